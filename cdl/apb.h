@@ -36,6 +36,19 @@ typedef struct {
     bit     perr;
 } t_apb_response;
 
+/*t t_apb_logging_control
+ *
+ * Filtering and sampling of the transfers logged by apb_logging; all
+ * zeros logs every transfer
+ */
+typedef struct {
+    bit[32] address_mask   "Mask of the address bits that must match address_match for a transfer to be logged";
+    bit[32] address_match  "Value of the masked address bits for a transfer to be logged";
+    bit     writes_only    "If set, only writes are logged";
+    bit     errors_only    "If set, only transfers with an error response (perr) are logged";
+    bit[16] sample_interval "If greater than one, only the first of every sample_interval transfers that pass the other filters is logged";
+} t_apb_logging_control;
+
 /*t t_apb_processor_response */
 typedef struct {
     bit acknowledge;
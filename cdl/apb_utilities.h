@@ -35,3 +35,20 @@ module apb_logging( clock clk         "System clock",
     timing to   rising clock clk apb_request;
     timing to   rising clock clk apb_response;
 }
+
+/*m apb_logging_filtered
+ *
+ */
+extern
+module apb_logging_filtered( clock clk         "System clock",
+                             input bit reset_n "Active low reset",
+
+                             input  t_apb_request  apb_request   "APB request",
+                             input   t_apb_response apb_response "APB response",
+                             input  t_apb_logging_control logging_control "Filtering and sampling of the transfers to log; all zeros logs every transfer"
+    )
+{
+    timing to   rising clock clk apb_request;
+    timing to   rising clock clk apb_response;
+    timing to   rising clock clk logging_control;
+}
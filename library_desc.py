@@ -15,6 +15,7 @@ class ApbModules(cdl_desc.Modules):
     export_dirs      = cdl_include_dirs + [ src_dir ]
     modules = []
     modules += [ CdlModule("apb_logging") ]
+    modules += [ CdlModule("apb_logging_filtered") ]
     modules += [ CdlModule("apb_master_mux") ]
     modules += [ CdlModule("apb_processor") ]
     modules += [ CdlModule("apb_script_master") ]
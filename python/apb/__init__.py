@@ -1,6 +1,18 @@
 from .rom import Rom
 from .script import Script
+from .rom_sim import RomSim
+from .rom_analysis import RomAnalysis
+from .script_analysis import ScriptAnalysis
+from .script_sim import ScriptSim
+from .sram_loader import SramLoader
+from .address_map_index import AddressMapIndex
+from .log_parser import ApbLogParser, ApbTrace
+from .stats import ApbStats
+from .profiler import HarnessProfiler
 from .target_fifo_sink import FifoSinkAddressMap
 from .target_sram_interface import SramInterfaceAddressMap
 __all__ = [Rom, Script]
+__all__ += [RomSim, ScriptSim, RomAnalysis, ScriptAnalysis]
+__all__ += [SramLoader, AddressMapIndex]
+__all__ += [ApbLogParser, ApbTrace, ApbStats, HarnessProfiler]
 __all__ += [FifoSinkAddressMap]
@@ -0,0 +1,136 @@
+#a Copyright
+#
+#  This file 'address_map_index.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from bisect import bisect_right
+from cdl.utils import csr
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+#a Classes
+#c AddressDecode
+class AddressDecode(object):
+    """
+    Decode of an APB address: the submap (dotted path of the MapMaps
+    from the top of the map, '' for the top level), the register (its
+    name, or None if the address is in a submap but not at or after a
+    register of it), the offset of the address from the register, and
+    the fields of the register as (lsb, width, name) with zero fields
+    omitted
+    """
+    address:int
+    submap:str
+    register:Optional[str]
+    offset:int
+    fields:List[Tuple[int,int,str]]
+    def __init__(self, address:int, submap:str, register:Optional[str], offset:int, fields:List[Tuple[int,int,str]]):
+        self.address = address
+        self.submap = submap
+        self.register = register
+        self.offset = offset
+        self.fields = fields
+        pass
+    #f path
+    def path(self) -> str:
+        """
+        Dotted name of the register (such as 'sram.data_window+5')
+        """
+        if self.register is None: name = "%s+0x%x"%(self.submap, self.offset)
+        elif self.submap=="": name = self.register
+        else: name = self.submap + "." + self.register
+        if (self.register is not None) and (self.offset!=0): name += "+%d"%self.offset
+        return name
+    #f decode_value
+    def decode_value(self, value:int) -> Dict[str,int]:
+        return {name:(value>>lsb) & ((1<<width)-1) for (lsb, width, name) in self.fields}
+    def __str__(self) -> str:
+        return "0x%08x: %s"%(self.address, self.path())
+    pass
+
+#c AddressMapIndex
+class AddressMapIndex(object):
+    """
+    Reverse decode of APB addresses of a composed csr.Map (such as the
+    ApbAddressMap of the tests) to submap, register and fields
+
+    The map is walked once (as ApbTargetBus.of_map walks it) to build a
+    dictionary of register addresses, and sorted arrays of register and
+    submap addresses. An address that is a register decodes with one
+    dictionary lookup; other addresses are decoded by bisection to the
+    register below them in the same submap (as for a windowed register
+    such as the SRAM data_window), and the decode is then memoized.
+    A submap is taken to decode the addresses up to the next power of
+    two above its highest register; an address of a submap beyond
+    that decodes with no register.
+    """
+    registers:Dict[int,AddressDecode]
+    #f __init__
+    def __init__(self, apb_map:Union[csr.Map,Type[csr.Map]], max_memoized:int=64*1024):
+        map_class = apb_map if isinstance(apb_map, type) else type(apb_map)
+        self.registers = {}
+        self.submaps : List[Tuple[int,str]] = []
+        self.submap_sizes : Dict[str,int] = {}
+        self.add_map(map_class, 0, "")
+        self.register_addresses = sorted(self.registers.keys())
+        self.submaps.sort()
+        self.submap_addresses = [a for (a,n) in self.submaps]
+        self.max_memoized = max_memoized
+        self.memoized : Dict[int,Optional[AddressDecode]] = {}
+        pass
+    #f add_map
+    def add_map(self, map_class:Type[csr.Map], base:int, path:str) -> None:
+        self.submaps.append((base, path))
+        self.submap_sizes[path] = 1 << max([0]+[m.reg for m in map_class._map if isinstance(m, csr.MapCsr)]).bit_length()
+        for m in map_class._map:
+            if isinstance(m, csr.MapMap):
+                self.add_map(m.map, base+m.offset, m.name if path=="" else path+"."+m.name)
+                pass
+            elif isinstance(m, csr.MapCsr):
+                fields = [(lsb, f.width, f.name) for (lsb, f) in sorted(m.csr._fields.items())
+                          if not isinstance(f, csr.CsrFieldZero)]
+                self.registers[base+m.reg] = AddressDecode(base+m.reg, path, m.name, 0, fields)
+                pass
+            pass
+        pass
+    #f decode
+    def decode(self, address:int) -> Optional[AddressDecode]:
+        """
+        Decode an address, returning None if it is below all the submaps
+        """
+        d = self.registers.get(address, None)
+        if d is not None: return d
+        if address in self.memoized: return self.memoized[address]
+        d = self.decode_slow(address)
+        if len(self.memoized)<self.max_memoized: self.memoized[address] = d
+        return d
+    #f decode_slow
+    def decode_slow(self, address:int) -> Optional[AddressDecode]:
+        i = bisect_right(self.submap_addresses, address) - 1
+        if i<0: return None
+        (submap_base, submap) = self.submaps[i]
+        j = bisect_right(self.register_addresses, address) - 1
+        if (j>=0) and (self.register_addresses[j]>=submap_base) and (address-submap_base<self.submap_sizes[submap]):
+            r = self.registers[self.register_addresses[j]]
+            if r.submap==submap:
+                return AddressDecode(address, submap, r.register, address-r.address, r.fields)
+            pass
+        return AddressDecode(address, submap, None, address-submap_base, [])
+    #f name
+    def name(self, address:int) -> str:
+        d = self.decode(address)
+        if d is None: return "0x%08x"%address
+        return d.path()
+    pass
@@ -0,0 +1,122 @@
+#a Copyright
+#
+#  This file 'batch.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+import importlib
+import json
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from .rom import Rom
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+#a Functions
+#f parse_defines
+def parse_defines(define_list:List[str]) -> Dict[str,Union[bool,str]]:
+    """
+    Convert a list of 'name' or 'name=value' strings (as given by --define) to a dictionary
+    """
+    defines : Dict[str,Union[bool,str]] = {}
+    dre = re.compile(r"(.*)=(.*)")
+    for d in define_list:
+        m = dre.match(d)
+        if m is None:
+            defines[d] = True
+            pass
+        else:
+            defines[m.group(1)] = m.group(2)
+            pass
+        pass
+    return defines
+
+#f compile_entry
+def compile_entry(entry:Dict[str,Any], cache_dir:Optional[str]=None, cache_size:int=64) -> Dict[str,Any]:
+    """
+    Compile one manifest entry and write its outputs, returning a summary of it
+
+    An entry is a dictionary with 'src' (the module with the program
+    function), optional 'define' (a list of 'name=value' strings, or a
+    dictionary), and optional 'mif', 'mem' and 'bin' output filenames.
+    """
+    t0 = time.perf_counter()
+    defines = entry.get("define", [])
+    if type(defines)==list: defines = parse_defines(defines)
+    cached = False
+    if cache_dir is not None:
+        from .compile_cache import CompileCache
+        cache = CompileCache(cache_dir, max_bytes=cache_size*1024*1024)
+        compilation = cache.compile_module(entry["src"], defines)
+        cached = cache.hits>0
+        pass
+    else:
+        m = importlib.import_module(entry["src"])
+        compilation = Rom.compile_program(m.program(Rom, defines))
+        pass
+    t1 = time.perf_counter()
+    if entry.get("mif",None) is not None: Rom.mif_of_compilation(compilation, filename=entry["mif"])
+    if entry.get("mem",None) is not None: Rom.mem_of_compilation(compilation, filename=entry["mem"])
+    if entry.get("bin",None) is not None: Rom.bin_of_compilation(compilation, filename=entry["bin"])
+    t2 = time.perf_counter()
+    return {"src":entry["src"],
+            "define":defines,
+            "words":len(compilation.image),
+            "cached":cached,
+            "compile_time":t1-t0,
+            "write_time":t2-t1,
+            }
+
+#f run_batch
+def run_batch(manifest_filename:str, jobs:Optional[int]=None, cache_dir:Optional[str]=None, cache_size:int=64) -> List[Dict[str,Any]]:
+    """
+    Compile all the entries of a JSON manifest (a list of entries as
+    for compile_entry) across a pool of processes, and print a timing
+    summary of each entry
+
+    An entry that fails does not stop the batch; its result is the
+    src, define and error (the exception as a string) of the entry,
+    and it is reported as FAILED in the summary.
+    """
+    with open(manifest_filename) as f:
+        manifest = json.load(f)
+        pass
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(compile_entry, entry, cache_dir, cache_size) for entry in manifest]
+        results = []
+        for (entry, f) in zip(manifest, futures):
+            try:
+                results.append(f.result())
+                pass
+            except Exception as e:
+                results.append({"src":entry.get("src",None), "define":entry.get("define",[]), "error":str(e)})
+                pass
+            pass
+        pass
+    elapsed = time.perf_counter() - t0
+    failed = [r for r in results if "error" in r]
+    for r in results:
+        if "error" in r:
+            print("%-32s FAILED %s (define %s)"%(r["src"], r["error"], str(r["define"])))
+            continue
+        defines = " ".join(["%s=%s"%(k,str(v)) for (k,v) in sorted(r["define"].items())])
+        print("%-32s %6d words %8.1fms compile %8.1fms write%s %s"%(
+            r["src"], r["words"], 1000*r["compile_time"], 1000*r["write_time"],
+            " (cached)" if r["cached"] else "", defines))
+        pass
+    total = sum([r["compile_time"]+r["write_time"] for r in results if "error" not in r])
+    print("%d entries in %.1fms (%.1fms total across processes), %d failed"%(len(results), 1000*elapsed, 1000*total, len(failed)))
+    return results
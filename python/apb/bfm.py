@@ -16,10 +16,38 @@
 #
 
 #a Imports
+from array import array
 from .structs import t_apb_request, t_apb_response
+from .models  import ApbTargetModel
+from .rom_sim import RomSim
 from cdl.utils   import csr
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+#a Functions
+#f word_view
+def word_view(buffer:Any) -> memoryview:
+    """
+    Return a memoryview of 32-bit words onto any C-contiguous buffer
+    (bytes, array('I'), numpy uint32 array, ...) without copying it
+    """
+    return memoryview(buffer).cast("B").cast("I")
 
 #a Test classes
+#c ApbRecorders
+class ApbRecorders(object):
+    """
+    Fan-out of the transfers of an ApbMaster to more than one recorder
+    """
+    def __init__(self, recorders:List[Any]):
+        self.recorders = recorders
+        pass
+    def record(self, timestamp:int, write_not_read:int, address:int, data:int, err:int, wait_cycles:int) -> None:
+        for r in self.recorders:
+            r.record(timestamp, write_not_read, address, data, err, wait_cycles)
+            pass
+        pass
+    pass
+
 #c ApbReg
 class ApbReg(object):
     def __init__(self, apb:'ApbMaster', reg:csr.Csr):
@@ -34,6 +62,23 @@ class ApbReg(object):
 
 #c ApbMaster
 class ApbMaster(object):
+    """
+    Signal-level APB master for test harnesses
+
+    Single transfers are performed by read and write; transfers may
+    also be queued and then performed by flush, without returning to
+    the caller between them. Every transfer takes the APB minimum of a
+    select and an enable cycle plus its wait cycles, whether queued or
+    not: a single transfer also starts in the cycle that the previous
+    one completes, if the caller does not wait between them. Queueing
+    reduces the Python work per transfer, not the bus cycles.
+
+    The transfers, bus cycles (with psel asserted) and wait cycles are
+    counted for the bandwidth report; the transfers may also be
+    recorded to a trace writer (see record_trace) and collected as
+    statistics (see record_stats).
+    """
+    pending:List[Tuple[int,int,int]]
     def __init__(self, th:object, request_name:str, response_name:str):
         self.th = th
         for k in t_apb_request:
@@ -47,40 +92,254 @@ class ApbMaster(object):
         self.paddr.drive(0)
         self.pwdata.drive(0)
         self.pwrite.drive(0)
+        self.pending = []
+        self.reset_bandwidth()
+        self.recorders = {}
+        self.record_trace(None)
+        pass
+    #f record_trace
+    def record_trace(self, writer:Optional[Any], timestamp:Optional[Callable[[],int]]=None) -> None:
+        """
+        Record every transfer (when it completes) to a trace writer,
+        such as a trace_file.TraceWriter, or stop recording if writer
+        is None; the timestamp of a transfer is given by timestamp, by
+        default the global cycle of the test harness
+        """
+        if timestamp is None: timestamp = lambda : self.th.global_cycle()
+        self.timestamp = timestamp
+        self.set_recorder("trace", writer)
+        pass
+    #f record_stats
+    def record_stats(self, stats:Optional[Any]) -> None:
+        """
+        Collect statistics of every transfer in stats, such as an
+        stats.ApbStats, or stop collecting if stats is None
+        """
+        self.set_recorder("stats", stats)
         pass
+    #f set_recorder
+    def set_recorder(self, kind:str, recorder:Optional[Any]) -> None:
+        if recorder is None:
+            self.recorders.pop(kind, None)
+            pass
+        else:
+            self.recorders[kind] = recorder
+            pass
+        recorders = list(self.recorders.values())
+        self.recorder = None
+        if len(recorders)==1: self.recorder = recorders[0]
+        if len(recorders)>1: self.recorder = ApbRecorders(recorders)
+        pass
+    #f reset_bandwidth
+    def reset_bandwidth(self) -> None:
+        self.bus_transfers = 0
+        self.bus_cycles = 0
+        self.bus_wait_cycles = 0
+        pass
+    #f bandwidth
+    def bandwidth(self) -> Dict[str,float]:
+        """
+        Return the bandwidth achieved by the transfers since the last
+        reset_bandwidth, with the cycles that the apb_processor would
+        need for the same transfers (it fetches and executes an
+        instruction per transfer, and always has an idle cycle between
+        them)
+        """
+        transfers = self.bus_transfers
+        cycles = self.bus_cycles
+        processor_cycles = transfers * (RomSim.fetch_cycles + RomSim.execute_cycles + RomSim.apb_cycles) + self.bus_wait_cycles
+        r = {"transfers":transfers,
+             "cycles":cycles,
+             "wait_cycles":self.bus_wait_cycles,
+             "cycles_per_transfer":0.0,
+             "bytes_per_cycle":0.0,
+             "processor_cycles":processor_cycles,
+             "processor_bytes_per_cycle":0.0,
+             }
+        if transfers>0:
+            r["cycles_per_transfer"] = cycles / transfers
+            r["bytes_per_cycle"] = 4.0 * transfers / cycles
+            r["processor_bytes_per_cycle"] = 4.0 * transfers / processor_cycles
+            pass
+        return r
+    #f bandwidth_report
+    def bandwidth_report(self) -> str:
+        b = self.bandwidth()
+        return ("%d transfers in %d cycles (%d wait): %.2f cycles per transfer, %.3f bytes per cycle; "+
+                "apb_processor would take %d cycles, %.3f bytes per cycle")%(
+                    b["transfers"], b["cycles"], b["wait_cycles"],
+                    b["cycles_per_transfer"], b["bytes_per_cycle"],
+                    b["processor_cycles"], b["processor_bytes_per_cycle"])
     #f reg
     def reg(self, reg):
         return ApbReg(self, reg)
     #f transaction
     def transaction(self, write_not_read, address, data):
-        self.psel.drive(1)
-        self.penable.drive(0)
-        self.paddr.drive(address)
-        self.pwdata.drive(data)
-        self.pwrite.drive(write_not_read)
-        self.th.bfm_wait(1)
-        self.penable.drive(1)
-        self.th.bfm_wait(1)
-        while self.pready.value()==0:
-            self.th.bfm_wait(1)
+        return self.transactions([(write_not_read, address, data)])[0]
+    #f queue
+    def queue(self, write_not_read:int, address:int, data:int=0) -> None:
+        self.pending.append((write_not_read, address, data))
+        pass
+    #f queue_write
+    def queue_write(self, address:int, data:int) -> None:
+        self.pending.append((1, address, data))
+        pass
+    #f queue_read
+    def queue_read(self, address:int) -> None:
+        self.pending.append((0, address, 0xdeadbeef))
+        pass
+    #f flush
+    def flush(self, allow_error:bool=False) -> List[Tuple[int,int]]:
+        """
+        Perform all the queued transfers, and return their (err,
+        read_data) in order
+        """
+        requests = self.pending
+        self.pending = []
+        results = self.transactions(requests)
+        if not allow_error:
+            for (err, read_data) in results:
+                if err:
+                    self.th.failtest("Expected apb error response of 0")
+                    break
+                pass
             pass
-        self.psel.drive(0)
-        read_data = self.prdata.value()
-        err       = self.perr.value()
-        return (err, read_data)
+        return results
+    #f transactions
+    def transactions(self, requests:Iterable[Tuple[int,int,int]]) -> List[Tuple[int,int]]:
+        """
+        Perform (write_not_read, address, data) transfers and return
+        their (err, read_data)
+
+        psel is held asserted from the enable phase of one transfer to
+        the select phase of the next, so each takes two cycles plus its
+        wait cycles.
+        """
+        (psel, penable, paddr, pwdata, pwrite, prdata, pready, perr) = (
+            self.psel, self.penable, self.paddr, self.pwdata, self.pwrite, self.prdata, self.pready, self.perr)
+        bfm_wait = self.th.bfm_wait
+        recorder = self.recorder
+        results = []
+        wait_cycles = 0
+        psel.drive(1)
+        for (write_not_read, address, data) in requests:
+            penable.drive(0)
+            paddr.drive(address)
+            pwdata.drive(data)
+            pwrite.drive(write_not_read)
+            bfm_wait(1)
+            penable.drive(1)
+            bfm_wait(1)
+            w = 0
+            while pready.value()==0:
+                bfm_wait(1)
+                w += 1
+                pass
+            wait_cycles += w
+            (err, read_data) = (perr.value(), prdata.value())
+            results.append((err, read_data))
+            if recorder is not None: recorder.record(self.timestamp(), write_not_read, address, data if write_not_read else read_data, err, w)
+            pass
+        psel.drive(0)
+        penable.drive(0)
+        self.bus_transfers += len(results)
+        self.bus_cycles += 2*len(results) + wait_cycles
+        self.bus_wait_cycles += wait_cycles
+        return results
     #f write
     def write(self, address, data, allow_error=False):
         (err, data) = self.transaction(1, address, data)
         if err and not allow_error:
-            th.failtest("Expected apb error response of 0")
+            self.th.failtest("Expected apb error response of 0")
             pass
         pass
     #f read
     def read(self, address, allow_error=False):
         (err, data) = self.transaction(0, address, 0xdeadbeef)
         if err and not allow_error:
-            th.failtest("Expected apb error response of 0")
+            self.th.failtest("Expected apb error response of 0")
             pass
         return data
+    #f write_block
+    def write_block(self, address:int, buffer:Any, stride:int=1, allow_error:bool=False) -> int:
+        """
+        Write the 32-bit words of a buffer to address, address+stride,
+        ... (a stride of 0 writes them all to the same address, such as
+        an SRAM data_inc register)
+
+        The transfers are performed by transactions, and errors are
+        checked once at the end; the number of errored transfers is
+        returned.
+        """
+        words = word_view(buffer)
+        results = self.transactions((1, address+i*stride, d) for (i,d) in enumerate(words))
+        errors = sum([err for (err, read_data) in results])
+        if errors and not allow_error:
+            self.th.failtest("Expected apb error response of 0 for %d block write transfers"%errors)
+            pass
+        return errors
+    #f read_block
+    def read_block(self, address:int, count:int, stride:int=1, out:Optional[Any]=None, allow_error:bool=False) -> Any:
+        """
+        Read count 32-bit words from address, address+stride, ... (a
+        stride of 0 reads them all from the same address) into out, if
+        given (any writable buffer of at least count words, such as a
+        numpy uint32 array), or into a new array('I')
+
+        The transfers are performed by transactions as for write_block;
+        the buffer is returned.
+        """
+        if out is None: out = array("I", bytes(4*count))
+        words = word_view(out)
+        results = self.transactions((0, address+i*stride, 0xdeadbeef) for i in range(count))
+        errors = 0
+        for (i, (err, read_data)) in enumerate(results):
+            words[i] = read_data
+            errors += err
+            pass
+        if errors and not allow_error:
+            self.th.failtest("Expected apb error response of 0 for %d block read transfers"%errors)
+            pass
+        return out
     pass
 
+#c ApbModelMaster
+class ApbModelMaster(ApbMaster):
+    """
+    Transaction-level alternative to ApbMaster, with the same
+    read/write/reg API, that performs transfers directly on a target
+    model (such as an ApbTargetBus built from the address map) without
+    driving any signals or waiting for simulation time
+
+    The cycles that the transfers would take on the bus are counted
+    in @a cycle, which is also the time presented to the models.
+    """
+    def __init__(self, th:object, target:ApbTargetModel):
+        self.th = th
+        self.target = target
+        self.cycle = 0
+        self.pending = []
+        self.reset_bandwidth()
+        self.recorders = {}
+        self.record_trace(None)
+        pass
+    #f record_trace
+    def record_trace(self, writer:Optional[Any], timestamp:Optional[Callable[[],int]]=None) -> None:
+        if timestamp is None: timestamp = lambda : self.cycle
+        super(ApbModelMaster,self).record_trace(writer, timestamp)
+        pass
+    #f transaction
+    def transaction(self, write_not_read, address, data):
+        (err, read_data, wait_cycles) = self.target.transaction(self.cycle, write_not_read, address, data)
+        self.cycle += 2 + wait_cycles
+        self.bus_transfers += 1
+        self.bus_cycles += 2 + wait_cycles
+        self.bus_wait_cycles += wait_cycles
+        if self.recorder is not None:
+            self.recorder.record(self.timestamp(), write_not_read, address, data if write_not_read else read_data, err, wait_cycles)
+            pass
+        return (err, read_data)
+    #f transactions
+    def transactions(self, requests:Iterable[Tuple[int,int,int]]) -> List[Tuple[int,int]]:
+        return [ self.transaction(w,a,d) for (w,a,d) in requests ]
+    pass
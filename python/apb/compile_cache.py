@@ -0,0 +1,228 @@
+#a Copyright
+#
+#  This file 'compile_cache.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+import ast
+import hashlib
+import importlib
+import importlib.machinery
+import json
+import os
+import sys
+from .rom import Rom, CompiledProgam
+from typing import Dict, List, Optional, Set, Union
+
+#a Functions
+#f find_module_spec
+def find_module_spec(name:str) -> Optional[importlib.machinery.ModuleSpec]:
+    """
+    Find the spec of a module without importing it or its parent
+    packages (importlib.util.find_spec imports the parents), by
+    finding each package of its name on the search path of the last
+
+    A module that has already been imported gives its own spec.
+    Returns None if the module is not found on the path (including
+    builtin modules).
+    """
+    module = sys.modules.get(name, None)
+    if getattr(module, "__spec__", None) is not None: return module.__spec__
+    parts = name.split(".")
+    path = None
+    spec = None
+    for i in range(len(parts)):
+        if (i>0) and (spec.submodule_search_locations is None): return None
+        spec = importlib.machinery.PathFinder.find_spec(".".join(parts[:i+1]), path)
+        if spec is None: return None
+        path = spec.submodule_search_locations
+        pass
+    return spec
+
+#f module_files
+def module_files(module_name:str) -> List[str]:
+    """
+    Find the source files of a module and of the modules that it
+    imports (transitively), without importing any of them
+
+    Modules from the Python installation (standard library and site
+    packages) and those that have no Python source are not included.
+    """
+    system_prefixes = tuple(set([os.path.abspath(p)+os.sep for p in [sys.prefix, sys.base_prefix, sys.exec_prefix]]))
+    files : List[str] = []
+    visited : Set[str] = set()
+    to_visit = [module_name]
+    while len(to_visit)>0:
+        name = to_visit.pop()
+        if name in visited: continue
+        visited.add(name)
+        if "." in name: to_visit.append(name.rpartition(".")[0])
+        spec = find_module_spec(name)
+        if (spec is None) or (spec.origin is None): continue
+        origin = os.path.abspath(spec.origin)
+        if not origin.endswith(".py"): continue
+        if origin.startswith(system_prefixes): continue
+        files.append(origin)
+        with open(origin,"rb") as f:
+            tree = ast.parse(f.read(), filename=origin)
+            pass
+        package = name if spec.submodule_search_locations is not None else name.rpartition(".")[0]
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                to_visit.extend([a.name for a in node.names])
+                pass
+            elif isinstance(node, ast.ImportFrom):
+                base = node.module or ""
+                if node.level>0:
+                    parts = package.split(".")
+                    parts = parts[:len(parts)-(node.level-1)]
+                    base = ".".join(parts + ([base] if base else []))
+                    pass
+                if base: to_visit.append(base)
+                to_visit.extend([base+"."+a.name for a in node.names if base])
+                pass
+            pass
+        pass
+    return sorted(files)
+
+#a Classes
+#c CompileCache
+class CompileCache(object):
+    """
+    On-disk cache of ROM compilations, keyed by the content of the
+    program source (and its imports), the defines, and the assembler
+
+    Each entry is a packed binary image (as Rom.write_bin) and a JSON
+    file of the base address and labels, named by the key. Entries are
+    evicted, least recently used first, when the cache exceeds
+    max_bytes; a hit refreshes the modification time of an entry.
+    """
+    #v assembler_files - the sources that determine the compiled output
+    assembler_files = [os.path.join(os.path.dirname(os.path.abspath(__file__)),f) for f in ["rom.py", "compile_cache.py"]]
+    #f __init__
+    def __init__(self, cache_dir:str, max_bytes:int=64*1024*1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        pass
+    #f assembler_version
+    @classmethod
+    def assembler_version(cls) -> str:
+        h = hashlib.sha256()
+        for f in cls.assembler_files:
+            with open(f,"rb") as fh:
+                h.update(fh.read())
+                pass
+            pass
+        return h.hexdigest()
+    #f key
+    def key(self, module_name:str, defines:Dict[str,Union[bool,str]]) -> str:
+        h = hashlib.sha256()
+        h.update(self.assembler_version().encode())
+        h.update(module_name.encode())
+        h.update(json.dumps(defines, sort_keys=True).encode())
+        for f in module_files(module_name):
+            with open(f,"rb") as fh:
+                h.update(f.encode())
+                h.update(fh.read())
+                pass
+            pass
+        return h.hexdigest()
+    #f entry_filenames
+    def entry_filenames(self, key:str) -> List[str]:
+        return [os.path.join(self.cache_dir, key+".bin"), os.path.join(self.cache_dir, key+".json")]
+    #f get
+    def get(self, key:str) -> Optional[CompiledProgam]:
+        (bin_filename, json_filename) = self.entry_filenames(key)
+        try:
+            with open(json_filename) as f:
+                desc = json.load(f)
+                pass
+            image = Rom.image_of_bin(bin_filename)
+            pass
+        except (OSError, ValueError):
+            return None
+        compiled = CompiledProgam()
+        compiled.base_address = desc["base_address"]
+        compiled.labels = desc["labels"]
+        compiled.image = image
+        for f in (bin_filename, json_filename):
+            os.utime(f)
+            pass
+        return compiled
+    #f put
+    def put(self, key:str, compiled:CompiledProgam) -> None:
+        (bin_filename, json_filename) = self.entry_filenames(key)
+        tmp_suffix = ".%d.tmp"%os.getpid()
+        with open(bin_filename+tmp_suffix,"wb") as f:
+            Rom.write_bin(compiled, f)
+            pass
+        with open(json_filename+tmp_suffix,"w") as f:
+            json.dump({"base_address":compiled.base_address, "labels":compiled.labels}, f)
+            pass
+        os.replace(bin_filename+tmp_suffix, bin_filename)
+        os.replace(json_filename+tmp_suffix, json_filename)
+        self.evict()
+        pass
+    #f evict
+    def evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in max_bytes
+        """
+        entries : Dict[str,List[float]] = {}
+        for f in os.listdir(self.cache_dir):
+            (key, ext) = os.path.splitext(f)
+            if ext not in [".bin", ".json"]: continue
+            try:
+                st = os.stat(os.path.join(self.cache_dir, f))
+                pass
+            except OSError:
+                continue
+            if key not in entries: entries[key] = [0.0, 0]
+            entries[key][0] = max(entries[key][0], st.st_mtime)
+            entries[key][1] += st.st_size
+            pass
+        total = sum([e[1] for e in entries.values()])
+        for key in sorted(entries.keys(), key=lambda k:entries[k][0]):
+            if total<=self.max_bytes: break
+            for f in self.entry_filenames(key):
+                try:
+                    os.remove(f)
+                    pass
+                except OSError:
+                    pass
+                pass
+            total -= entries[key][1]
+            pass
+        pass
+    #f compile_module
+    def compile_module(self, module_name:str, defines:Dict[str,Union[bool,str]]) -> CompiledProgam:
+        """
+        Return the compilation of module_name.program(Rom, defines),
+        from the cache if possible
+        """
+        key = self.key(module_name, defines)
+        compiled = self.get(key)
+        if compiled is not None:
+            self.hits += 1
+            return compiled
+        self.misses += 1
+        m = importlib.import_module(module_name)
+        compiled = Rom.compile_program(m.program(Rom, defines))
+        self.put(key, compiled)
+        return compiled
+    pass
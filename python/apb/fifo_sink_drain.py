@@ -0,0 +1,116 @@
+#a Copyright
+#
+#  This file 'fifo_sink_drain.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from array import array
+from .bfm import ApbMaster, word_view
+from typing import Any, Callable, Iterator
+
+#a Classes
+#c FifoSinkDrainer
+class FifoSinkDrainer(object):
+    """
+    Drain whole entries from an apb_target_fifo_sink through an
+    ApbMaster (or ApbModelMaster)
+
+    The FIFO status is read once per batch, and the whole entries that
+    it reports are then read back-to-back from fifo_data, rather than
+    checking the status for every word. The fifo_status register
+    presents the status of whichever FIFO feeds the sink, so
+    entries_of_status must convert a value of it to the number of whole
+    entries in the FIFO not yet started to be read.
+    """
+    #f __init__
+    def __init__(self, apb:ApbMaster, fifo_sink:Any, entries_of_status:Callable[[int],int]):
+        self.apb = apb
+        self.config_status_reg = fifo_sink.config_status.Address()
+        self.fifo_status_reg   = fifo_sink.fifo_status.Address()
+        self.fifo_data_reg     = fifo_sink.fifo_data.Address()
+        self.entries_of_status = entries_of_status
+        self.words_per_entry = (apb.read(self.config_status_reg) & 7) + 1
+        self.entries_drained = 0
+        pass
+    #f configure
+    def configure(self, words_per_entry:int) -> None:
+        """
+        Set the number of 32-bit words (1 to 8) per FIFO entry, and clear the status
+        """
+        self.apb.write(self.config_status_reg, (words_per_entry-1) & 7)
+        self.words_per_entry = words_per_entry
+        pass
+    #f frames
+    def frames(self, max_batch:int=64, until_empty:bool=True) -> Iterator[memoryview]:
+        """
+        Generate the entries of the FIFO as memoryviews of their bytes
+        (the 32-bit words in host order)
+
+        Each batch reads the FIFO status, then up to max_batch entries
+        into a buffer; the frames of a batch are views onto that
+        buffer, so are only valid until the next batch is read (use
+        bytes(frame) to keep one). If until_empty then batches are read
+        until the FIFO has no whole entries, otherwise just one batch is
+        read.
+        """
+        frame_bytes = 4*self.words_per_entry
+        buffer = array("I", bytes(frame_bytes*max_batch))
+        view = memoryview(buffer).cast("B")
+        while True:
+            n = min(max_batch, self.entries_of_status(self.apb.read(self.fifo_status_reg)))
+            if n==0: return
+            self.apb.read_block(self.fifo_data_reg, n*self.words_per_entry, stride=0, out=buffer)
+            for i in range(n):
+                yield view[i*frame_bytes:(i+1)*frame_bytes]
+                pass
+            self.entries_drained += n
+            if not until_empty: return
+            pass
+        pass
+    #f dprintf_payload
+    @staticmethod
+    def dprintf_payload(frame:Any) -> bytes:
+        """
+        Convert a frame of a dprintf FIFO entry back to the bytes of the
+        dprintf data, up to the first zero byte
+
+        The entry holds the 64-bit dprintf data words in order, each as
+        its low 32 bits followed by its high 32 bits, with the bytes of
+        a data word most significant first. Only whole data words are
+        recovered: with an odd number of words per entry the last word
+        is the low half of a data word whose high half (the bytes that
+        precede it) is not in the entry, so it is dropped. Hence an
+        entry of n words recovers the first 8*(n//2) bytes of the
+        dprintf; 8 words per entry recovers all of a t_dprintf_req_4.
+        """
+        words = word_view(frame)
+        data = bytearray()
+        for i in range(0, len(words)-1, 2):
+            data += words[i+1].to_bytes(4,"big")
+            data += words[i].to_bytes(4,"big")
+            pass
+        end = data.find(0)
+        if end>=0: del data[end:]
+        return bytes(data)
+    #f dprintf_messages
+    def dprintf_messages(self, max_batch:int=64, until_empty:bool=True) -> Iterator[bytes]:
+        """
+        Generate the payloads of the dprintf entries drained from the FIFO
+        """
+        for frame in self.frames(max_batch=max_batch, until_empty=until_empty):
+            yield self.dprintf_payload(frame)
+            pass
+        pass
+    pass
@@ -0,0 +1,233 @@
+#a Copyright
+#
+#  This file 'log_parser.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+import re
+from array import array
+from .address_map_index import AddressMapIndex
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Tuple, Union
+
+try:
+    import numpy
+    pass
+except ImportError:
+    numpy = None
+    pass
+
+#a Classes
+#c ApbTrace
+class ApbTrace(object):
+    """
+    Columnar trace of completed APB transfers: cycle, rw (1 for a
+    write, 0 for a read), address and data
+
+    The columns are numpy arrays if numpy is available (views onto the
+    arrays that they were built in, without copying), otherwise arrays
+    of the array module.
+    """
+    cycle:Any
+    rw:Any
+    address:Any
+    data:Any
+    #f __init__
+    def __init__(self, cycle:array, rw:array, address:array, data:array):
+        if numpy is not None:
+            self.cycle   = numpy.frombuffer(cycle,   dtype=numpy.uint64) if len(cycle)>0 else numpy.zeros(0, dtype=numpy.uint64)
+            self.rw      = numpy.frombuffer(rw,      dtype=numpy.uint8)  if len(rw)>0 else numpy.zeros(0, dtype=numpy.uint8)
+            self.address = numpy.frombuffer(address, dtype=numpy.uint32) if len(address)>0 else numpy.zeros(0, dtype=numpy.uint32)
+            self.data    = numpy.frombuffer(data,    dtype=numpy.uint32) if len(data)>0 else numpy.zeros(0, dtype=numpy.uint32)
+            pass
+        else:
+            (self.cycle, self.rw, self.address, self.data) = (cycle, rw, address, data)
+            pass
+        pass
+    def __len__(self) -> int:
+        return len(self.cycle)
+    #f register_counts
+    def register_counts(self, index:AddressMapIndex) -> Dict[str,Tuple[int,int]]:
+        """
+        Count the (reads, writes) of each register of an address map
+        (by its AddressDecode path); each distinct address is decoded once
+        """
+        counts : Dict[int,List[int]] = {}
+        if numpy is not None:
+            for rw in [0,1]:
+                (addresses, n) = numpy.unique(self.address[self.rw==rw], return_counts=True)
+                for (a, c) in zip(addresses.tolist(), n.tolist()):
+                    counts.setdefault(a,[0,0])[rw] += c
+                    pass
+                pass
+            pass
+        else:
+            for (a, rw) in zip(self.address, self.rw):
+                counts.setdefault(a,[0,0])[rw] += 1
+                pass
+            pass
+        result : Dict[str,Tuple[int,int]] = {}
+        for (a, (r, w)) in counts.items():
+            name = index.name(a)
+            (pr, pw) = result.get(name,(0,0))
+            result[name] = (pr+r, pw+w)
+            pass
+        return result
+    #f bandwidth
+    def bandwidth(self, window_cycles:int) -> List[Tuple[int,int,int]]:
+        """
+        Count the (reads, writes) completing in each window of
+        window_cycles cycles, returning (window start cycle, reads,
+        writes) for each window from cycle zero to the latest transfer
+        """
+        if len(self)==0: return []
+        if numpy is not None:
+            windows = (self.cycle // numpy.uint64(window_cycles)).astype(numpy.int64)
+            n = int(windows.max()) + 1
+            writes = numpy.bincount(windows, weights=self.rw, minlength=n).astype(int)
+            total = numpy.bincount(windows, minlength=n)
+            return [(i*window_cycles, int(t-w), int(w)) for (i,(t,w)) in enumerate(zip(total.tolist(), writes.tolist()))]
+        n = max(self.cycle)//window_cycles + 1
+        counts = [[0,0] for i in range(n)]
+        for (c, rw) in zip(self.cycle, self.rw):
+            counts[c//window_cycles][rw] += 1
+            pass
+        return [(i*window_cycles, r, w) for (i,(r,w)) in enumerate(counts)]
+    #f read_latency
+    def read_latency(self, index:Optional[AddressMapIndex]=None) -> Dict[str,Tuple[int,float,int,int]]:
+        """
+        Summarize the latency of reads as (count, mean, min, max) per
+        register (by name if an index is given, else by address), and
+        for all reads as '*'
+
+        The log records only the completion of each transfer, so the
+        latency of a read is taken to be the cycles since the previous
+        transfer completed; this is the duration of the read (select,
+        enable and wait cycles) when the bus is kept busy, and an upper
+        bound on it otherwise.
+        """
+        if len(self)<2: return {}
+        if numpy is not None:
+            latency = numpy.diff(self.cycle.astype(numpy.int64))
+            reads = numpy.flatnonzero(self.rw[1:]==0)
+            latency = latency[reads]
+            addresses = self.address[1:][reads]
+            groups : Dict[Any,Any] = {"*":latency}
+            for a in numpy.unique(addresses).tolist():
+                groups[a] = latency[addresses==a]
+                pass
+            by_key = {k:(len(l), float(l.mean()), int(l.min()), int(l.max())) for (k,l) in groups.items() if len(l)>0}
+            pass
+        else:
+            lists : Dict[Any,List[int]] = {"*":[]}
+            for i in range(1, len(self)):
+                if self.rw[i]: continue
+                l = self.cycle[i] - self.cycle[i-1]
+                lists["*"].append(l)
+                lists.setdefault(self.address[i],[]).append(l)
+                pass
+            by_key = {k:(len(l), sum(l)/len(l), min(l), max(l)) for (k,l) in lists.items() if len(l)>0}
+            pass
+        if index is None: return {(k if k=="*" else "0x%08x"%k):v for (k,v) in by_key.items()}
+        result : Dict[str,Tuple[int,float,int,int]] = {}
+        for (k, (n, mean, lo, hi)) in by_key.items():
+            name = k if k=="*" else index.name(k)
+            if name in result:
+                (pn, pmean, plo, phi) = result[name]
+                (n, mean, lo, hi) = (pn+n, (pn*pmean+n*mean)/(pn+n), min(plo,lo), max(phi,hi))
+                pass
+            result[name] = (n, mean, lo, hi)
+            pass
+        return result
+    pass
+
+#c ApbLogParser
+class ApbLogParser(object):
+    """
+    Streaming parser of the 'APB write' and 'APB read' events of
+    apb_logging in simulation log files
+
+    Log lines are of the form
+
+      <cycle>: <hierarchy>: APB write address <address> data <data>
+
+    A log line is taken to be an event if it contains 'APB write' or
+    'APB read' followed by 'address' and 'data' values (in hex, with or
+    without a 0x prefix, separated from their names by any of ':',
+    '=', ',' or spaces); the cycle is the decimal timestamp field at
+    the start of the line, ended by a ':', ',' or space (or the number
+    of the event if the line has none). Digits elsewhere on the line,
+    such as in the hierarchy name of the logger, are not taken as the
+    cycle. Files are read a line at a time, and the columns are
+    accumulated in arrays, so the whole log is never held in memory.
+    Lines that are not events are counted as skipped.
+    """
+    line_re = re.compile(r"^\s*(?:(\d+)[\s:,])?.*?APB (write|read)\W+address[\s:=,]+(?:0x)?([0-9a-fA-F]+)\W+data[\s:=,]+(?:0x)?([0-9a-fA-F]+)")
+    #f __init__
+    def __init__(self):
+        self.cycle   = array("Q")
+        self.rw      = array("B")
+        self.address = array("I")
+        self.data    = array("I")
+        self.lines_skipped = 0
+        pass
+    #f parse_lines
+    def parse_lines(self, lines:Iterable[str]) -> None:
+        (cycle, rw, address, data) = (self.cycle, self.rw, self.address, self.data)
+        match = self.line_re.match
+        n = len(cycle)
+        for l in lines:
+            if "APB " not in l:
+                self.lines_skipped += 1
+                continue
+            m = match(l)
+            if m is None:
+                self.lines_skipped += 1
+                continue
+            (c, kind, a, d) = m.groups()
+            cycle.append(int(c) if c is not None else n)
+            rw.append(1 if kind=="write" else 0)
+            address.append(int(a,16) & 0xffffffff)
+            data.append(int(d,16) & 0xffffffff)
+            n += 1
+            pass
+        pass
+    #f parse_file
+    def parse_file(self, f:Union[str,IO[str]]) -> None:
+        if type(f)==str:
+            with open(f) as fh:
+                self.parse_lines(fh)
+                pass
+            return
+        self.parse_lines(f)
+        pass
+    #f trace
+    def trace(self) -> ApbTrace:
+        """
+        Return the trace of the events parsed; with numpy its columns
+        share the arrays of the parser, so no more lines may be parsed
+        """
+        return ApbTrace(self.cycle, self.rw, self.address, self.data)
+    #f parse
+    @classmethod
+    def parse(cls, *files:Union[str,IO[str]]) -> ApbTrace:
+        """
+        Parse log files (filenames or open files) in turn into a trace
+        """
+        parser = cls()
+        for f in files:
+            parser.parse_file(f)
+            pass
+        return parser.trace()
+    pass
@@ -0,0 +1,107 @@
+#a Copyright
+#
+#  This file 'logging_control.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from .structs import t_apb_logging_control
+from typing import Any, Dict, Iterable, List, Tuple
+
+#a Classes
+#c ApbLoggingControl
+class ApbLoggingControl(object):
+    """
+    Value of the logging control input of apb_logging_filtered (a
+    t_apb_logging_control), from a filter configuration dictionary:
+
+    window - (base, size) of the addresses to log, size a power of two and base a multiple of it
+    writes_only - if True, log only writes
+    errors_only - if True, log only transfers with an error response
+    sample - log only one in this many of the transfers that pass the other filters
+
+    An empty configuration logs every transfer.
+
+    A harness 'loggers' dictionary may give the configuration as the
+    'filter' of a logger; of_loggers removes the filters (for the
+    simulation logger configuration) and combines them.
+    """
+    #f __init__
+    def __init__(self, config:Dict[str,Any]={}):
+        self.address_mask = 0
+        self.address_match = 0
+        if "window" in config:
+            (base, size) = config["window"]
+            if size<=0 or (size & (size-1))!=0 or (base & (size-1))!=0:
+                raise Exception("APB logging window (0x%x, 0x%x) must be a power of two size aligned to its size"%(base, size))
+            self.address_mask = (~(size-1)) & 0xffffffff
+            self.address_match = base & self.address_mask
+            pass
+        self.writes_only = 1 if config.get("writes_only",False) else 0
+        self.errors_only = 1 if config.get("errors_only",False) else 0
+        self.sample_interval = config.get("sample",0)
+        if (self.sample_interval<0) or (self.sample_interval>0xffff):
+            raise Exception("APB logging sample interval %d must fit in the 16 bits of sample_interval"%self.sample_interval)
+        pass
+    #f of_loggers
+    @classmethod
+    def of_loggers(cls, loggers:Dict[str,Dict[str,Any]]) -> Tuple[Dict[str,Dict[str,Any]],'ApbLoggingControl']:
+        """
+        Split the filters from a loggers dictionary, returning the
+        loggers without them and the control for the filters (the last
+        if more than one logger has one)
+        """
+        config : Dict[str,Any] = {}
+        stripped : Dict[str,Dict[str,Any]] = {}
+        for (name, logger) in loggers.items():
+            logger = dict(logger)
+            config.update(logger.pop("filter",{}))
+            stripped[name] = logger
+            pass
+        return (stripped, cls(config))
+    #f logged
+    def logged(self, transfers:Iterable[Tuple[int,int,int,int]]) -> List[Tuple[int,int,int,int]]:
+        """
+        Return those of the transfers (write_not_read, address, data,
+        err), in order, that apb_logging_filtered would log with this control,
+        starting with its sample count at zero
+        """
+        result : List[Tuple[int,int,int,int]] = []
+        sample_count = 0
+        for t in transfers:
+            (write_not_read, address, data, err) = t
+            if (address & self.address_mask)!=self.address_match: continue
+            if self.writes_only and not write_not_read: continue
+            if self.errors_only and not err: continue
+            if self.sample_interval>1:
+                sample_skip = (sample_count!=0)
+                sample_count = 0 if (sample_count+1>=self.sample_interval) else sample_count+1
+                if sample_skip: continue
+                pass
+            result.append(t)
+            pass
+        return result
+    #f value
+    def value(self) -> Dict[str,int]:
+        return {k:getattr(self,k) for k in t_apb_logging_control}
+    #f drive
+    def drive(self, th:Any, name:str) -> None:
+        """
+        Drive the logging control input signals of a test harness (such as 'apb_logging_control')
+        """
+        for (k,v) in self.value().items():
+            getattr(th, "%s__%s"%(name, k)).drive(v)
+            pass
+        pass
+    pass
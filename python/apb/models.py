@@ -0,0 +1,156 @@
+#a Copyright
+#
+#  This file 'models.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from bisect import bisect_right
+from cdl.utils import csr
+from typing import Dict, List, Optional, Tuple, Type, Union
+
+#a Registry
+#v target_model_classes
+target_model_classes : Dict[Type[csr.Map],Type['ApbTargetModel']] = {}
+
+#f register_target_model
+def register_target_model(map_class:Type[csr.Map], model_class:Type['ApbTargetModel']) -> None:
+    """
+    Register the model class to use for a target's address map, so
+    that ApbTargetBus.of_map can build a bus from a composed map
+    """
+    target_model_classes[map_class] = model_class
+    pass
+
+#f map_size
+def map_size(map_class:Type[csr.Map]) -> int:
+    """
+    Number of addresses decoded by an address map: the power of two
+    above its highest register (as for AddressMapIndex), or above the
+    end of its highest submap
+    """
+    last = 0
+    for m in map_class._map:
+        if isinstance(m, csr.MapCsr): last = max(last, m.reg)
+        elif isinstance(m, csr.MapMap): last = max(last, m.offset + map_size(m.map) - 1)
+        pass
+    return 1 << last.bit_length()
+
+#a Classes
+#c ApbTargetModel
+class ApbTargetModel(object):
+    """
+    Transaction-level model of an APB target
+
+    A model is presented with complete APB transfers rather than
+    signals; the cycle is the clock tick of the select phase of the
+    transfer, so that models with time-dependent state (such as the
+    timer) can be evaluated lazily.
+
+    The transaction returns (err, read_data, wait_cycles), where
+    wait_cycles is the number of cycles that pready would be held low
+    in the enable phase of the transfer.
+    """
+    #f transaction
+    def transaction(self, cycle:int, write_not_read:int, address:int, data:int) -> Tuple[int,int,int]:
+        return (0, 0, 0)
+    pass
+
+#c ApbMemoryModel
+class ApbMemoryModel(ApbTargetModel):
+    """
+    Simple read/write memory of 32-bit words, one per APB address,
+    with a fixed number of wait cycles per access
+    """
+    contents:Dict[int,int]
+    def __init__(self, wait_cycles:int=0):
+        self.wait_cycles = wait_cycles
+        self.contents = {}
+        pass
+    #f transaction
+    def transaction(self, cycle:int, write_not_read:int, address:int, data:int) -> Tuple[int,int,int]:
+        if write_not_read:
+            self.contents[address] = data & 0xffffffff
+            return (0, 0, self.wait_cycles)
+        return (0, self.contents.get(address,0), self.wait_cycles)
+    pass
+
+#c ApbTargetBus
+class ApbTargetBus(ApbTargetModel):
+    """
+    Decode of an APB address to one of a set of target models
+
+    Each target is added at an offset, optionally with a size, and it
+    receives addresses relative to that offset; the target selected is
+    the one with the greatest offset not above the transaction address.
+    Transactions that do not decode to a target (below all the offsets,
+    or at or beyond the size of the target selected) complete with an
+    error.
+
+    A bus may be built from a composed csr.Map (such as the
+    ApbAddressMap of the tests) using of_map; each MapMap of the map
+    gets the model registered for its address map class, or a bus
+    built from its submaps, with the size of its map (see map_size).
+    """
+    offsets:List[int]
+    targets:List[ApbTargetModel]
+    sizes:List[Optional[int]]
+    named:Dict[str,ApbTargetModel]
+    def __init__(self):
+        self.offsets = []
+        self.targets = []
+        self.sizes = []
+        self.named = {}
+        pass
+    #f of_map
+    @classmethod
+    def of_map(cls, apb_map:Union[csr.Map,Type[csr.Map]]) -> 'ApbTargetBus':
+        map_class = apb_map if isinstance(apb_map, type) else type(apb_map)
+        bus = cls()
+        for m in map_class._map:
+            if not isinstance(m, csr.MapMap): continue
+            model_class = target_model_classes.get(m.map, None)
+            if model_class is None:
+                model = cls.of_map(m.map)
+                pass
+            else:
+                model = model_class()
+                pass
+            bus.add_target(m.offset, model, name=m.name, size=map_size(m.map))
+            pass
+        return bus
+    #f add_target
+    def add_target(self, offset:int, target:ApbTargetModel, name:Optional[str]=None, size:Optional[int]=None) -> None:
+        """
+        Add a target at an offset; if size is None the target decodes
+        every address up to the next target
+        """
+        i = bisect_right(self.offsets, offset)
+        self.offsets.insert(i, offset)
+        self.targets.insert(i, target)
+        self.sizes.insert(i, size)
+        if name is not None: self.named[name] = target
+        pass
+    #f model
+    def model(self, name:str) -> ApbTargetModel:
+        return self.named[name]
+    #f transaction
+    def transaction(self, cycle:int, write_not_read:int, address:int, data:int) -> Tuple[int,int,int]:
+        i = bisect_right(self.offsets, address) - 1
+        if i<0: return (1, 0, 0)
+        offset = address - self.offsets[i]
+        size = self.sizes[i]
+        if (size is not None) and (offset>=size): return (1, 0, 0)
+        return self.targets[i].transaction(cycle, write_not_read, offset, data)
+    pass
@@ -0,0 +1,175 @@
+#a Copyright
+#
+#  This file 'profiler.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+#a Classes
+#c HarnessProfiler
+class HarnessProfiler(object):
+    """
+    Wall-clock profiler of a test harness (a ThExecFile), splitting the
+    time of the test between the simulation and the Python code of the
+    harness and its BFMs (ApbMaster, DbgMaster, DprintfBus, ...)
+
+    When installed, the bfm_wait of the harness is replaced by one that
+    times the wait; the BFMs all wait through the bfm_wait of their
+    harness, so this sees every wait of the test. The time spent in
+    bfm_wait is simulation time; the time between one bfm_wait
+    returning and the next being called is Python time, and is
+    attributed to the call site of that next bfm_wait. The call site is
+    the first frame outside this package (so a wait within an ApbMaster
+    transfer is attributed to the test code that called the ApbMaster)
+    and outside any of the skip directories, or its caller 'depth'
+    frames further out. A wait costs two clock reads, a short frame
+    walk and a dictionary update, so the profiler may be left installed
+    in regressions.
+
+    The simulated cycles are the total of the cycles waited for.
+    """
+    sites:Dict[Tuple[Any,int],List[Any]]
+    #f __init__
+    def __init__(self, th:Any, depth:int=0, skip:Iterable[str]=()):
+        self.th = th
+        self.depth = depth
+        self.skip_dirs = tuple([os.path.dirname(os.path.abspath(__file__))] + [os.path.abspath(d) for d in skip])
+        self.skip_code : Dict[Any,bool] = {}
+        self.bfm_wait_th : Callable[[int],None] = th.bfm_wait
+        self.installed = False
+        self.reset()
+        pass
+    #f reset
+    def reset(self) -> None:
+        # sites[(code, line)] = [waits, cycles, sim seconds, python seconds]
+        self.sites = {}
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.end = self.start
+        pass
+    #f install
+    def install(self) -> 'HarnessProfiler':
+        if not self.installed:
+            self.th.bfm_wait = self.bfm_wait
+            self.installed = True
+            self.reset()
+            pass
+        return self
+    #f uninstall
+    def uninstall(self) -> None:
+        if self.installed:
+            self.th.bfm_wait = self.bfm_wait_th
+            self.installed = False
+            self.end = time.perf_counter()
+            pass
+        pass
+    def __enter__(self) -> 'HarnessProfiler':
+        return self.install()
+    def __exit__(self, *args:Any) -> None:
+        self.uninstall()
+        pass
+    #f skipped
+    def skipped(self, code:Any) -> bool:
+        """
+        Return True if frames of the code are not call sites (the code
+        is in this package or a skip directory); cached per code object
+        """
+        skip = self.skip_code.get(code, None)
+        if skip is None:
+            filename = os.path.abspath(code.co_filename)
+            skip = any([filename.startswith(d+os.sep) for d in self.skip_dirs])
+            self.skip_code[code] = skip
+            pass
+        return skip
+    #f call_site
+    def call_site(self) -> Tuple[Any,int]:
+        frame = sys._getframe(2)
+        while (frame.f_back is not None) and self.skipped(frame.f_code):
+            frame = frame.f_back
+            pass
+        for i in range(self.depth):
+            if frame.f_back is None: break
+            frame = frame.f_back
+            pass
+        return (frame.f_code, frame.f_lineno)
+    #f bfm_wait
+    def bfm_wait(self, cycles:int) -> None:
+        t0 = time.perf_counter()
+        key = self.call_site()
+        s = self.sites.get(key, None)
+        if s is None:
+            s = [0, 0, 0.0, 0.0]
+            self.sites[key] = s
+            pass
+        self.bfm_wait_th(cycles)
+        t1 = time.perf_counter()
+        s[0] += 1
+        s[1] += cycles
+        s[2] += t1 - t0
+        s[3] += t0 - self.last
+        self.last = t1
+        pass
+    #f site_name
+    @staticmethod
+    def site_name(code:Any, line:int) -> str:
+        return "%s:%d (%s)"%(os.path.basename(code.co_filename), line, code.co_name)
+    #f profile
+    def profile(self) -> Dict[str,Dict[str,Any]]:
+        """
+        Return the profile of each call site of bfm_wait, most Python
+        time first, as a dictionary of waits, cycles, sim_seconds and
+        python_seconds
+        """
+        result : Dict[str,Dict[str,Any]] = {}
+        for ((code, line), (waits, cycles, sim, python)) in sorted(self.sites.items(), key=lambda kv:-kv[1][3]):
+            result[self.site_name(code, line)] = {"waits":waits, "cycles":cycles, "sim_seconds":sim, "python_seconds":python}
+            pass
+        return result
+    #f summary
+    def summary(self) -> Dict[str,Any]:
+        """
+        Return the totals of the profile: wall_seconds (since installed,
+        to uninstalled or now), sim_seconds, python_seconds (to the last
+        wait), cycles and cycles_per_wall_second
+        """
+        end = time.perf_counter() if self.installed else self.end
+        wall = end - self.start
+        (waits, cycles, sim, python) = (0, 0, 0.0, 0.0)
+        for s in self.sites.values():
+            waits += s[0]
+            cycles += s[1]
+            sim += s[2]
+            python += s[3]
+            pass
+        return {"wall_seconds":wall, "sim_seconds":sim, "python_seconds":python,
+                "waits":waits, "cycles":cycles,
+                "python_fraction":python/max(wall,1E-9),
+                "cycles_per_wall_second":cycles/max(wall,1E-9),
+                }
+    #f report
+    def report(self, max_sites:int=10) -> str:
+        s = self.summary()
+        r = ("%d cycles in %.3fs (%.0f cycles per second): %.3fs simulating, %.3fs (%.1f%%) in Python, %d waits\n")%(
+            s["cycles"], s["wall_seconds"], s["cycles_per_wall_second"],
+            s["sim_seconds"], s["python_seconds"], 100*s["python_fraction"], s["waits"])
+        for (name, p) in list(self.profile().items())[:max_sites]:
+            r += "  %-48s %8d waits %8d cycles %8.3fs sim %8.3fs Python\n"%(name, p["waits"], p["cycles"], p["sim_seconds"], p["python_seconds"])
+            pass
+        return r
+    pass
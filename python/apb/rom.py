@@ -1,27 +1,56 @@
 #!/usr/bin/env python3
+import mmap, os, sys
+from array import array
 from cdl.utils.memory import Memory
-from typing import Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 #a Classes
 class CompiledProgam(object):
+    """
+    Compiled program, as an image of 40-bit ROM words (in an
+    array('Q')) starting at base_address, with its labels
+    """
     labels:Dict[str,int]
-    contents:List[Tuple[int,int]]
+    base_address:int
+    image:array
+    optimization:Optional[Dict[str,int]]
     def __init__(self):
         self.labels = {}
-        self.contents = []
+        self.base_address = 0
+        self.image = array("Q")
+        self.optimization = None
         pass
     def add_label(self, name:str, address:int) -> None:
         self.labels[name] = address
         pass
     def add_contents(self, address:int, data:int) -> None:
-        self.contents.append((address,data))
+        if len(self.image)==0: self.base_address = address
+        i = address - self.base_address
+        if i<0:
+            self.image[0:0] = array("Q",[0]) * (-i)
+            self.base_address = address
+            i = 0
+            pass
+        if i>=len(self.image):
+            self.image.extend(array("Q",[0]) * (i+1-len(self.image)))
+            pass
+        self.image[i] = data
         pass
+    @property
+    def contents(self) -> List[Tuple[int,int]]:
+        return list(zip(range(self.base_address, self.base_address+len(self.image)), self.image))
+    def as_memoryview(self) -> memoryview:
+        """
+        Return the image (of 64-bit native-endian words) without copying
+        """
+        return memoryview(self.image)
     def add_to_memory(self, memory:Memory, bytes_per_word=8, label_prefix:str="", base_address:int=0) -> None:
         for (ln, la) in self.labels.items():
             memory.add_label( label="%s%s"%(label_prefix, ln),
                               address=la )
             pass
-        for (a,d) in self.contents:
+        base_address += self.base_address
+        for (a,d) in enumerate(self.image):
             memory.add_data_word(address=(a + base_address)*bytes_per_word,
                                  data=d)
             pass
@@ -103,11 +132,286 @@ class Rom(object):
     def op_finish(cls):
         return (cls.opcodes["opcode_class_finish"]<<(32+5))
         pass
+    #f decode_op
+    @staticmethod
+    def decode_op(op:int) -> Tuple[int,int,int]:
+        """
+        Decode an op into (opcode_class, subclass, data)
+        """
+        return ((op>>37)&7, (op>>32)&31, op & 0xffffffff)
+    #f alu_combine
+    @staticmethod
+    def alu_combine(alu_op:int, a:int, b:int) -> int:
+        """
+        Return the result of the ALU op on two values
+        """
+        if alu_op==0: return a | b
+        if alu_op==1: return a & b
+        if alu_op==2: return a & ~b & 0xffffffff
+        if alu_op==3: return a ^ b
+        return (a + b) & 0xffffffff
+    #f optimize_program
+    @classmethod
+    def optimize_program(cls, program:Dict[str,Any], min_repeat:int=4) -> Tuple[Dict[str,Any],Dict[str,int]]:
+        """
+        Optimize a program (as given to compile_program), returning the
+        optimized program and a report of the ROM words saved
+
+        The optimizations are:
+
+        * ops following a finish, branch or ret are removed up to the next op with a set label
+
+        * a set address is removed if the address is known to already be that value,
+          within a run of ops that is not branched into
+
+        * adjacent ALU ops (and set accumulator) with constant data are folded into one
+
+        * a run of at least min_repeat identical APB write requests is replaced by a set
+          repeat and a loop, if the repeat count is not used subsequently (this saves
+          ROM words, but the loop takes more cycles than the unrolled writes)
+
+        Set labels are never removed, and new labels '__repeat_<n>:' are
+        added for the loops. Branches must be to labels (not to
+        absolute addresses), as ops move.
+        """
+        code = []
+        for op_labels in program["code"]:
+            if len(op_labels)==1:
+                code.append([op_labels[0],[]])
+                pass
+            else:
+                code.append([op_labels[0],list(op_labels[1])])
+                pass
+            pass
+        words_before = len(code)
+        report = {"unreachable":0, "set_address":0, "alu_folded":0, "repeats":0}
+        changed = True
+        while changed:
+            changed = False
+            for (k,fn) in [("unreachable",cls.optimize_unreachable),
+                           ("set_address",cls.optimize_set_address),
+                           ("alu_folded", cls.optimize_alu),
+                           ("repeats",    lambda code:cls.optimize_repeats(code, min_repeat)),
+                           ]:
+                n = fn(code)
+                if n>0: changed = True
+                report[k] += n
+                pass
+            pass
+        report["words_before"] = words_before
+        report["words_after"] = len(code)
+        report["words_saved"] = words_before - len(code)
+        optimized = dict(program)
+        optimized["code"] = [ (op, labels) for (op, labels) in code ]
+        return (optimized, report)
+    #f has_set_label
+    @staticmethod
+    def has_set_label(labels:List[str]) -> bool:
+        for l in labels:
+            if l[-1]==':': return True
+            pass
+        return False
+    #f has_use_label
+    @staticmethod
+    def has_use_label(labels:List[str]) -> bool:
+        for l in labels:
+            if l[-1]!=':': return True
+            pass
+        return False
+    #f optimize_unreachable
+    @classmethod
+    def optimize_unreachable(cls, code:List[List[Any]]) -> int:
+        removed = 0
+        i = 0
+        reachable = True
+        while i<len(code):
+            (op, labels) = code[i]
+            if cls.has_set_label(labels): reachable = True
+            if not reachable:
+                del code[i]
+                removed += 1
+                continue
+            (opcode_class, subclass, data) = cls.decode_op(op)
+            if opcode_class==cls.opcodes["opcode_class_finish"]: reachable = False
+            if opcode_class==cls.opcodes["opcode_class_branch"]:
+                if subclass in [cls.opcode_subclass["rom_op_branch"], cls.opcode_subclass["rom_op_ret"]]:
+                    reachable = False
+                    pass
+                pass
+            i += 1
+            pass
+        return removed
+    #f optimize_set_address
+    @classmethod
+    def optimize_set_address(cls, code:List[List[Any]]) -> int:
+        removed = 0
+        address = None
+        increment = None
+        i = 0
+        while i<len(code):
+            (op, labels) = code[i]
+            if cls.has_set_label(labels):
+                address = None
+                increment = None
+                pass
+            (opcode_class, subclass, data) = cls.decode_op(op)
+            if cls.has_use_label(labels): data = None
+            if opcode_class==cls.opcodes["opcode_class_set_parameter"]:
+                if subclass==cls.opcode_subclass["rom_op_set_address"]:
+                    if (data is not None) and (address==data):
+                        del code[i]
+                        removed += 1
+                        continue
+                    address = data
+                    pass
+                elif subclass==cls.opcode_subclass["rom_op_set_increment"]:
+                    increment = data
+                    pass
+                pass
+            elif opcode_class==cls.opcodes["opcode_class_apb_request"]:
+                if subclass & 4:
+                    if (address is None) or (increment is None):
+                        address = None
+                        pass
+                    else:
+                        address = (address + increment) & 0xffffffff
+                        pass
+                    pass
+                pass
+            elif opcode_class==cls.opcodes["opcode_class_wait"]:
+                increment = 0
+                pass
+            elif opcode_class==cls.opcodes["opcode_class_branch"]:
+                if subclass not in [cls.opcode_subclass["rom_op_beq"],
+                                    cls.opcode_subclass["rom_op_bne"],
+                                    cls.opcode_subclass["rom_op_loop"]]:
+                    address = None
+                    increment = None
+                    pass
+                pass
+            elif opcode_class!=cls.opcodes["opcode_class_alu"]:
+                address = None
+                increment = None
+                pass
+            i += 1
+            pass
+        return removed
+    #f optimize_alu
+    @classmethod
+    def optimize_alu(cls, code:List[List[Any]]) -> int:
+        removed = 0
+        set_class = cls.opcodes["opcode_class_set_parameter"]
+        set_acc = cls.opcode_subclass["rom_op_set_accumulator"]
+        alu_class = cls.opcodes["opcode_class_alu"]
+        i = 0
+        while i+1<len(code):
+            (op0, labels0) = code[i]
+            (op1, labels1) = code[i+1]
+            if (cls.has_use_label(labels0) or cls.has_use_label(labels1) or cls.has_set_label(labels1)):
+                i += 1
+                continue
+            (class0, subclass0, data0) = cls.decode_op(op0)
+            (class1, subclass1, data1) = cls.decode_op(op1)
+            is_set0 = (class0==set_class) and (subclass0==set_acc)
+            is_set1 = (class1==set_class) and (subclass1==set_acc)
+            op = None
+            if (is_set0 or class0==alu_class) and is_set1:
+                op = op1
+                pass
+            elif is_set0 and (class1==alu_class):
+                op = cls.op_set("accumulator", cls.alu_combine(subclass1, data0, data1))
+                pass
+            elif (class0==alu_class) and (class1==alu_class) and (subclass0==subclass1):
+                combine = subclass0
+                if subclass0==cls.opcode_subclass["rom_op_alu_bic"]: combine = cls.opcode_subclass["rom_op_alu_or"]
+                op = op0 - data0 + cls.alu_combine(combine, data0, data1)
+                pass
+            if op is None:
+                i += 1
+                continue
+            code[i][0] = op
+            del code[i+1]
+            removed += 1
+            pass
+        return removed
+    #f repeat_is_live
+    @classmethod
+    def repeat_is_live(cls, code:List[List[Any]], start:int) -> bool:
+        """
+        Determine if the repeat count may be used by a loop op starting
+        at code[start], following all branches
+        """
+        label_index = {}
+        for (i,(op,labels)) in enumerate(code):
+            for l in labels:
+                if l[-1]==':': label_index[l] = i
+                pass
+            pass
+        visited = set()
+        to_visit = [start]
+        while len(to_visit)>0:
+            i = to_visit.pop()
+            while (i<len(code)) and (i not in visited):
+                visited.add(i)
+                (op, labels) = code[i]
+                (opcode_class, subclass, data) = cls.decode_op(op)
+                if opcode_class==cls.opcodes["opcode_class_finish"]: break
+                if opcode_class==cls.opcodes["opcode_class_set_parameter"]:
+                    if subclass==cls.opcode_subclass["rom_op_set_repeat"]: break
+                    pass
+                if opcode_class==cls.opcodes["opcode_class_branch"]:
+                    if subclass in [cls.opcode_subclass["rom_op_loop"], cls.opcode_subclass["rom_op_ret"]]: return True
+                    targets = [ label_index.get(l+":",None) for l in labels if l[-1]!=':' ]
+                    if (len(targets)!=1) or (targets[0] is None): return True
+                    to_visit.append(targets[0])
+                    if subclass==cls.opcode_subclass["rom_op_branch"]: break
+                    pass
+                i += 1
+                pass
+            if i>=len(code): return True
+            pass
+        return False
+    #f optimize_repeats
+    @classmethod
+    def optimize_repeats(cls, code:List[List[Any]], min_repeat:int) -> int:
+        removed = 0
+        used_labels = set()
+        for (op, labels) in code:
+            used_labels.update(labels)
+            pass
+        i = 0
+        while i<len(code):
+            (op, labels) = code[i]
+            (opcode_class, subclass, data) = cls.decode_op(op)
+            if ( (opcode_class!=cls.opcodes["opcode_class_apb_request"]) or
+                 ((subclass&3)==cls.opcode_subclass["rom_op_req_read"]) or
+                 cls.has_use_label(labels) ):
+                i += 1
+                continue
+            n = 1
+            while (i+n<len(code)) and (code[i+n][0]==op) and (len(code[i+n][1])==0):
+                n += 1
+                pass
+            if (n<min_repeat) or cls.repeat_is_live(code, i+n):
+                i += n
+                continue
+            k = 0
+            while ("__repeat_%d:"%k) in used_labels: k+=1
+            label = "__repeat_%d"%k
+            used_labels.add(label+":")
+            code[i:i+n] = [ [cls.op_set("repeat",n-1), labels],
+                            [op, [label+":"]],
+                            [cls.op_branch("loop",0), [label]] ]
+            removed += n-3
+            i += 3
+            pass
+        return removed
     #f compile_program
     @staticmethod
-    def compile_program(program, address=0):
+    def compile_program(program, address=0, optimize=False, **kwargs):
         """
-        Does a two-pass compile of a program
+        Does a single-pass compile of a program into an array of words,
+        backpatching forward references to labels
 
         A program consists of a list of (op | (op*labels tuple))
 
@@ -125,65 +429,142 @@ class Rom(object):
         op_finish()
 
         inc is a post-increment
+
+        If optimize is True then the program is first passed through
+        optimize_program (with any kwargs), and its report is kept as
+        the optimization of the compiled program.
         """
         compiled = CompiledProgam()
-        label_addresses = {}
-        for p in range(2):
-            prog_address = address
-            for op_labels in program["code"]:
-                if len(op_labels)==1:
-                    op=op_labels[0]
-                    labels=[]
-                    pass
-                else:
-                    (op,labels) = op_labels
-                    pass
-                if p==0:
-                    for l in labels:
-                        if l[-1]==':': label_addresses[l] = prog_address
+        if optimize:
+            (program, compiled.optimization) = Rom.optimize_program(program, **kwargs)
+            pass
+        code = program["code"]
+        compiled.base_address = address
+        image = array("Q",[0]) * len(code)
+        labels = compiled.labels
+        fixups = []
+        for (i, op_labels) in enumerate(code):
+            op = op_labels[0]
+            if len(op_labels)>1:
+                for l in op_labels[1]:
+                    if l[-1]==':':
+                        labels[l] = address+i
                         pass
-                    pass
-                else:
-                    for l in labels:
-                        if l[-1]!=':':
-                            op |= label_addresses[l+":"]
-                            # print("%08x"%label_addresses[l+":"])
-                            pass
+                    elif l+":" in labels:
+                        op |= labels[l+":"]
+                        pass
+                    else:
+                        fixups.append((i, l+":"))
                         pass
-                    compiled.add_contents(prog_address, op)
                     pass
-                prog_address = prog_address + 1
                 pass
+            image[i] = op
             pass
-        for (ln,la) in label_addresses.items():
-            compiled.add_label(ln, la)
+        for (i, l) in fixups:
+            image[i] |= labels[l]
             pass
+        compiled.image = image
         return compiled
     pass
-    #f mif_of_compilation
+    #f open_filename
     @staticmethod
     def open_filename(filename):
-        import sys
         if filename=='': return (sys.stdout, lambda x:None)
         f = open(filename,"w")
         if not f:
             die
             pass
         return (f, lambda x:f.close() )
+    #f write_mif
+    @staticmethod
+    def write_mif(compiled:CompiledProgam, f:Any, chunk_words:int=4096) -> None:
+        """
+        Write the image of a compilation as a MIF file, with a line of
+        '<word address>: <40-bit data>' (in hex) per ROM word, formatting
+        it in chunks of words
+        """
+        image = compiled.image
+        base_address = compiled.base_address
+        for i in range(0, len(image), chunk_words):
+            chunk = image[i:i+chunk_words]
+            f.write("".join(["%x: %010x\n"%(base_address+i+j, d) for (j,d) in enumerate(chunk)]))
+            pass
+        pass
+    #f write_mem
+    @staticmethod
+    def write_mem(compiled:CompiledProgam, f:Any, chunk_words:int=4096) -> None:
+        """
+        Write the image of a compilation as a READMEMH file, with an
+        '@<word address>' line followed by a line per ROM word, formatting
+        it in chunks of words
+        """
+        image = compiled.image
+        f.write("@%x\n"%compiled.base_address)
+        for i in range(0, len(image), chunk_words):
+            chunk = image[i:i+chunk_words]
+            f.write("".join(["%010x\n"%d for d in chunk]))
+            pass
+        pass
+    #f write_bin
+    @staticmethod
+    def write_bin(compiled:CompiledProgam, f:Any, chunk_words:int=64*1024) -> None:
+        """
+        Write the image of a compilation as packed binary, 5 bytes per
+        ROM word in little-endian order, starting at the base address
+        of the compilation
+        """
+        image = compiled.image
+        for i in range(0, len(image), chunk_words):
+            chunk = image[i:i+chunk_words]
+            if sys.byteorder!="little": chunk.byteswap()
+            words = chunk.tobytes()
+            packed = bytearray(5*len(chunk))
+            for k in range(5):
+                packed[k::5] = words[k::8]
+                pass
+            f.write(packed)
+            pass
+        pass
+    #f image_of_bin
+    @staticmethod
+    def image_of_bin(filename:str) -> array:
+        """
+        Read a packed binary ROM image (as written by write_bin) into
+        an array of words, mapping the file rather than reading it
+        """
+        image = array("Q")
+        with open(filename,"rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size==0: return image
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                num_words = size // 5
+                words = bytearray(8*num_words)
+                for k in range(5):
+                    words[k::8] = m[k:5*num_words:5]
+                    pass
+                image.frombytes(words)
+                pass
+            pass
+        if sys.byteorder!="little": image.byteswap()
+        return image
+    #f mif_of_compilation
     @classmethod
     def mif_of_compilation(cls, compiled, filename=''):
         (f,c) = cls.open_filename(filename)
-        memory = Memory(bit_width=40)
-        compiled.add_to_memory(memory, bytes_per_word=5)
-        memory.write_mif(f)
+        cls.write_mif(compiled, f)
         c(None)
         pass
+    #f mem_of_compilation
     @classmethod
     def mem_of_compilation(cls, compiled, filename=''):
         (f,c) = cls.open_filename(filename)
-        memory = Memory(bit_width=40)
-        compiled.add_to_memory(memory, bytes_per_word=5)
-        memory.write_mem(f)
+        cls.write_mem(compiled, f)
         c(None)
         pass
-
+    #f bin_of_compilation
+    @classmethod
+    def bin_of_compilation(cls, compiled, filename):
+        with open(filename,"wb") as f:
+            cls.write_bin(compiled, f)
+            pass
+        pass
@@ -0,0 +1,293 @@
+#a Copyright
+#
+#  This file 'rom_analysis.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from .rom     import Rom, CompiledProgam
+from .rom_sim import RomSim
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+#a Classes
+#c RomAnalysisResult
+class RomAnalysisResult(object):
+    """
+    Result of the static analysis of a ROM program from an entry point
+
+    best_cycles and worst_cycles are the bounds on the cycles for the
+    paths that reach an op_finish; reads and writes are the APB
+    requests on the worst-case path. can_hang is True if there is a
+    path that never finishes (such as a branch to itself on failure).
+    hot_loops is a list of (start, end, cycles, iterations) for the
+    backward branches of the worst-case path, most cycles first.
+    """
+    label:str
+    best_cycles:Optional[int]
+    worst_cycles:Optional[int]
+    reads:int
+    writes:int
+    can_hang:bool
+    hot_loops:List[Tuple[int,int,int,int]]
+    def __init__(self, label:str, best_cycles:Optional[int], worst_cycles:Optional[int], reads:int, writes:int,
+                 can_hang:bool, hot_loops:List[Tuple[int,int,int,int]]):
+        self.label = label
+        self.best_cycles = best_cycles
+        self.worst_cycles = worst_cycles
+        self.reads = reads
+        self.writes = writes
+        self.can_hang = can_hang
+        self.hot_loops = hot_loops
+        pass
+    def __str__(self) -> str:
+        if self.best_cycles is None:
+            r = "%s: never finishes"%self.label
+            pass
+        else:
+            r = "%s: %d to %d cycles, %d reads, %d writes"%(self.label, self.best_cycles, self.worst_cycles, self.reads, self.writes)
+            pass
+        if self.can_hang: r += " (may hang)"
+        for (start, end, cycles, iterations) in self.hot_loops:
+            r += "\n    loop %d..%d: %d cycles in %d iterations"%(start, end, cycles, iterations)
+            pass
+        return r
+    pass
+
+#c RomAnalysis
+class RomAnalysis(object):
+    """
+    Static cycle and bus-traffic analysis of a compiled ROM program
+
+    The control flow of the program is walked from an entry point,
+    tracking the APB address, accumulator, increment and repeat count
+    where they are known constants. A branch on an accumulator that is
+    not known (for example, after an APB read) follows both paths;
+    a backward branch of this kind (a polling loop) is taken at most
+    poll_bound times on any path. A loop whose repeat count is not
+    known is assumed to run repeat_bound times.
+
+    The cycle costs are those of RomSim; the APB wait cycles of a
+    request are given by pready_wait, which may be an int or a
+    function of (address, write_not_read) where the address is None if
+    it is not known.
+    """
+    #f __init__
+    def __init__(self, compiled:CompiledProgam,
+                 pready_wait:Union[int,Callable[[Optional[int],int],int]]=0,
+                 poll_bound:int=16,
+                 repeat_bound:int=256,
+                 max_states:int=1000*1000):
+        if type(pready_wait)==int:
+            wait = pready_wait
+            pready_wait = lambda address, write_not_read:wait
+            pass
+        self.pready_wait = pready_wait
+        self.poll_bound = poll_bound
+        self.repeat_bound = repeat_bound
+        self.max_states = max_states
+        self.labels = dict(compiled.labels)
+        self.contents = [RomSim.decode(d) for d in [0]*compiled.base_address + list(compiled.image)]
+        pass
+    #f step
+    def step(self, state:Tuple) -> Tuple[int,int,int,List[Tuple]]:
+        """
+        Execute the instruction for a state, returning (cycles, reads,
+        writes, successor states); a finish has no successors, and an
+        instruction outside the program has None as its successors
+        """
+        (pc, address, acc, inc, repeat, counts) = state
+        if pc>=len(self.contents): return (0, 0, 0, None)
+        (opcode_class, subclass, arg) = self.contents[pc]
+        cycles = RomSim.fetch_cycles + RomSim.execute_cycles
+        reads = 0
+        writes = 0
+        next_pc = (pc + 1) & 0xffff
+        if opcode_class==0: # ALU
+            if acc is not None: acc = Rom.alu_combine(subclass, acc, arg)
+            pass
+        elif opcode_class==1: # Set parameter
+            if   subclass==0: address = arg
+            elif subclass==1: repeat = arg
+            elif subclass==2: acc = arg
+            elif subclass==3: inc = arg
+            pass
+        elif opcode_class==2: # APB request
+            write_not_read = 0 if (subclass&3)==0 else 1
+            cycles += RomSim.apb_cycles + self.pready_wait(address, write_not_read)
+            if write_not_read:
+                writes = 1
+                pass
+            else:
+                reads = 1
+                acc = None
+                pass
+            if subclass & 4:
+                address = None if ((address is None) or (inc is None)) else ((address + inc) & 0xffffffff)
+                pass
+            pass
+        elif opcode_class==3: # Branch
+            target = arg & 0xffff
+            if subclass==0:
+                return (cycles, 0, 0, [(target, address, acc, inc, repeat, counts)])
+            if subclass==3: # loop
+                if repeat is None:
+                    if self.repeat_bound==0: return (cycles, 0, 0, [(next_pc, address, acc, inc, 0xffffffff, counts)])
+                    repeat = self.repeat_bound
+                    pass
+                if repeat!=0: next_pc = target
+                return (cycles, 0, 0, [(next_pc, address, acc, inc, (repeat-1) & 0xffffffff, counts)])
+            if subclass==7: # ret
+                if inc is None: return (cycles, 0, 0, None)
+                return (cycles, 0, 0, [(inc & 0xffff, address, acc, inc, repeat, counts)])
+            link = subclass>=4
+            if link: inc = next_pc
+            if subclass==4: return (cycles, 0, 0, [(target, address, acc, inc, repeat, counts)])
+            condition = subclass & 3 # 1 for beq, 2 for bne
+            if acc is not None:
+                taken = (acc==0) if condition==1 else (acc!=0)
+                return (cycles, 0, 0, [(target if taken else next_pc, address, acc, inc, repeat, counts)])
+            not_taken = (next_pc, address, acc, inc, repeat, counts)
+            if target>pc:
+                return (cycles, 0, 0, [(target, address, acc, inc, repeat, counts), not_taken])
+            # A polling loop: its count is dropped when it exits, so
+            # the code after it is explored once rather than once per
+            # number of iterations
+            counts_dict = dict(counts)
+            n = counts_dict.pop(pc,0)
+            not_taken = (next_pc, address, acc, inc, repeat, tuple(sorted(counts_dict.items())))
+            if n>=self.poll_bound: return (cycles, 0, 0, [not_taken])
+            counts_dict[pc] = n+1
+            taken_counts = tuple(sorted(counts_dict.items()))
+            return (cycles, 0, 0, [(target, address, acc, inc, repeat, taken_counts), not_taken])
+        elif opcode_class==4: # Wait
+            cycles += arg + RomSim.wait_complete_cycles
+            inc = 0
+            pass
+        elif opcode_class==5: # Finish
+            return (cycles, 0, 0, [])
+        else:
+            return (cycles, 0, 0, None)
+        return (cycles, reads, writes, [(next_pc, address, acc, inc, repeat, counts)])
+    #f analyze
+    def analyze(self, label:Union[int,str], num_hot_loops:int=4) -> RomAnalysisResult:
+        """
+        Analyze the program from an entry point (label or address); the
+        processor state is assumed unknown at the start, other than the
+        increment that resets to 1
+        """
+        if type(label)==int:
+            pc = label
+            label = str(label)
+            pass
+        else:
+            if label[-1]==':': label = label[:-1]
+            pc = self.labels[label+":"]
+            pass
+        start = (pc, None, None, 1, None, ())
+        # values[state] = (best, worst, reads, writes, can_hang, worst successor) with best None if it never finishes
+        values : Dict[Tuple,Tuple] = {}
+        on_stack = set([start])
+        stack = [[start, self.step(start), 0]]
+        while len(stack)>0:
+            frame = stack[-1]
+            (state, (cycles, reads, writes, successors), i) = frame
+            if successors is not None:
+                while (i<len(successors)) and ((successors[i] in values) or (successors[i] in on_stack)):
+                    i += 1
+                    pass
+                frame[2] = i
+                if i<len(successors):
+                    if len(values)+len(stack)>self.max_states:
+                        raise Exception("ROM analysis exceeded %d states"%self.max_states)
+                    s = successors[i]
+                    on_stack.add(s)
+                    stack.append([s, self.step(s), 0])
+                    continue
+                pass
+            stack.pop()
+            on_stack.remove(state)
+            if successors is None:
+                values[state] = (None, None, 0, 0, True, None)
+                continue
+            if len(successors)==0:
+                values[state] = (cycles, cycles, reads, writes, False, None)
+                continue
+            best = None
+            worst = None
+            worst_reads = 0
+            worst_writes = 0
+            worst_state = None
+            can_hang = False
+            for s in successors:
+                if s not in values: # a cycle in the state graph - the program can spin forever
+                    can_hang = True
+                    continue
+                (s_best, s_worst, s_reads, s_writes, s_hang, _) = values[s]
+                can_hang = can_hang or s_hang
+                if s_best is None: continue
+                if (best is None) or (s_best<best): best = s_best
+                if (worst is None) or (s_worst>worst):
+                    (worst, worst_reads, worst_writes, worst_state) = (s_worst, s_reads, s_writes, s)
+                    pass
+                pass
+            if best is None:
+                values[state] = (None, None, 0, 0, True, None)
+                continue
+            values[state] = (best+cycles, worst+cycles, worst_reads+reads, worst_writes+writes, can_hang, worst_state)
+            pass
+        (best, worst, reads, writes, can_hang, _) = values[start]
+        return RomAnalysisResult(label=label, best_cycles=best, worst_cycles=worst, reads=reads, writes=writes,
+                                 can_hang=can_hang, hot_loops=self.hot_loops(values, start, num_hot_loops))
+    #f hot_loops
+    def hot_loops(self, values:Dict[Tuple,Tuple], start:Tuple, num_hot_loops:int) -> List[Tuple[int,int,int,int]]:
+        """
+        Find the backward branches of the worst-case path, and the
+        cycles spent in the code that they branch over
+        """
+        path = []
+        state = start
+        while state is not None:
+            path.append(state)
+            state = values[state][5]
+            pass
+        loops : Dict[Tuple[int,int],List[int]] = {}
+        for i in range(len(path)-1):
+            (pc, next_pc) = (path[i][0], path[i+1][0])
+            if next_pc<=pc:
+                k = (next_pc, pc)
+                if k not in loops: loops[k] = [0,0]
+                loops[k][1] += 1
+                pass
+            pass
+        for (pc_state, next_state) in zip(path, path[1:]+[None]):
+            pc = pc_state[0]
+            cycles = self.step(pc_state)[0]
+            for ((start_pc, end_pc), l) in loops.items():
+                if start_pc<=pc<=end_pc: l[0] += cycles
+                pass
+            pass
+        hot = [ (s, e, l[0], l[1]) for ((s,e),l) in loops.items() ]
+        hot.sort(key=lambda x:-x[2])
+        return hot[:num_hot_loops]
+    #f analyze_all
+    def analyze_all(self) -> List[RomAnalysisResult]:
+        """
+        Analyze the program from every label
+        """
+        labels = sorted(self.labels.items(), key=lambda x:x[1])
+        return [ self.analyze(l) for (l,a) in labels ]
+    #f report
+    def report(self) -> str:
+        return "\n".join([str(r) for r in self.analyze_all()])
+    pass
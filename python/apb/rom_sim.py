@@ -0,0 +1,221 @@
+#a Copyright
+#
+#  This file 'rom_sim.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from .rom    import Rom, CompiledProgam
+from .models import ApbTargetModel, ApbMemoryModel
+from typing import List, Optional, Tuple, Union
+
+#a Classes
+#c RomSimResult
+class RomSimResult(object):
+    """
+    Result of running a ROM program in the simulator
+
+    status is 'finished' if an op_finish was executed, 'timeout' if the
+    cycle or instruction limit was reached, or 'illegal' if an opcode
+    class that the processor cannot execute was fetched (the hardware
+    would stall forever).
+    """
+    status:str
+    address:int
+    cycles:int
+    instructions:int
+    apb_reads:int
+    apb_writes:int
+    apb_errors:int
+    def __init__(self, status:str, address:int, cycles:int, instructions:int, apb_reads:int, apb_writes:int, apb_errors:int):
+        self.status = status
+        self.address = address
+        self.cycles = cycles
+        self.instructions = instructions
+        self.apb_reads = apb_reads
+        self.apb_writes = apb_writes
+        self.apb_errors = apb_errors
+        pass
+    def __str__(self) -> str:
+        return "%s at %d after %d cycles, %d instructions, %d reads, %d writes, %d errors"%(
+            self.status, self.address, self.cycles, self.instructions,
+            self.apb_reads, self.apb_writes, self.apb_errors)
+    pass
+
+#c RomSim
+class RomSim(object):
+    """
+    Instruction-set simulator for apb_processor ROM programs
+
+    This executes a compiled ROM program (from Rom.compile_program)
+    with the semantics of apb_processor.cdl, performing the APB
+    requests on a transaction-level target model.
+
+    The processor state (APB address, accumulator, increment, repeat
+    count) persists between runs, as it does in the hardware; the
+    increment resets to 1.
+
+    Cycles are counted as the hardware does: every instruction takes
+    two cycles to fetch from the ROM and one to execute; an APB
+    request adds the select and enable phases plus any wait cycles
+    from the target; a wait adds one cycle per count plus one to
+    complete.
+
+    Branch-with-link sets the increment to the address following the
+    branch, and return branches to the increment, as documented for
+    the processor.
+    """
+    fetch_cycles = 2
+    execute_cycles = 1
+    apb_cycles = 2
+    wait_complete_cycles = 1
+    contents:List[Tuple[int,int,int]]
+    #f __init__
+    def __init__(self, compiled:CompiledProgam, target:Optional[ApbTargetModel]=None):
+        if target is None: target = ApbMemoryModel()
+        self.target = target
+        self.labels = dict(compiled.labels)
+        words = [0] * compiled.base_address + list(compiled.image)
+        self.contents = [ self.decode(d) for d in words ]
+        self.cycle = 0
+        self.reset()
+        pass
+    #f decode
+    @staticmethod
+    def decode(data:int) -> Tuple[int,int,int]:
+        return ((data>>37)&7, (data>>32)&7, data & 0xffffffff)
+    #f reset
+    def reset(self) -> None:
+        self.address = 0
+        self.accumulator = 0
+        self.increment = 1
+        self.repeat_count = 0
+        pass
+    #f resolve
+    def resolve(self, start:Union[int,str]) -> int:
+        if type(start)==int: return start
+        if start[-1]!=':': start = start+":"
+        return self.labels[start]
+    #f run
+    def run(self, start:Union[int,str], max_cycles:int=1000*1000, max_instructions:int=1000*1000) -> RomSimResult:
+        """
+        Run the program from an address (or label) until it finishes,
+        or until max_cycles or max_instructions is exceeded
+        """
+        pc = self.resolve(start)
+        contents = self.contents
+        num_words = len(contents)
+        transaction = self.target.transaction
+        address      = self.address
+        accumulator  = self.accumulator
+        increment    = self.increment
+        repeat_count = self.repeat_count
+        op_cycles    = self.fetch_cycles + self.execute_cycles
+        apb_cycles   = self.apb_cycles
+        wait_complete_cycles = self.wait_complete_cycles
+        cycle = self.cycle
+        end_cycle = cycle + max_cycles
+        start_cycle = cycle
+        instructions = 0
+        reads = 0
+        writes = 0
+        errors = 0
+        status = "timeout"
+        while (instructions<max_instructions) and (cycle<end_cycle):
+            if pc<num_words:
+                (opcode_class, subclass, arg) = contents[pc]
+                pass
+            else:
+                (opcode_class, subclass, arg) = (0,0,0)
+                pass
+            instructions += 1
+            cycle += op_cycles
+            next_pc = (pc + 1) & 0xffff
+            if opcode_class==0: # ALU
+                if   subclass==0: accumulator = accumulator | arg
+                elif subclass==1: accumulator = accumulator & arg
+                elif subclass==2: accumulator = accumulator & ~arg
+                elif subclass==3: accumulator = accumulator ^ arg
+                elif subclass==4: accumulator = (accumulator + arg) & 0xffffffff
+                pass
+            elif opcode_class==1: # Set parameter
+                if   subclass==0: address = arg
+                elif subclass==1: repeat_count = arg
+                elif subclass==2: accumulator = arg
+                elif subclass==3: increment = arg
+                pass
+            elif opcode_class==2: # APB request
+                req = subclass & 3
+                if req==0:
+                    (err, read_data, wait_cycles) = transaction(cycle, 0, address, 0)
+                    accumulator = read_data & 0xffffffff
+                    reads += 1
+                    pass
+                else:
+                    wdata = arg if req==1 else accumulator
+                    (err, read_data, wait_cycles) = transaction(cycle, 1, address, wdata)
+                    writes += 1
+                    pass
+                if err: errors += 1
+                cycle += apb_cycles + wait_cycles
+                if subclass & 4:
+                    address = (address + increment) & 0xffffffff
+                    pass
+                pass
+            elif opcode_class==3: # Branch
+                if subclass==0:
+                    next_pc = arg & 0xffff
+                    pass
+                elif subclass==1:
+                    if accumulator==0: next_pc = arg & 0xffff
+                    pass
+                elif subclass==2:
+                    if accumulator!=0: next_pc = arg & 0xffff
+                    pass
+                elif subclass==3:
+                    if repeat_count!=0: next_pc = arg & 0xffff
+                    repeat_count = (repeat_count - 1) & 0xffffffff
+                    pass
+                elif subclass==7:
+                    next_pc = increment & 0xffff
+                    pass
+                else:
+                    take = ( (subclass==4) or
+                             ((subclass==5) and (accumulator==0)) or
+                             ((subclass==6) and (accumulator!=0)) )
+                    increment = next_pc
+                    if take: next_pc = arg & 0xffff
+                    pass
+                pass
+            elif opcode_class==4: # Wait - uses the increment as a down-counter
+                cycle += arg + wait_complete_cycles
+                increment = 0
+                pass
+            elif opcode_class==5: # Finish
+                status = "finished"
+                break
+            else:
+                status = "illegal"
+                break
+            pc = next_pc
+            pass
+        self.address      = address
+        self.accumulator  = accumulator
+        self.increment    = increment
+        self.repeat_count = repeat_count
+        self.cycle = cycle
+        return RomSimResult(status=status, address=pc, cycles=cycle-start_cycle,
+                            instructions=instructions,
+                            apb_reads=reads, apb_writes=writes, apb_errors=errors)
+    pass
@@ -1,24 +1,96 @@
 #!/usr/bin/env python3
+import struct
+from array import array
 from cdl.utils.memory import Memory
-from typing import Dict, List, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
 
 #a Classes
 class CompiledScript(object):
-    contents:List[List[int]]
+    """
+    Compiled script, as a single growable bytearray of the script bytes
+
+    Ops are appended to the bytearray as they are compiled, and the
+    offset of the start of each op is recorded. The script may be
+    presented without copying using as_memoryview or chunks; while
+    such a view is held the script cannot be added to.
+    """
+    data:bytearray
+    offsets:array
+    optimization:Optional[Dict[str,int]]
     def __init__(self):
-        self.contents = []
+        self.data = bytearray()
+        self.offsets = array("L")
+        self.optimization = None
         pass
-    def add_contents(self, op:List[int]) -> None:
-        self.contents.append(op)
+    def __len__(self) -> int:
+        return len(self.data)
+    @property
+    def contents(self) -> List[List[int]]:
+        ends = list(self.offsets[1:]) + [len(self.data)]
+        return [ list(self.data[s:e]) for (s,e) in zip(self.offsets, ends) ]
+    def add_contents(self, op:Union[Sequence[int],bytes,bytearray]) -> None:
+        self.offsets.append(len(self.data))
+        self.data.extend(op)
         pass
-    def as_bytes(self) -> bytes:
-        r = bytearray()
-        for op in self.contents:
-            for b in op:
-                r.append(b)
+    def add_op_write(self, addr8:int, data_size:int, data:Sequence[int], inc:bool=False, page:Optional[int]=None) -> None:
+        """
+        Add writes of any number of data items, as ops of up to 8
+        writes each; the data is packed into the script in bulk
+
+        With inc the ops after the first start at addr8+8, addr8+16,
+        ...; an op takes the upper bytes of its address from the
+        address of the script master, so if an op would start on a
+        later 256-address page then set ops are added before it to
+        move the address to that page. This requires page, the
+        address of the script master (bits 31 to 8) before the writes;
+        if it is not given then such writes raise an exception.
+        """
+        mask = (1<<data_size)-1
+        packed = memoryview(struct.pack("<%d%s"%(len(data),Script.data_size_formats[data_size]), *[d&mask for d in data]))
+        db = data_size // 8
+        address = ((0 if page is None else page & 0xffffff) << 8) | (addr8 & 0xff)
+        current_page = address >> 8
+        for i in range(0, len(data), 8):
+            num = min(8, len(data)-i)
+            op_address = (address+i) & 0xffffffff if inc else address
+            if (op_address>>8)!=current_page:
+                if page is None:
+                    packed.release()
+                    raise Exception("Incrementing write of %d items from 0x%02x crosses a 256-address page, and the page is not given"%(len(data), addr8&0xff))
+                for b in range(1,4):
+                    if ((op_address>>(8*b))^(current_page>>(8*(b-1)))) & 0xff:
+                        self.add_contents(Script.op_set("addr%d"%b, op_address>>(8*b)))
+                        pass
+                    pass
+                current_page = op_address >> 8
                 pass
+            self.offsets.append(len(self.data))
+            self.data.extend(Script.op_write_header(op_address, data_size, num, inc))
+            self.data.extend(packed[i*db:(i+num)*db])
+            pass
+        packed.release()
+        pass
+    def as_memoryview(self) -> memoryview:
+        return memoryview(self.data)
+    def as_bytes(self) -> bytes:
+        return bytes(self.data)
+    def beats(self) -> Iterator[Tuple[int,int,bool]]:
+        """
+        Generate the script interface beats of the script (see
+        Script.beats), for ScriptSim.invoke_script_beats; DbgMaster
+        takes the script as bytes, not beats
+        """
+        return Script.beats((self.data,))
+    def chunks(self, size:int) -> Iterator[memoryview]:
+        """
+        Generate the script bytes as memoryviews of (at most) size bytes
+        """
+        view = memoryview(self.data)
+        for i in range(0, len(view), size):
+            yield view[i:i+size]
             pass
-        return bytes(r)
+        view.release()
+        pass
     pass
 #c Script
 class Script(object):
@@ -45,6 +117,11 @@ class Script(object):
         "inc": 32,
         "poll_set": 64,
         }
+
+    data_size_formats = {8:"B", 16:"H", 32:"I"}
+
+    # Cycles from the script master consuming the bytes of an instruction to the next being presented
+    data_latency = 2
     #f get_define_int
     @staticmethod
     def get_define_int(defines, k, default):
@@ -59,7 +136,7 @@ class Script(object):
                 data&0xff]
     #f op_poll_clr
     @classmethod
-    def op_poll_set(cls, addr8, bit=0):
+    def op_poll_clr(cls, addr8, bit=0):
         return [(cls.opcodes["opcode_class_poll"]<<6) |
                 cls.opcode_subclass["poll_clr"] |
                 (bit & 31),
@@ -81,31 +158,333 @@ class Script(object):
                 cls.opcode_subclass["data_size_"+str(data_size)] |
                 (((num-1)%8) << 2),
                 addr8&0xff]
-    #f op_write
+    #f op_write_header
     @classmethod
-    def op_write(cls, addr8, data_size, data=[], inc=False):
+    def op_write_header(cls, addr8, data_size, num, inc=False):
         opts = 0
         if inc: opts = cls.opcode_subclass["inc"]
+        return bytes(( (cls.opcodes["opcode_class_write"]<<6) |
+                       opts |
+                       cls.opcode_subclass["data_size_"+str(data_size)] |
+                       ((num-1) << 2),
+                       addr8&0xff ))
+    #f op_write
+    @classmethod
+    def op_write(cls, addr8, data_size, data=[], inc=False):
         num = len(data)
         if num==0 or num>8:
-            return []
-        r = []
-        r.append( (cls.opcodes["opcode_class_write"]<<6) |
-                  opts |
-                  cls.opcode_subclass["data_size_"+str(data_size)] |
-                  ((num-1) << 2) )
-        r.append(addr8&0xff)
-        db = data_size // 8
-        for d in data:
-            for i in range(db):
-                r.append(d&0xff)
-                d = d>>8
+            return bytearray()
+        r = bytearray(cls.op_write_header(addr8, data_size, num, inc))
+        fmt = cls.data_size_formats[data_size]
+        mask = (1<<data_size)-1
+        r.extend(struct.pack("<%d%s"%(num,fmt), *[d&mask for d in data]))
+        return r
+    #f beats
+    @staticmethod
+    def beats(script:Iterable[Union[Sequence[int],bytes,bytearray,memoryview]]) -> Iterator[Tuple[int,int,bool]]:
+        """
+        Generate the script interface beats (data, num_data_valid,
+        data_is_last) to present to the script master for a script,
+        given as ops or any other chunking of the script bytes
+
+        The script master discards any bytes of a beat that remain once
+        it has consumed some, so each beat carries exactly the bytes of
+        one instruction, or the data of one repeated write (up to six
+        bytes, with the first byte in the bottom of data). The script
+        ends with a beat with no data that is marked as last (a beat
+        that is consumed loses its last marking), unless the script
+        ends with a partial instruction; that is presented as the last
+        beat, so that the script master completes with an error.
+        """
+        pending = b""
+        repeats = 0
+        repeat_size = 0
+        for op in script:
+            view = memoryview(op) if isinstance(op,(bytes,bytearray,memoryview)) else memoryview(bytes(op))
+            if len(pending)>0: view = memoryview(pending+bytes(view))
+            n = len(view)
+            pos = 0
+            while pos<n:
+                if repeats>0:
+                    size = repeat_size
+                    pass
+                else:
+                    opcode = view[pos]
+                    size = 2
+                    if (opcode>>6)==3:
+                        repeat_size = 4 if (opcode&2) else ((opcode&3)+1)
+                        size = 2 + repeat_size
+                        pass
+                    pass
+                if pos+size>n: break
+                yield (int.from_bytes(view[pos:pos+size],"little"), size, False)
+                pos += size
+                if repeats>0:
+                    repeats -= 1
+                    pass
+                elif (opcode>>6)==3:
+                    repeats = (opcode>>2)&7
+                    pass
                 pass
+            pending = bytes(view[pos:])
             pass
-        return r
+        if len(pending)>0:
+            yield (int.from_bytes(pending,"little"), len(pending), True)
+            return
+        yield (0, 0, True)
+        pass
+    #f decode_op
+    @staticmethod
+    def decode_op(op:Sequence[int]) -> Tuple[int,int,int,int,int,List[int]]:
+        """
+        Decode an op into (opcode_class, data_size, inc, num, arg, data)
+        """
+        opcode = op[0]
+        opcode_class = opcode>>6
+        data_size = 32 if (opcode&2) else (8<<(opcode&1))
+        inc = (opcode>>5)&1
+        num = ((opcode>>2)&7) + 1
+        data = []
+        if opcode_class==3:
+            db = data_size//8
+            data = [int.from_bytes(bytes(op[2+i*db:2+(i+1)*db]),"little") for i in range(num)]
+            pass
+        return (opcode_class, data_size, inc, num, op[1], data)
+    #f optimize_script
+    @classmethod
+    def optimize_script(cls, script, address:Optional[int]=0, poll_delay:Optional[int]=64, poll_count:Optional[int]=16,
+                        pready_wait:Union[int,Callable[[Optional[int],int],int]]=0,
+                        inter_data_idle_cycles:int=0) -> Tuple[List[Sequence[int]],Dict[str,int]]:
+        """
+        Peephole optimization of a script
+
+        Set ops that do not change the address, poll delay or poll
+        count are dropped; the initial values are those after a start
+        with clear, and should be None for an unknown value (such as
+        for a script that is started without clearing the state).
+
+        Adjacent reads (or writes) of the same size are merged into
+        single ops of up to 8 transfers, either repeated to the same
+        address or incrementing through adjacent addresses; an
+        incrementing op is not allowed to cross a 256-byte boundary,
+        as the script master increments the whole APB address.
+
+        Returns the new ops and a report of the bytes, instructions
+        and cycles saved. The cycles before and after are the
+        ScriptAnalysis best case (polls succeeding first time) of the
+        scripts, with the pready_wait and inter_data_idle_cycles given
+        (as for ScriptAnalysis). Merged writes still take an interface
+        beat per data item, so save no cycles; dropped set ops and
+        merged reads save the beats of the instructions removed.
+        """
+        params = {2:poll_delay, 3:poll_count}
+        address_bytes = [None]*4
+        if address is not None: address_bytes = [(address>>(8*i))&0xff for i in range(4)]
+        ops = []
+        group = None
+        def flush_group():
+            if group is None: return
+            (opcode_class, data_size, inc, addr8, num, data) = group
+            if opcode_class==3:
+                ops.append(cls.op_write(addr8, data_size, data, inc=inc))
+                pass
+            else:
+                ops.append(cls.op_read(addr8, data_size, num, inc=inc))
+                pass
+            pass
+        script = [op for op in script if len(op)>0]
+        bytes_before = 0
+        instructions_before = 0
+        for op in script:
+            bytes_before += len(op)
+            instructions_before += 1
+            (opcode_class, data_size, inc, num, arg, data) = cls.decode_op(op)
+            if opcode_class==0:
+                param = (op[0]>>2)&3
+                if param<2:
+                    byte_sel = op[0]&3
+                    if byte_sel==0: continue
+                    if address_bytes[byte_sel]==arg: continue
+                    address_bytes[byte_sel] = arg
+                    pass
+                else:
+                    if params[param]==arg: continue
+                    params[param] = arg
+                    pass
+                flush_group()
+                group = None
+                ops.append(op)
+                continue
+            if opcode_class==1:
+                flush_group()
+                group = None
+                ops.append(op)
+                continue
+            if num==1: inc = None
+            if group is not None:
+                (g_class, g_size, g_inc, g_addr8, g_num, g_data) = group
+                merge = None
+                if (g_class==opcode_class) and (g_size==data_size) and (g_num+num<=8):
+                    if (arg==g_addr8) and (g_inc is not True) and (inc is not True):
+                        merge = False
+                        pass
+                    elif (arg==g_addr8+g_num) and (g_inc is not False) and (inc is not False) and (arg+num<=256):
+                        merge = True
+                        pass
+                    pass
+                if merge is not None:
+                    group = (g_class, g_size, merge, g_addr8, g_num+num, g_data+data)
+                    continue
+                flush_group()
+                pass
+            group = (opcode_class, data_size, inc, arg, num, data)
+            pass
+        flush_group()
+        bytes_after = sum([len(op) for op in ops])
+        from .script_analysis import ScriptAnalysis
+        analysis = ScriptAnalysis(pready_wait, inter_data_idle_cycles=inter_data_idle_cycles)
+        cycles_before = analysis.analyze(script, clear=address is not None).best_cycles
+        cycles_after = analysis.analyze(ops, clear=address is not None).best_cycles
+        report = {"bytes_before":bytes_before,
+                  "bytes_after":bytes_after,
+                  "bytes_saved":bytes_before - bytes_after,
+                  "instructions_saved":instructions_before - len(ops),
+                  "cycles_before":cycles_before,
+                  "cycles_after":cycles_after,
+                  "cycles_saved":cycles_before - cycles_after,
+                  }
+        return (ops, report)
+    #f access_of_tuple
+    @staticmethod
+    def access_of_tuple(access:Tuple) -> Tuple[str,int,Optional[int],Optional[int]]:
+        """
+        Convert an access to (kind, address, value or bit, data size)
+
+        An access is one of:
+        (register or address, value)
+        ("write", register or address, value [, data size])
+        ("read", register or address [, data size])
+        ("poll", register or address, bit)
+
+        where a register is a csr.Csr of an address map (such as
+        ApbAddressMap().gpio.output), and the data size of a read
+        defaults to 32.
+        """
+        if type(access[0])!=str: access = ("write",) + tuple(access)
+        kind = access[0]
+        address = access[1]
+        if hasattr(address, "Address"): address = address.Address()
+        if kind=="write":
+            size = access[3] if len(access)>3 else None
+            return (kind, address, access[2] & 0xffffffff, size)
+        if kind=="read":
+            return (kind, address, None, access[2] if len(access)>2 else 32)
+        if kind=="poll":
+            return (kind, address, access[2], None)
+        raise Exception("Unknown script access kind '%s'"%kind)
+    #f group_of_accesses
+    @staticmethod
+    def group_of_accesses(accesses:List[Tuple[str,int,Optional[int],Optional[int]]]) -> Optional[Tuple[int,int,bool]]:
+        """
+        Determine if accesses can be performed by a single op, and if so
+        return (script bytes, data size, inc)
+        """
+        (kind, address, value, size) = accesses[0]
+        if kind=="poll":
+            if len(accesses)>1: return None
+            return (2, 0, False)
+        inc = False
+        if len(accesses)>1:
+            if len(accesses)>8: return None
+            inc = accesses[1][1]==address+1
+            for (i,(k,a,v,s)) in enumerate(accesses):
+                if k!=kind: return None
+                if (a>>8)!=(address>>8): return None
+                if a!=(address+i if inc else address): return None
+                if (kind=="read") and (s!=size): return None
+                pass
+            pass
+        if kind=="read": return (2, size, inc)
+        size = 8
+        for (k,a,v,s) in accesses:
+            if s is not None:
+                size = max(size, s)
+                pass
+            elif v>=0x10000:
+                size = 32
+                pass
+            elif v>=0x100:
+                size = max(size, 16)
+                pass
+            pass
+        return (2+len(accesses)*(size//8), size, inc)
+    #f script_of_accesses
+    @classmethod
+    def script_of_accesses(cls, accesses:Iterable[Tuple], clear:bool=True) -> List[Sequence[int]]:
+        """
+        Generate the smallest script for a list of accesses (see
+        access_of_tuple), in order
+
+        The upper address bytes are set as required (all of them at
+        the start if the script is started without clear). Writes use
+        the smallest data size that holds their values, and adjacent
+        accesses of the same kind to one address, or to successive
+        addresses within a 256-byte page, are grouped into single ops;
+        the grouping is chosen to minimize the script size. Polls wait
+        for the bit to be set, as that is all that the script master
+        supports.
+        """
+        items = [cls.access_of_tuple(a) for a in accesses]
+        n = len(items)
+        best_bytes = [0] + [None]*n
+        best_start = [0]*(n+1)
+        groups = [None]*(n+1)
+        for j in range(1,n+1):
+            for i in range(j-1, max(-1,j-9), -1):
+                g = cls.group_of_accesses(items[i:j])
+                if g is None: break
+                if (best_bytes[j] is None) or (best_bytes[i]+g[0]<best_bytes[j]):
+                    best_bytes[j] = best_bytes[i] + g[0]
+                    best_start[j] = i
+                    groups[j] = g
+                    pass
+                pass
+            pass
+        group_list = []
+        j = n
+        while j>0:
+            group_list.append((best_start[j], j, groups[j]))
+            j = best_start[j]
+            pass
+        group_list.reverse()
+        ops = []
+        address_bytes = [0,0,0,0] if clear else [None,None,None,None]
+        for (i, j, (nbytes, size, inc)) in group_list:
+            (kind, address, value, _) = items[i]
+            for b in range(1,4):
+                if address_bytes[b]!=(address>>(8*b))&0xff:
+                    address_bytes[b] = (address>>(8*b))&0xff
+                    ops.append(cls.op_set("addr%d"%b, address_bytes[b]))
+                    pass
+                pass
+            if kind=="poll":
+                ops.append(cls.op_poll_set(address, value))
+                pass
+            elif kind=="read":
+                ops.append(cls.op_read(address, size, j-i, inc=inc))
+                pass
+            else:
+                ops.append(cls.op_write(address, size, [v for (k,a,v,s) in items[i:j]], inc=inc))
+                pass
+            pass
+        return ops
+    #f compile_accesses
+    @classmethod
+    def compile_accesses(cls, accesses:Iterable[Tuple], clear:bool=True) -> CompiledScript:
+        return cls.compile_script(cls.script_of_accesses(accesses, clear=clear))
     #f compile_script
     @staticmethod
-    def compile_script(script):
+    def compile_script(script, optimize:bool=False, **kwargs):
         """
         Compile of a script (single pass)
 
@@ -117,8 +496,17 @@ class Script(object):
         op_poll_set(addr,bit)
         op_read(addr,8|16|32,[N])
         op_write(addr,8|16|32,data_list)
+
+        The ops may be lists of bytes or bytes-like objects.
+
+        If optimize is True then the script is first passed through
+        optimize_script (with any kwargs), and its report is kept as
+        the optimization of the compiled script.
         """
         compiled = CompiledScript()
+        if optimize:
+            (script, compiled.optimization) = Script.optimize_script(script, **kwargs)
+            pass
         for op in script:
             compiled.add_contents(op)
             pass
@@ -0,0 +1,238 @@
+#a Copyright
+#
+#  This file 'script_analysis.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from .script import Script, CompiledScript
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+#a Classes
+#c ScriptOpCost
+class ScriptOpCost(object):
+    """
+    Cycles of one instruction of a script
+
+    cycles is from the instruction being presented to the next being
+    presented (or the end of the script); of these, apb_cycles are
+    with psel asserted (apb_request and apb_request_wait), poll_delay_cycles
+    are between poll attempts (poll_delay), and starved_cycles are
+    spent waiting for script bytes from the interface (do_instruction
+    or apb_request_wait with too few bytes).
+    """
+    def __init__(self, offset:int, start:int, description:str):
+        self.offset = offset
+        self.start = start
+        self.description = description
+        self.cycles = 0
+        self.transfers = 0
+        self.apb_cycles = 0
+        self.poll_delay_cycles = 0
+        self.starved_cycles = 0
+        pass
+    def __str__(self) -> str:
+        return "%5d: %-28s %6d cycles (%d transfers, %d apb, %d poll delay, %d starved)"%(
+            self.offset, self.description, self.cycles, self.transfers,
+            self.apb_cycles, self.poll_delay_cycles, self.starved_cycles)
+    pass
+
+#c ScriptAnalysisResult
+class ScriptAnalysisResult(object):
+    """
+    Result of a static cycle estimate of a script
+
+    best_cycles has every poll succeeding on its first attempt, and
+    worst_cycles has every poll succeeding on its last attempt (after
+    poll_count retries, each of poll_delay cycles); best_ops and
+    worst_ops are the per-instruction breakdowns of these.
+    poll_fail_cycles is the most cycles until a poll of the script
+    fails (or None if the script has no polls).
+    """
+    best_cycles:int
+    worst_cycles:int
+    poll_fail_cycles:Optional[int]
+    best_ops:List[ScriptOpCost]
+    worst_ops:List[ScriptOpCost]
+    def __init__(self, best:Tuple[int,List[ScriptOpCost],Optional[int]], worst:Tuple[int,List[ScriptOpCost],Optional[int]]):
+        (self.best_cycles, self.best_ops, _) = best
+        (self.worst_cycles, self.worst_ops, self.poll_fail_cycles) = worst
+        pass
+    def __str__(self) -> str:
+        r = "%d to %d cycles"%(self.best_cycles, self.worst_cycles)
+        if self.poll_fail_cycles is not None: r += ", poll failure by %d cycles"%self.poll_fail_cycles
+        for o in self.worst_ops:
+            r += "\n" + str(o)
+            pass
+        return r
+    pass
+
+#c ScriptAnalysis
+class ScriptAnalysis(object):
+    """
+    Static cycle estimate for apb_script_master scripts
+
+    The timing is that of the script FSM (as executed by ScriptSim):
+    the instruction bytes are consumed in do_instruction, and the
+    client presents the next bytes Script.data_latency cycles (plus
+    inter_data_idle_cycles) later; an APB transfer takes select and
+    enable cycles plus pready_wait cycles in apb_request (or
+    apb_request_poll), and one cycle back in do_instruction or
+    apb_request_wait; a failed poll spends poll_delay+1 cycles in
+    poll_delay and one more to restart the request.
+
+    pready_wait may be an int or a function of (address,
+    write_not_read), where the address is None if the script does not
+    set all the upper address bytes after a start without clear. The
+    poll delay and count are taken to be their maximum (255) until set,
+    for a start without clear.
+    """
+    #f __init__
+    def __init__(self,
+                 pready_wait:Union[int,Callable[[Optional[int],int],int]]=0,
+                 inter_data_idle_cycles:int=0):
+        if type(pready_wait)==int:
+            wait = pready_wait
+            pready_wait = lambda address, write_not_read:wait
+            pass
+        self.pready_wait = pready_wait
+        self.inter_data_idle_cycles = inter_data_idle_cycles
+        pass
+    #f describe
+    @staticmethod
+    def describe(data:int) -> str:
+        opcode = data & 0xff
+        arg = (data>>8) & 0xff
+        opcode_class = opcode>>6
+        if opcode_class==0:
+            param = (opcode>>2)&3
+            if param==2: return "set poll_delay %d"%arg
+            if param==3: return "set poll_count %d"%arg
+            return "set addr%d 0x%02x"%(opcode&3, arg)
+        if opcode_class==1:
+            return "poll 0x%02x bit %d"%(arg, opcode&31)
+        size = 32 if (opcode&2) else (8<<(opcode&1))
+        num = ((opcode>>2)&7) + 1
+        r = "%s%d 0x%02x"%("write" if opcode_class==3 else "read", size, arg)
+        if num>1: r += " x%d"%num
+        if opcode & 0x20: r += " inc"
+        return r
+    #f walk
+    def walk(self, beats:Iterable[Tuple[int,int,bool]], worst:bool, clear:bool) -> Tuple[int,List[ScriptOpCost],Optional[int]]:
+        """
+        Walk the beats of a script with polls succeeding on their first
+        (or, if worst, last) attempt, and return (cycles, op costs,
+        poll failure cycles)
+        """
+        latency = Script.data_latency + self.inter_data_idle_cycles
+        address_bytes = [0,0,0,0] if clear else [None,None,None,None]
+        poll_delay = 64 if clear else 255
+        poll_count = 16 if clear else 255
+        ops : List[ScriptOpCost] = []
+        poll_fail_cycles = None
+        beats = iter(beats)
+        ready = 1
+        data_ready = latency
+        offset = 0
+        t = 0
+        while True:
+            t = max(ready, data_ready)
+            if len(ops)>0: ops[-1].starved_cycles += max(0, data_ready-ready)
+            (data, num_data_valid, data_is_last) = next(beats, (0,0,True))
+            if data_is_last and (num_data_valid==0): break
+            op = ScriptOpCost(offset, t, self.describe(data))
+            ops.append(op)
+            offset += num_data_valid
+            data_ready = t + latency
+            opcode = data & 0xff
+            opcode_class = opcode>>6
+            size = opcode & 3
+            size_bytes = 4 if (size&2) else (size+1)
+            if num_data_valid < (2+size_bytes if opcode_class==3 else 2):
+                ready = t+1
+                if data_is_last: break
+                continue
+            arg = (data>>8) & 0xff
+            paddr = None if (address_bytes[1] is None or address_bytes[2] is None or address_bytes[3] is None) else (
+                (address_bytes[3]<<24) | (address_bytes[2]<<16) | (address_bytes[1]<<8) | arg)
+            if opcode_class==0:
+                param = (opcode>>2)&3
+                if param==2:
+                    poll_delay = arg
+                    pass
+                elif param==3:
+                    poll_count = arg
+                    pass
+                elif (opcode&3)>0:
+                    address_bytes[opcode&3] = arg
+                    pass
+                ready = t+1
+                continue
+            if opcode_class==1:
+                w = self.pready_wait(paddr, 0)
+                attempt_cycles = w+1 + poll_delay+2
+                retries = poll_count if worst else 0
+                op.transfers = retries+1
+                op.apb_cycles = (retries+1)*(2+w)
+                op.poll_delay_cycles = retries*(poll_delay+2)
+                fail = t + 1 + poll_count*attempt_cycles + 1 + w
+                if (poll_fail_cycles is None) or (fail>poll_fail_cycles): poll_fail_cycles = fail
+                ready = t + 1 + retries*attempt_cycles + 2 + w
+                continue
+            write_not_read = opcode_class & 1
+            num_ops = ((opcode>>2)&7) + 1
+            inc = (opcode>>5)&1
+            start_cycle = t+1
+            for i in range(num_ops):
+                if i>0:
+                    start_cycle = ready + 1
+                    if write_not_read:
+                        start_cycle = max(ready, data_ready)
+                        op.starved_cycles += max(0, data_ready-ready)
+                        (wdata, num_data_valid, data_is_last) = next(beats, (0,0,True))
+                        offset += num_data_valid
+                        data_ready = start_cycle + latency
+                        start_cycle += 1
+                        pass
+                    if inc and (paddr is not None): paddr = (paddr+1) & 0xffffffff
+                    pass
+                w = self.pready_wait(paddr, write_not_read)
+                op.transfers += 1
+                op.apb_cycles += 2+w
+                ready = start_cycle + 1 + w + 1
+                pass
+            pass
+        end = t + 1
+        for (o, n) in zip(ops, ops[1:]+[None]):
+            o.cycles = (end if n is None else n.start) - o.start
+            pass
+        return (end, ops, poll_fail_cycles)
+    #f analyze
+    def analyze(self, script:Union[Iterable[Iterable[int]],bytes,bytearray,memoryview], clear:bool=True) -> ScriptAnalysisResult:
+        """
+        Estimate the cycles of a script (ops, a CompiledScript, or
+        bytes), started with or without clear
+        """
+        if isinstance(script, CompiledScript):
+            beats = lambda : script.beats()
+            pass
+        elif isinstance(script, (bytes, bytearray, memoryview)):
+            beats = lambda : Script.beats((script,))
+            pass
+        else:
+            beats = lambda : Script.beats(script)
+            pass
+        return ScriptAnalysisResult(best=self.walk(beats(), worst=False, clear=clear),
+                                    worst=self.walk(beats(), worst=True, clear=clear))
+    pass
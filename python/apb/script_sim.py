@@ -0,0 +1,222 @@
+#a Copyright
+#
+#  This file 'script_sim.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from .script import Script
+from .models import ApbTargetModel, ApbMemoryModel
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+#a Classes
+#c ScriptSim
+class ScriptSim(object):
+    """
+    Executor for apb_script_master byte scripts
+
+    This interprets the byte stream of a script (from
+    Script.compile_script(...).as_bytes()) with the semantics of
+    apb_script_master.cdl, performing the APB requests on a
+    transaction-level target model.
+
+    invoke_script_bytes returns the same (completion, data_returned)
+    as DbgMaster.invoke_script_bytes; the completion is 'ok',
+    'errored' (the script ended part way through an instruction),
+    'poll_failed', or 'timeout'. Read data is returned masked to the
+    size of the read; polls return no data.
+
+    The cycles that the script master would take are recorded in @a
+    cycles, and those with psel asserted in @a apb_cycles. The timing
+    follows the script FSM: an instruction executes in the cycle after
+    its bytes are presented, and the client must present the next
+    bytes after seeing them consumed, so they are available two
+    cycles (plus any inter-data idle cycles) later. An APB transfer
+    takes a select and an enable cycle plus target wait cycles, and
+    the FSM takes one more cycle to return to do_instruction or
+    apb_request_wait. A failed poll spends poll_delay+1 cycles in
+    poll_delay before retrying, and the poll is attempted poll_count+1
+    times.
+
+    Note that the hardware uses opcode bit 6 as the poll type, so
+    (since that is part of the opcode class) all polls wait for the
+    bit to be set.
+    """
+    data_latency = Script.data_latency
+    #f __init__
+    def __init__(self, target:Optional[ApbTargetModel]=None):
+        if target is None: target = ApbMemoryModel()
+        self.target = target
+        self.address = 0
+        self.poll_delay = 0
+        self.poll_count = 0
+        self.cycle = 0
+        self.cycles = 0
+        self.apb_cycles = 0
+        self.apb_transfers = 0
+        pass
+    #f invoke_script_bytes
+    def invoke_script_bytes(self, script_bytes:Union[bytes,bytearray,memoryview],
+                            inter_data_idle_cycles:Union[None,int,Callable[[],int]]=None,
+                            timeout:Optional[int]=None,
+                            clear:bool=True) -> Tuple[str,List[int]]:
+        """
+        Execute the script, starting with a clear of the script state
+        (address 0, poll count 16, poll delay 64) unless clear is False
+        """
+        return self.invoke_script_beats(Script.beats((script_bytes,)), inter_data_idle_cycles, timeout, clear)
+    #f invoke_script_beats
+    def invoke_script_beats(self, beats:Iterable[Tuple[int,int,bool]],
+                            inter_data_idle_cycles:Union[None,int,Callable[[],int]]=None,
+                            timeout:Optional[int]=None,
+                            clear:bool=True) -> Tuple[str,List[int]]:
+        """
+        Execute a script presented as script interface beats (from
+        Script.beats or CompiledScript.beats), consuming them as the
+        script master would
+        """
+        if inter_data_idle_cycles is None:
+            idle = lambda : 0
+            pass
+        elif type(inter_data_idle_cycles)==int:
+            idle = lambda : inter_data_idle_cycles
+            pass
+        else:
+            idle = inter_data_idle_cycles
+            pass
+        if clear:
+            self.address = 0
+            self.poll_count = 16
+            self.poll_delay = 64
+            pass
+        beats = iter(beats)
+        transaction = self.target.transaction
+        start = self.cycle
+        ready = start + 1
+        data_ready = start + self.data_latency + idle()
+        apb_cycles = 0
+        transfers = 0
+        data_returned = []
+        completion = "ok"
+        while True:
+            t = max(ready, data_ready)
+            if (timeout is not None) and (t-start>timeout):
+                completion = "timeout"
+                break
+            (data, num_data_valid, data_is_last) = next(beats, (0,0,True))
+            if data_is_last and (num_data_valid==0):
+                break
+            opcode = data & 0xff
+            opcode_class = opcode>>6
+            size = opcode & 3
+            size_bytes = 4 if (size&2) else (size+1)
+            bytes_required = 2
+            if opcode_class==3: bytes_required = 2+size_bytes
+            if num_data_valid<bytes_required:
+                if data_is_last:
+                    completion = "errored"
+                    break
+                data_ready = t + self.data_latency + idle()
+                continue
+            arg = (data>>8) & 0xff
+            paddr = (self.address & 0xffffff00) | arg
+            data_ready = t + self.data_latency + idle()
+            if opcode_class==0: # Set parameter
+                param = (opcode>>2)&3
+                if param==2:
+                    self.poll_delay = arg
+                    pass
+                elif param==3:
+                    self.poll_count = arg
+                    pass
+                else:
+                    byte_sel = opcode & 3
+                    if byte_sel>0:
+                        shift = 8*byte_sel
+                        self.address = (self.address & ~(0xff<<shift)) | (arg<<shift)
+                        pass
+                    pass
+                ready = t+1
+                continue
+            if opcode_class==1: # Poll
+                mask = 1<<(opcode&31)
+                poll_type = (opcode>>6)&1
+                downcount = self.poll_count
+                start_cycle = t+1
+                while True:
+                    (err, read_data, wait_cycles) = transaction(start_cycle, 0, paddr, 0)
+                    transfers += 1
+                    apb_cycles += 2 + wait_cycles
+                    complete_cycle = start_cycle + 1 + wait_cycles
+                    if poll_type == ((read_data & mask)!=0):
+                        ready = complete_cycle+1
+                        break
+                    if downcount==0:
+                        ready = complete_cycle
+                        completion = "poll_failed"
+                        break
+                    downcount -= 1
+                    start_cycle = complete_cycle + 1 + self.poll_delay + 1
+                    if (timeout is not None) and (start_cycle-start>timeout):
+                        ready = start_cycle
+                        completion = "timeout"
+                        break
+                    pass
+                if completion!="ok": break
+                continue
+            # Read or write, possibly repeated, possibly incrementing
+            write_not_read = opcode_class & 1
+            num_ops = ((opcode>>2)&7) + 1
+            inc = (opcode>>5)&1
+            size_mask = 0xffffffff if (size&2) else ((1<<(8*size_bytes))-1)
+            wdata = data>>16
+            start_cycle = t+1
+            for i in range(num_ops):
+                if i>0:
+                    start_cycle = ready + 1
+                    if write_not_read:
+                        while True:
+                            start_cycle = max(ready, data_ready)
+                            (wdata, num_data_valid, data_is_last) = next(beats, (0,0,True))
+                            data_ready = start_cycle + self.data_latency + idle()
+                            if (num_data_valid>=size_bytes) or data_is_last: break
+                            ready = start_cycle
+                            pass
+                        if num_data_valid<size_bytes:
+                            completion = "errored"
+                            break
+                        start_cycle += 1
+                        pass
+                    if inc: paddr = (paddr+1) & 0xffffffff
+                    pass
+                if write_not_read:
+                    (err, read_data, wait_cycles) = transaction(start_cycle, 1, paddr, wdata & size_mask)
+                    pass
+                else:
+                    (err, read_data, wait_cycles) = transaction(start_cycle, 0, paddr, 0)
+                    data_returned.append(read_data & size_mask)
+                    pass
+                transfers += 1
+                apb_cycles += 2 + wait_cycles
+                ready = start_cycle + 1 + wait_cycles + 1
+                pass
+            if completion!="ok": break
+            pass
+        end = max(ready, data_ready)
+        self.cycle = end + 1
+        self.cycles = end + 1 - start
+        self.apb_cycles = apb_cycles
+        self.apb_transfers = transfers
+        return (completion, data_returned)
+    pass
@@ -0,0 +1,144 @@
+#a Copyright
+#
+#  This file 'sram_access.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+from array import array
+from .bfm import ApbMaster, word_view
+from typing import Any, List, Optional, Tuple
+
+try:
+    import numpy
+    pass
+except ImportError:
+    numpy = None
+    pass
+
+#a Functions
+#f new_words
+def new_words(count:int) -> Any:
+    """
+    Allocate a buffer of count 32-bit words - a numpy uint32 array if
+    numpy is available, else an array('I')
+    """
+    if numpy is not None: return numpy.zeros(count, dtype=numpy.uint32)
+    return array("I", bytes(4*count))
+
+#f contiguous_word_view
+def contiguous_word_view(buffer:Any) -> memoryview:
+    """
+    Return a memoryview of 32-bit words onto a buffer, as word_view
+    does; a buffer that is not C-contiguous (such as a strided slice of
+    a numpy array) is copied, in order, to bytes first
+    """
+    m = memoryview(buffer)
+    if not m.c_contiguous: m = memoryview(m.tobytes())
+    return word_view(m)
+
+#f mismatch_ranges
+def mismatch_ranges(actual:Any, expected:Any, chunk_words:int=256) -> List[Tuple[int,int]]:
+    """
+    Compare two buffers of 32-bit words (of the same length), and
+    return the (start, end) word ranges where they differ
+
+    Either buffer may be non-contiguous, in which case it is copied
+    (see contiguous_word_view). With numpy the comparison is vectorised; otherwise chunks of the
+    buffers are compared as bytes, and only differing chunks are
+    compared word by word.
+    """
+    a = contiguous_word_view(actual)
+    e = contiguous_word_view(expected)
+    if len(a)!=len(e): raise Exception("Cannot compare %d words with %d words"%(len(a),len(e)))
+    if numpy is not None:
+        differ = numpy.flatnonzero(numpy.frombuffer(a, dtype=numpy.uint32) != numpy.frombuffer(e, dtype=numpy.uint32))
+        if len(differ)==0: return []
+        breaks = numpy.flatnonzero(numpy.diff(differ)>1)
+        starts = numpy.concatenate(([differ[0]], differ[breaks+1]))
+        ends = numpy.concatenate((differ[breaks]+1, [differ[-1]+1]))
+        return [(int(s),int(n)) for (s,n) in zip(starts, ends)]
+    ranges : List[Tuple[int,int]] = []
+    ab = a.cast("B")
+    eb = e.cast("B")
+    for c in range(0, len(a), chunk_words):
+        n = min(c+chunk_words, len(a))
+        if ab[4*c:4*n]==eb[4*c:4*n]: continue
+        for i in range(c, n):
+            if a[i]==e[i]: continue
+            if (len(ranges)>0) and (ranges[-1][1]==i):
+                ranges[-1] = (ranges[-1][0], i+1)
+                pass
+            else:
+                ranges.append((i, i+1))
+                pass
+            pass
+        pass
+    return ranges
+
+#a Classes
+#c SramAccess
+class SramAccess(object):
+    """
+    Bulk access to the SRAM behind an SramInterfaceAddressMap through
+    an ApbMaster (or ApbModelMaster)
+
+    Blocks are transferred with one write of the address register and
+    back-to-back transfers to data_inc.
+    """
+    #f __init__
+    def __init__(self, apb:ApbMaster, sram:Any):
+        self.apb = apb
+        self.address_reg = sram.address.Address()
+        self.data_inc_reg = sram.data_inc.Address()
+        pass
+    #f load
+    def load(self, address:int, buffer:Any, allow_error:bool=False) -> int:
+        """
+        Write a buffer of 32-bit words to the SRAM at address, returning
+        the number of errored transfers
+        """
+        self.apb.write(self.address_reg, address, allow_error=allow_error)
+        return self.apb.write_block(self.data_inc_reg, buffer, stride=0, allow_error=allow_error)
+    #f dump
+    def dump(self, address:int, count:int, out:Optional[Any]=None, allow_error:bool=False) -> Any:
+        """
+        Read count 32-bit words of the SRAM from address into out (any
+        writable buffer of at least count words), or into a new buffer
+        from new_words, and return the buffer
+        """
+        if out is None: out = new_words(count)
+        self.apb.write(self.address_reg, address, allow_error=allow_error)
+        return self.apb.read_block(self.data_inc_reg, count, stride=0, out=out, allow_error=allow_error)
+    #f verify
+    def verify(self, address:int, expected:Any, out:Optional[Any]=None, allow_error:bool=False) -> List[Tuple[int,int]]:
+        """
+        Dump the SRAM from address and compare it with the expected
+        words, returning the (start, end) SRAM address ranges that
+        do not match
+        """
+        count = len(contiguous_word_view(expected))
+        actual = self.dump(address, count, out=out, allow_error=allow_error)
+        actual = word_view(actual)[:count]
+        return [(address+s, address+e) for (s,e) in mismatch_ranges(actual, expected)]
+    #f mismatch_report
+    @staticmethod
+    def mismatch_report(ranges:List[Tuple[int,int]]) -> str:
+        if len(ranges)==0: return "SRAM matches"
+        r = "SRAM mismatches in %d words:"%(sum([e-s for (s,e) in ranges]))
+        for (s,e) in ranges:
+            r += "\n    0x%08x..0x%08x (%d words)"%(s, e-1, e-s)
+            pass
+        return r
+    pass
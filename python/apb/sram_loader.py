@@ -0,0 +1,315 @@
+#a Copyright
+#
+#  This file 'sram_loader.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+import sys
+from array import array
+from .rom     import Rom
+from .rom_sim import RomSim
+from .script  import Script
+from .script_analysis import ScriptAnalysis
+from .target_sram_interface import SramInterfaceModel
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+#a Functions
+#f words_of_image
+def words_of_image(image:Union[bytes,bytearray,memoryview,array,Sequence[int]]) -> array:
+    """
+    Convert an image (bytes-like, little-endian and padded with zeros
+    to a whole number of words, or a sequence of 32-bit words) to an
+    array of 32-bit words
+    """
+    if isinstance(image, array) and (image.itemsize==4) and (image.typecode in "IL"):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        data = bytes(memoryview(image).cast("B"))
+        data += bytes((-len(data)) & 3)
+        words = array("I")
+        words.frombytes(data)
+        if sys.byteorder=="big": words.byteswap()
+        return words
+    return array("I", [w & 0xffffffff for w in image])
+
+#a Classes
+#c SramLoadReport
+class SramLoadReport(object):
+    """
+    Summary of an SRAM load; regions are (method, first word, number of
+    words) where the method is 'inc' (set the address then stream to
+    data_inc) or 'window' (set the address once per 128-word window
+    and write to data_window)
+    """
+    words:int
+    words_written:int
+    words_skipped:int
+    regions:List[Tuple[str,int,int]]
+    estimated_cycles:int
+    def __init__(self, words:int, regions:List[Tuple[str,int,int]], estimated_cycles:int):
+        self.words = words
+        self.regions = regions
+        self.words_written = sum([n for (m,s,n) in regions])
+        self.words_skipped = words - self.words_written
+        self.estimated_cycles = estimated_cycles
+        pass
+    #f load_time
+    def load_time(self, clock_hz:float) -> float:
+        return self.estimated_cycles / clock_hz
+    def __str__(self) -> str:
+        r = "%d of %d words written (%d skipped) in %d regions, %d cycles"%(
+            self.words_written, self.words, self.words_skipped, len(self.regions), self.estimated_cycles)
+        for (method, start, num) in self.regions:
+            r += "\n    %-6s %6d words at +0x%x"%(method, num, start)
+            pass
+        return r
+    pass
+
+#c SramLoader
+class SramLoader(object):
+    """
+    Generate a Rom program or a Script that loads an image into the
+    SRAM behind an SramInterfaceAddressMap
+
+    The image is written at SRAM word address base_address; words that
+    match the baseline image (or, with no baseline, words that are zero
+    when skip_zero is set) are not written, except that gaps of up to
+    max_gap words between changed words are written anyway (they are
+    cheaper to write than to skip).
+
+    Changed words that are close enough to share 128-word windows are
+    grouped into clusters; each cluster is written either by setting
+    the SRAM address and streaming to data_inc, or by setting the SRAM
+    address once per window and writing to data_window, whichever the
+    cycle model finds faster. The cycle model is that of RomSim for
+    programs and ScriptAnalysis for scripts, with pready_wait (an int
+    or function of (address, write_not_read)) defaulting to the
+    SramInterfaceModel wait cycles.
+    """
+    window_size = 128
+    #f __init__
+    def __init__(self, sram:Any,
+                 image:Union[bytes,bytearray,memoryview,array,Sequence[int]],
+                 base_address:int=0,
+                 baseline:Optional[Union[bytes,bytearray,memoryview,array,Sequence[int]]]=None,
+                 skip_zero:bool=True,
+                 max_gap:int=2,
+                 pready_wait:Optional[Union[int,Callable[[Optional[int],int],int]]]=None,
+                 inter_data_idle_cycles:int=0):
+        self.address_reg     = sram.address.Address()
+        self.control_reg     = sram.control.Address()
+        self.data_inc_reg    = sram.data_inc.Address()
+        self.data_window_reg = sram.data_window.Address()
+        self.image = words_of_image(image)
+        self.baseline = None if baseline is None else words_of_image(baseline)
+        self.base_address = base_address
+        self.skip_zero = skip_zero
+        self.max_gap = max_gap
+        if pready_wait is None:
+            pready_wait = self.sram_pready_wait
+            pass
+        elif type(pready_wait)==int:
+            wait = pready_wait
+            pready_wait = lambda address, write_not_read:wait
+            pass
+        self.pready_wait = pready_wait
+        self.inter_data_idle_cycles = inter_data_idle_cycles
+        self.report : Optional[SramLoadReport] = None
+        pass
+    #f sram_pready_wait
+    def sram_pready_wait(self, address:Optional[int], write_not_read:int) -> int:
+        """
+        Wait cycles of the SRAM interface - data accesses only
+        """
+        if address is None: return 0
+        if address in [self.address_reg, self.control_reg]: return 0
+        return SramInterfaceModel.write_wait_cycles if write_not_read else SramInterfaceModel.read_wait_cycles
+    #f changed_runs
+    def changed_runs(self) -> List[Tuple[int,int]]:
+        """
+        Find the (start, end) word ranges of the image that must be
+        written, with gaps of up to max_gap words merged
+        """
+        image = self.image
+        n = len(image)
+        if self.baseline is not None:
+            reference = array("I", self.baseline[:n])
+            if len(reference)<n: unknown_from = len(reference)
+            else: unknown_from = n
+            reference.extend(array("I",[0])*(n-len(reference)))
+            pass
+        elif self.skip_zero:
+            reference = array("I",[0])*n
+            unknown_from = n
+            pass
+        else:
+            return [(0,n)] if n>0 else []
+        image_bytes = memoryview(image).cast("B")
+        reference_bytes = memoryview(reference).cast("B")
+        runs : List[Tuple[int,int]] = []
+        chunk = 64
+        start = None
+        last = None
+        for c in range(0, unknown_from, chunk):
+            e = min(c+chunk, unknown_from)
+            if image_bytes[4*c:4*e]==reference_bytes[4*c:4*e]: continue
+            for i in range(c, e):
+                if image[i]==reference[i]: continue
+                if (last is not None) and (i-last-1<=self.max_gap):
+                    last = i
+                    continue
+                if start is not None: runs.append((start, last+1))
+                start = i
+                last = i
+                pass
+            pass
+        if unknown_from<n:
+            if (last is not None) and (unknown_from-last-1<=self.max_gap):
+                last = n-1
+                pass
+            else:
+                if start is not None: runs.append((start, last+1))
+                start = unknown_from
+                last = n-1
+                pass
+            pass
+        if start is not None: runs.append((start, last+1))
+        return runs
+    #f clusters
+    def clusters(self, runs:List[Tuple[int,int]]) -> List[List[Tuple[int,int]]]:
+        """
+        Group runs that are close enough to share a window
+        """
+        clusters : List[List[Tuple[int,int]]] = []
+        for (s,e) in runs:
+            if (len(clusters)>0) and (s-clusters[-1][-1][1]<self.window_size):
+                clusters[-1].append((s,e))
+                pass
+            else:
+                clusters.append([(s,e)])
+                pass
+            pass
+        return clusters
+    #f accesses_inc
+    def accesses_inc(self, cluster:List[Tuple[int,int]]) -> List[Tuple[int,int]]:
+        accesses = []
+        for (s,e) in cluster:
+            accesses.append((self.address_reg, self.base_address+s))
+            accesses.extend([(self.data_inc_reg, self.image[i]) for i in range(s,e)])
+            pass
+        return accesses
+    #f accesses_window
+    def accesses_window(self, cluster:List[Tuple[int,int]]) -> List[Tuple[int,int]]:
+        accesses = []
+        window = None
+        for (s,e) in cluster:
+            for i in range(s,e):
+                a = self.base_address + i
+                if (a // self.window_size)!=window:
+                    window = a // self.window_size
+                    accesses.append((self.address_reg, window*self.window_size))
+                    pass
+                accesses.append((self.data_window_reg + (a % self.window_size), self.image[i]))
+                pass
+            pass
+        return accesses
+    #f rom_code_of_accesses
+    def rom_code_of_accesses(self, accesses:List[Tuple[int,int]]) -> List[Tuple[int]]:
+        """
+        Generate ROM code for writes, using write_arg_inc (with an
+        increment of one) for writes to successive addresses
+        """
+        code = []
+        address = None
+        for (a,d) in accesses:
+            if a==self.data_inc_reg: # data_inc increments the SRAM address, not the APB address
+                if address!=a: code.append((Rom.op_set("address",a),))
+                code.append((Rom.op_req("write_arg",d),))
+                address = a
+                continue
+            if address!=a: code.append((Rom.op_set("address",a),))
+            code.append((Rom.op_req("write_arg_inc",d),))
+            address = a+1
+            pass
+        return code
+    #f rom_cycles
+    def rom_cycles(self, code:List[Tuple[int]]) -> int:
+        """
+        Cycles of straight-line ROM code with an increment of one
+        """
+        cycles = 0
+        address = None
+        for op_labels in code:
+            (opcode_class, subclass, arg) = Rom.decode_op(op_labels[0])
+            cycles += RomSim.fetch_cycles + RomSim.execute_cycles
+            if opcode_class==1 and subclass==0:
+                address = arg
+                pass
+            elif opcode_class==2:
+                cycles += RomSim.apb_cycles + self.pready_wait(address, 1)
+                if subclass & 4: address = address+1
+                pass
+            pass
+        return cycles
+    #f script_cycles
+    def script_cycles(self, script:List[Sequence[int]], clear:bool=True) -> int:
+        return ScriptAnalysis(self.pready_wait, self.inter_data_idle_cycles).analyze(script, clear=clear).best_cycles
+    #f plan
+    def plan(self, cost:Callable[[List[Tuple[int,int]]],int]) -> Tuple[List[Tuple[int,int]],List[Tuple[str,int,int]]]:
+        """
+        Choose the faster method for each cluster of changed words
+        using cost (of a list of accesses), returning the accesses and
+        the regions of the load
+        """
+        accesses : List[Tuple[int,int]] = []
+        regions : List[Tuple[str,int,int]] = []
+        for cluster in self.clusters(self.changed_runs()):
+            by_inc = self.accesses_inc(cluster)
+            by_window = self.accesses_window(cluster)
+            if cost(by_window)<cost(by_inc):
+                accesses.extend(by_window)
+                regions.extend([("window", s, e-s) for (s,e) in cluster])
+                pass
+            else:
+                accesses.extend(by_inc)
+                regions.extend([("inc", s, e-s) for (s,e) in cluster])
+                pass
+            pass
+        return (accesses, regions)
+    #f rom_program
+    def rom_program(self, label:str="sram_load") -> Dict[str,Any]:
+        """
+        Generate a program (for Rom.compile_program) that loads the
+        image from label and finishes; the report is left in self.report
+        """
+        (accesses, regions) = self.plan(lambda a:self.rom_cycles(self.rom_code_of_accesses(a)))
+        code = [(Rom.op_set("increment",1),)] + self.rom_code_of_accesses(accesses) + [(Rom.op_finish(),)]
+        code[0] = (code[0][0], [label+":"])
+        self.report = SramLoadReport(len(self.image), regions, self.rom_cycles(code))
+        return {"code":code}
+    #f script
+    def script(self, clear:bool=True) -> List[Sequence[int]]:
+        """
+        Generate a script (for Script.compile_script) that loads the
+        image, for a script master started with (or without) clear;
+        the report is left in self.report
+        """
+        def cost(accesses:List[Tuple[int,int]]) -> int:
+            return self.script_cycles(Script.script_of_accesses(accesses, clear=False), clear=False)
+        (accesses, regions) = self.plan(cost)
+        script = Script.script_of_accesses(accesses, clear=clear)
+        self.report = SramLoadReport(len(self.image), regions, self.script_cycles(script, clear=clear))
+        return script
+    pass
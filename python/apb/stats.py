@@ -0,0 +1,153 @@
+#a Copyright
+#
+#  This file 'stats.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+import csv
+import json
+from .address_map_index import AddressMapIndex
+from cdl.utils import csr
+from typing import Any, Dict, IO, List, Optional, Type, Union
+
+#a Classes
+#c ApbStats
+class ApbStats(object):
+    """
+    Statistics of the transfers of an ApbMaster (see
+    ApbMaster.record_stats): reads, writes, errors and wait cycles per
+    register, and a histogram of the pready wait cycles per target
+
+    The counters are kept per address as the transfers are recorded;
+    the addresses are resolved to registers and targets (the submaps of
+    the address map, such as 'sram') through an AddressMapIndex only
+    when the statistics are reported. Without an address map the
+    registers and targets are named by their address.
+    """
+    #f __init__
+    def __init__(self, apb_map:Optional[Union[csr.Map,Type[csr.Map]]]=None):
+        self.index = None if apb_map is None else AddressMapIndex(apb_map)
+        self.reset()
+        pass
+    #f reset
+    def reset(self) -> None:
+        # counts[address] = [reads, writes, errors, wait cycles, {wait cycles:transfers}]
+        self.counts : Dict[int,List[Any]] = {}
+        pass
+    #f record
+    def record(self, timestamp:int, write_not_read:int, address:int, data:int, err:int, wait_cycles:int) -> None:
+        c = self.counts.get(address, None)
+        if c is None:
+            c = [0, 0, 0, 0, {}]
+            self.counts[address] = c
+            pass
+        c[1 if write_not_read else 0] += 1
+        c[2] += err
+        c[3] += wait_cycles
+        c[4][wait_cycles] = c[4].get(wait_cycles,0) + 1
+        pass
+    #f names
+    def names(self, address:int) -> List[str]:
+        """
+        Return [register name, target name] of an address
+        """
+        if self.index is None: return ["0x%08x"%address]*2
+        d = self.index.decode(address)
+        if d is None: return ["0x%08x"%address]*2
+        return [d.path(), d.submap]
+    #f registers
+    def registers(self) -> Dict[str,Dict[str,Any]]:
+        """
+        Return the statistics per register, as dictionaries of reads,
+        writes, errors, wait_cycles and mean_wait_cycles
+        """
+        result : Dict[str,Dict[str,Any]] = {}
+        for (address, (reads, writes, errors, wait, histogram)) in sorted(self.counts.items()):
+            name = self.names(address)[0]
+            r = result.get(name, None)
+            if r is None:
+                r = {"reads":0, "writes":0, "errors":0, "wait_cycles":0}
+                result[name] = r
+                pass
+            r["reads"] += reads
+            r["writes"] += writes
+            r["errors"] += errors
+            r["wait_cycles"] += wait
+            pass
+        for r in result.values():
+            r["mean_wait_cycles"] = r["wait_cycles"] / max(1, r["reads"]+r["writes"])
+            pass
+        return result
+    #f wait_histograms
+    def wait_histograms(self) -> Dict[str,List[int]]:
+        """
+        Return the histogram of pready wait cycles per target, as a
+        list of the number of transfers with 0, 1, 2, ... wait cycles
+        """
+        result : Dict[str,List[int]] = {}
+        for (address, c) in self.counts.items():
+            target = self.names(address)[1]
+            h = result.setdefault(target, [])
+            for (wait, n) in c[4].items():
+                if wait>=len(h): h.extend([0]*(wait+1-len(h)))
+                h[wait] += n
+                pass
+            pass
+        return result
+    #f as_dict
+    def as_dict(self) -> Dict[str,Any]:
+        registers = self.registers()
+        return {"transfers":sum([r["reads"]+r["writes"] for r in registers.values()]),
+                "errors":sum([r["errors"] for r in registers.values()]),
+                "registers":registers,
+                "wait_histograms":self.wait_histograms(),
+                }
+    #f write_json
+    def write_json(self, f:Union[str,IO[str]]) -> None:
+        if type(f)==str:
+            with open(f,"w") as fh:
+                json.dump(self.as_dict(), fh, indent=1)
+                pass
+            return
+        json.dump(self.as_dict(), f, indent=1)
+        pass
+    #f write_csv
+    def write_csv(self, f:Union[str,IO[str]]) -> None:
+        """
+        Write the per-register statistics as CSV, one row per register
+        """
+        if type(f)==str:
+            with open(f,"w",newline="") as fh:
+                self.write_csv(fh)
+                pass
+            return
+        columns = ["reads", "writes", "errors", "wait_cycles", "mean_wait_cycles"]
+        w = csv.writer(f)
+        w.writerow(["register"]+columns)
+        for (name, r) in self.registers().items():
+            w.writerow([name]+[r[c] for c in columns])
+            pass
+        pass
+    #f report
+    def report(self) -> str:
+        r = ""
+        for (name, s) in self.registers().items():
+            r += "%-32s %6d reads %6d writes %4d errors %6d wait cycles\n"%(name, s["reads"], s["writes"], s["errors"], s["wait_cycles"])
+            pass
+        for (target, h) in self.wait_histograms().items():
+            r += "%-32s waits %s\n"%(target, " ".join(["%d:%d"%(w,n) for (w,n) in enumerate(h) if n>0]))
+            pass
+        return r
+    pass
@@ -14,6 +14,15 @@ t_apb_response = {
     "perr":1,
 }
 
+#t t_apb_logging_control
+t_apb_logging_control = {
+    "address_mask":32,
+    "address_match":32,
+    "writes_only":1,
+    "errors_only":1,
+    "sample_interval":16,
+}
+
 #t t_apb_processor_response
 t_apb_processor_response = {
     "acknowledge":1,
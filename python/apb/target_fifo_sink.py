@@ -1,16 +1,95 @@
 #a Imports
+from collections import deque
 from cdl.utils.csr   import Csr, CsrField, CsrFieldZero, Map, MapCsr
+from .models import ApbTargetModel, register_target_model
+from typing import Callable, Deque, List, Optional, Tuple
 
 #a CSRs
 class DataCsr(Csr):
     _fields = {0:  CsrField(width=32, name="value", brief="value", doc="SRAM memory contents"),
               }
 class ConfigStatusCsr(Csr):
-    _fields = {0:  CsrField(width=32, name="value", brief="value", doc="Configuration / status"),
+    _fields = {0:  CsrField(width=3, name="words_per_entry", brief="wpe", doc="Number of 32-bit words per FIFO entry, less one; writing this clears the status bits"),
+               3:  CsrFieldZero(width=1),
+               4:  CsrField(width=1, name="last_read_midentry", brief="mid", doc="Asserted if the last data read was *not* the last word of an entry"),
+               5:  CsrField(width=1, name="last_read_empty", brief="empty", doc="Asserted if the last data read was of an empty FIFO"),
+               6:  CsrField(width=1, name="sticky_read_empty", brief="sempty", doc="Asserted if a data read of an empty FIFO has happened since the configuration was written"),
+               7:  CsrFieldZero(width=25),
+              }
+class FifoStatusCsr(Csr):
+    _fields = {0:  CsrField(width=32, name="value", brief="value", doc="FIFO status, as presented by the FIFO to the FIFO sink"),
               }
 class FifoSinkAddressMap(Map):
     _map = [ MapCsr(reg=0,   name="config_status",  brief="cs",     csr=ConfigStatusCsr, doc="Config/Status"),
-             MapCsr(reg=1,   name="fifo_status", brief="status", csr=DataCsr, doc="Fifo Status"),
+             MapCsr(reg=1,   name="fifo_status", brief="status", csr=FifoStatusCsr, doc="Fifo Status"),
              MapCsr(reg=2,   name="fifo_data",   brief="data",   csr=DataCsr, doc="Data from the FIFO"),
              ]
-             
+
+#a Models
+#c FifoSinkModel
+class FifoSinkModel(ApbTargetModel):
+    """
+    Transaction-level model of apb_target_fifo_sink and its FIFO
+
+    Entries are pushed into the FIFO as lists of 32-bit words; the
+    FIFO data register reads a word at a time, with the
+    words-per-entry configuration determining where entries end.
+
+    The FIFO status value is generated by status_fn(entries), where
+    entries is the number of whole entries in the FIFO not yet started
+    to be read; by default this is just the number of entries.
+    """
+    entries:Deque[List[int]]
+    fifo_wait_cycles = 3
+    def __init__(self, status_fn:Optional[Callable[[int],int]]=None):
+        if status_fn is None: status_fn = lambda n:n
+        self.status_fn = status_fn
+        self.entries = deque()
+        self.current = []
+        self.words_per_entry = 0
+        self.last_read_empty = 0
+        self.last_read_midentry = 0
+        self.sticky_read_empty = 0
+        pass
+    #f push
+    def push(self, words:List[int]) -> None:
+        self.entries.append(list(words))
+        pass
+    #f config_status
+    def config_status(self) -> int:
+        return ( self.words_per_entry |
+                 (self.last_read_midentry<<4) |
+                 (self.last_read_empty<<5) |
+                 (self.sticky_read_empty<<6) )
+    #f read_data
+    def read_data(self) -> int:
+        if len(self.current)==0:
+            if len(self.entries)==0:
+                self.last_read_empty = 1
+                self.last_read_midentry = 0
+                self.sticky_read_empty = 1
+                return 0
+            self.current = self.entries.popleft()[:self.words_per_entry+1]
+            self.current.reverse()
+            pass
+        self.last_read_empty = 0
+        data = self.current.pop()
+        self.last_read_midentry = 1 if len(self.current)>0 else 0
+        return data
+    #f transaction
+    def transaction(self, cycle:int, write_not_read:int, address:int, data:int) -> Tuple[int,int,int]:
+        address = address & 0x7f
+        if address==0:
+            if write_not_read:
+                self.words_per_entry = data & 7
+                self.last_read_empty = 0
+                self.last_read_midentry = 0
+                self.sticky_read_empty = 0
+                return (0,0,0)
+            return (0,self.config_status(),0)
+        if write_not_read: return (0,0,0)
+        if address==1: return (0,self.status_fn(len(self.entries)),self.fifo_wait_cycles)
+        return (0,self.read_data(),self.fifo_wait_cycles)
+    pass
+
+register_target_model(FifoSinkAddressMap, FifoSinkModel)
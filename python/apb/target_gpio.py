@@ -17,6 +17,8 @@
 
 #a Imports
 from cdl.utils.csr   import Csr, CsrField, CsrFieldZero, Map, MapCsr
+from .models import ApbTargetModel, register_target_model
+from typing import Callable, List, Optional, Tuple
 
 #a CSRs
 class OutputReg(Csr):
@@ -50,3 +52,73 @@ class GpioAddressMap(Map):
              MapCsr(reg=2, name="input0", brief="inp0", csr=InputReg0, doc="Type of GPIO input events (for pins 0-7)"),
              MapCsr(reg=3, name="input1", brief="inp1", csr=InputReg1, doc="Type of GPIO input events (for pins 8-15)"),
              ]
+
+#a Models
+#c GpioModel
+class GpioModel(ApbTargetModel):
+    """
+    Transaction-level model of apb_target_gpio
+
+    The input pins are sampled when the target is accessed, from
+    input_fn(cycle) if it is provided or else from @a inputs (which
+    may be set directly); edge events are detected between successive
+    samples, level events reflect the current sample.
+    """
+    input_types:List[int]
+    def __init__(self, input_fn:Optional[Callable[[int],int]]=None):
+        self.input_fn = input_fn
+        self.inputs = 0
+        self.outputs = 0
+        self.input_types = [0]*16
+        self.value = 0
+        self.events = 0
+        pass
+    #f sample_inputs
+    def sample_inputs(self, cycle:int) -> None:
+        if self.input_fn is not None:
+            self.inputs = self.input_fn(cycle)
+            pass
+        last = self.value
+        value = self.inputs & 0xffff
+        events = self.events
+        for i in range(16):
+            t = self.input_types[i]
+            if t==0: continue
+            b = (value>>i)&1
+            lb = (last>>i)&1
+            if t==1:   e = 1-b
+            elif t==2: e = b
+            elif t==3: e = ((events>>i)&1) | (b & (1-lb))
+            elif t==4: e = ((events>>i)&1) | (lb & (1-b))
+            elif t==5: e = ((events>>i)&1) | (b ^ lb)
+            else: continue
+            events = (events & ~(1<<i)) | (e<<i)
+            pass
+        self.value = value
+        self.events = events
+        pass
+    #f transaction
+    def transaction(self, cycle:int, write_not_read:int, address:int, data:int) -> Tuple[int,int,int]:
+        self.sample_inputs(cycle)
+        address = address & 3
+        if write_not_read:
+            if address==0:
+                self.outputs = data & 0xffffffff
+                pass
+            elif address>=2:
+                i = data & 0xf
+                if (data>>8)&1: self.input_types[i] = (data>>12)&7
+                if (data>>9)&1: self.events &= ~(1<<i)
+                pass
+            return (0,0,0)
+        if address==0: return (0,self.outputs,0)
+        if address==1: return (0,(self.events<<16) | self.value,0)
+        read_data = 0
+        base = 8*(address-2)
+        for i in range(8):
+            read_data |= self.input_types[base+i] << (4*i)
+            pass
+        return (0,read_data,0)
+    pass
+
+register_target_model(GpioAddressMap, GpioModel)
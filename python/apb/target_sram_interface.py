@@ -16,7 +16,10 @@
 #
 
 #a Imports
+from array import array
 from cdl.utils.csr   import Csr, CsrField, CsrFieldZero, Map, MapCsr
+from .models import ApbTargetModel, register_target_model
+from typing import Tuple
 
 #a CSRs
 class DataCsr(Csr):
@@ -36,4 +39,52 @@ class SramInterfaceAddressMap(Map):
              MapCsr(reg=4,   name="data_inc",    brief="dinc", csr=DataCsr,    doc="Autoincrement data access - Address increments by one after each access; read/writing causes an SRAM access"),
              MapCsr(reg=128, name="data_window", brief="dwin", csr=DataCsr,    doc="Windowed access - bottom bits of register are used as bottom bits of SRAM address; reading/writing causes an SRAM access"),
              ]
-             
+
+#a Models
+#c SramInterfaceModel
+class SramInterfaceModel(ApbTargetModel):
+    """
+    Transaction-level model of apb_target_sram_interface with an
+    attached SRAM of 'size' 32-bit words (a power of two)
+
+    Data accesses cause an SRAM access, which holds pready low; reads
+    take two wait cycles and writes one, with an SRAM that
+    acknowledges immediately and returns read data on the next cycle
+    (as in the testbenches).
+    """
+    read_wait_cycles = 2
+    write_wait_cycles = 1
+    def __init__(self, size:int=1<<16):
+        self.size = size
+        self.memory = array("I", bytes(4*size))
+        self.address = 0
+        self.control = 0
+        pass
+    #f transaction
+    def transaction(self, cycle:int, write_not_read:int, address:int, data:int) -> Tuple[int,int,int]:
+        address = address & 0xff
+        if address & 0x80:
+            sram_address = (self.address & ~0x7f) | (address & 0x7f)
+            pass
+        elif address==0:
+            if write_not_read:
+                self.address = data & 0xffffffff
+                return (0,0,0)
+            return (0,self.address,0)
+        elif address==2:
+            if write_not_read:
+                self.control = data & 0xffffffff
+                return (0,0,0)
+            return (0,self.control,0)
+        else:
+            sram_address = self.address
+            if address!=1: self.address = (self.address+1) & 0xffffffff
+            pass
+        sram_address = sram_address & (self.size-1)
+        if write_not_read:
+            self.memory[sram_address] = data & 0xffffffff
+            return (0,0,self.write_wait_cycles)
+        return (0,self.memory[sram_address],self.read_wait_cycles)
+    pass
+
+register_target_model(SramInterfaceAddressMap, SramInterfaceModel)
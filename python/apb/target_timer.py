@@ -17,6 +17,8 @@
 
 #a Imports
 from cdl.utils.csr   import Csr, CsrField, CsrFieldZero, Map, MapCsr
+from .models import ApbTargetModel, register_target_model
+from typing import List, Tuple
 
 #a CSRs
 class TimerCsr(Csr):
@@ -34,4 +36,50 @@ class TimerAddressMap(Map):
              MapCsr(reg=5, name="comparator1", brief="cmp1", csr=TimerComparatorCsr, doc=""),
              MapCsr(reg=6, name="comparator2", brief="cmp2", csr=TimerComparatorCsr, doc=""),
              ]
-             
+
+#a Models
+#c TimerModel
+class TimerModel(ApbTargetModel):
+    """
+    Transaction-level model of apb_target_timer
+
+    The timer counts cycles from the start_cycle of the model; each
+    comparator records the cycle at which its equalled status was last
+    cleared (by a read or write), and the equalled status is
+    determined from whether the timer has reached the comparator since
+    then.
+    """
+    comparators:List[int]
+    cleared:List[int]
+    def __init__(self, start_cycle:int=0):
+        self.start_cycle = start_cycle
+        self.comparators = [0,0,0]
+        self.cleared = [start_cycle,start_cycle,start_cycle]
+        pass
+    #f timer_value
+    def timer_value(self, cycle:int) -> int:
+        return (cycle - self.start_cycle) & 0x7fffffff
+    #f equalled
+    def equalled(self, i:int, cycle:int) -> int:
+        cleared = self.cleared[i]
+        delta = (self.comparators[i] - self.timer_value(cleared)) & 0x7fffffff
+        if delta < cycle-cleared: return 1
+        return 0
+    #f transaction
+    def transaction(self, cycle:int, write_not_read:int, address:int, data:int) -> Tuple[int,int,int]:
+        address = address & 0xf
+        if address==0:
+            if write_not_read: return (0,0,0)
+            return (0, self.timer_value(cycle+1), 0)
+        if address not in (4,5,6): return (0,0,0)
+        i = address & 3
+        if write_not_read:
+            self.comparators[i] = data & 0x7fffffff
+            self.cleared[i] = cycle+1
+            return (0,0,0)
+        read_data = (self.equalled(i,cycle+1)<<31) | self.comparators[i]
+        self.cleared[i] = cycle+1
+        return (0,read_data,0)
+    pass
+
+register_target_model(TimerAddressMap, TimerModel)
@@ -0,0 +1,194 @@
+#a Copyright
+#
+#  This file 'trace_file.py' copyright Gavin J Stark 2020
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+#a Imports
+import mmap
+import struct
+from array import array
+from .log_parser import ApbTrace
+from typing import Any, IO, Iterator, Optional, Tuple, Union
+
+try:
+    import numpy
+    pass
+except ImportError:
+    numpy = None
+    pass
+
+#a Trace format
+# A trace file is a 16-byte header (magic, version, record size) followed
+# by fixed-size little-endian records of (timestamp, address, data,
+# flags, wait cycles), where flags has flag_write and flag_error bits
+trace_magic   = b"APBTRACE"
+trace_version = 1
+header_struct = struct.Struct("<8sII")
+record_struct = struct.Struct("<QIIII")
+flag_write = 1
+flag_error = 2
+if numpy is not None:
+    record_dtype = numpy.dtype([("timestamp","<u8"), ("address","<u4"), ("data","<u4"), ("flags","<u4"), ("wait_cycles","<u4")])
+    pass
+
+#a Classes
+#c TraceWriter
+class TraceWriter(object):
+    """
+    Writer of APB transfers to a binary trace file
+
+    Records are packed into a buffer of buffer_records records, which
+    is written out when full (and on flush or close).
+    """
+    #f __init__
+    def __init__(self, f:Union[str,IO[bytes]], buffer_records:int=4096):
+        self.owns_file = type(f)==str
+        self.f = open(f,"wb") if self.owns_file else f
+        self.f.write(header_struct.pack(trace_magic, trace_version, record_struct.size))
+        self.buffer = bytearray(record_struct.size*buffer_records)
+        self.offset = 0
+        self.records = 0
+        pass
+    #f record
+    def record(self, timestamp:int, write_not_read:int, address:int, data:int, err:int=0, wait_cycles:int=0) -> None:
+        record_struct.pack_into(self.buffer, self.offset,
+                                timestamp, address & 0xffffffff, data & 0xffffffff,
+                                (flag_write if write_not_read else 0) | (flag_error if err else 0),
+                                wait_cycles)
+        self.offset += record_struct.size
+        self.records += 1
+        if self.offset==len(self.buffer): self.flush()
+        pass
+    #f write_trace
+    def write_trace(self, trace:ApbTrace) -> None:
+        """
+        Write all the transfers of an ApbTrace (such as one parsed from
+        an apb_logging text log), with no wait cycles
+        """
+        self.flush()
+        n = len(trace)
+        if numpy is not None:
+            records = numpy.zeros(n, dtype=record_dtype)
+            records["timestamp"] = trace.cycle
+            records["address"] = trace.address
+            records["data"] = trace.data
+            records["flags"] = trace.rw
+            self.f.write(records.tobytes())
+            pass
+        else:
+            for i in range(n):
+                self.f.write(record_struct.pack(trace.cycle[i], trace.address[i], trace.data[i], trace.rw[i], 0))
+                pass
+            pass
+        self.records += n
+        pass
+    #f flush
+    def flush(self) -> None:
+        if self.offset>0:
+            self.f.write(memoryview(self.buffer)[:self.offset])
+            self.offset = 0
+            pass
+        self.f.flush()
+        pass
+    #f close
+    def close(self) -> None:
+        self.flush()
+        if self.owns_file: self.f.close()
+        pass
+    def __enter__(self) -> 'TraceWriter':
+        return self
+    def __exit__(self, *args:Any) -> None:
+        self.close()
+        pass
+    pass
+
+#c TraceReader
+class TraceReader(object):
+    """
+    Memory-mapped reader of a binary trace file
+
+    records is a numpy structured array (of record_dtype) directly on
+    the mapping if numpy is available, so no record is parsed until it
+    is used; without numpy, iterating the reader unpacks the records
+    in turn.
+
+    Arrays taken from records (and iterators of the reader) remain
+    valid after close: the file is then unmapped when the last of them
+    is released. The columns of trace() are copies of the records.
+    """
+    #f __init__
+    def __init__(self, filename:str):
+        with open(filename,"rb") as f:
+            header = f.read(header_struct.size)
+            if len(header)<header_struct.size: raise Exception("Trace file '%s' is too short"%filename)
+            (magic, version, record_size) = header_struct.unpack(header)
+            if (magic!=trace_magic) or (version!=trace_version) or (record_size!=record_struct.size):
+                raise Exception("Trace file '%s' is not a version %d APB trace"%(filename, trace_version))
+            f.seek(0,2)
+            size = f.tell()
+            self.mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            pass
+        self.num_records = (size - header_struct.size) // record_struct.size
+        self.records = None
+        if numpy is not None:
+            self.records = numpy.frombuffer(self.mapping, dtype=record_dtype, count=self.num_records, offset=header_struct.size)
+            pass
+        pass
+    def __len__(self) -> int:
+        return self.num_records
+    #f __iter__
+    def __iter__(self) -> Iterator[Tuple[int,int,int,int,int]]:
+        """
+        Iterate over the (timestamp, address, data, flags, wait cycles) of the records
+        """
+        view = memoryview(self.mapping)[header_struct.size:header_struct.size+self.num_records*record_struct.size]
+        return record_struct.iter_unpack(view)
+    #f trace
+    def trace(self) -> ApbTrace:
+        """
+        Return the trace as an ApbTrace (for its register counts,
+        bandwidth and latency summaries)
+        """
+        if numpy is not None:
+            r = self.records
+            return ApbTrace(numpy.array(r["timestamp"]),
+                            ((r["flags"] & flag_write)!=0).astype(numpy.uint8),
+                            numpy.array(r["address"]),
+                            numpy.array(r["data"]))
+        (cycle, rw, address, data) = (array("Q"), array("B"), array("I"), array("I"))
+        for (t, a, d, flags, w) in self:
+            cycle.append(t)
+            rw.append(flags & flag_write)
+            address.append(a)
+            data.append(d)
+            pass
+        return ApbTrace(cycle, rw, address, data)
+    #f close
+    def close(self) -> None:
+        """
+        Release the mapping of the file; if a caller still holds an
+        array of the records (or an iterator) the mapping cannot be
+        closed yet, and is closed when the last of those is released
+        """
+        self.records = None
+        if self.mapping is None: return
+        try:
+            self.mapping.close()
+            pass
+        except BufferError:
+            pass
+        self.mapping = None
+        pass
+    pass
@@ -3,7 +3,7 @@ from apb import Rom
 
 #a Toplevel
 if __name__ == "__main__":
-    import argparse, sys, re
+    import argparse, sys
     parser = argparse.ArgumentParser(description='Generate MIF or READMEMH files for APB processor ROM')
     parser.add_argument('--src', type=str, default=None,
                     help='Source for APB script')
@@ -11,36 +11,52 @@ if __name__ == "__main__":
                     help='Output MIF filename')
     parser.add_argument('--mem', type=str, default=None,
                     help='Output READMEMH filename')
+    parser.add_argument('--bin', type=str, default=None,
+                    help='Output packed binary filename (5 bytes per word)')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                    help='Directory for a cache of compilations')
+    parser.add_argument('--cache-size', type=int, default=64,
+                    help='Maximum size of the compilation cache in MB')
+    parser.add_argument('--batch', type=str, default=None,
+                    help='JSON manifest of (src, define, mif, mem, bin) entries to compile in parallel')
+    parser.add_argument('--jobs', type=int, default=None,
+                    help='Number of processes for batch mode (default is the number of CPUs)')
     parser.add_argument('--define', type=str, action='append', default=[],
                     help='Defines for the ROM program')
     args = parser.parse_args()
     show_usage = False
-    if args.src is None:
+    if (args.src is None) and (args.batch is None):
         show_usage = True
         pass
     if show_usage:
         parser.print_help()
         sys.exit(0)
         pass
-    defines = {}
-    dre = re.compile(r"(.*)=(.*)")
-    for d in args.define:
-        m = dre.match(d)
-        if m is None:
-            defines[d] = True
-            pass
-        else:
-            defines[m.group(1)] = m.group(2)
-            pass
-        pass
-    import importlib
-    m = importlib.import_module(args.src)
-    program = m.program(Rom, defines)
-    compilation = Rom.compile_program(program)
+    if args.batch is not None:
+        from apb.batch import run_batch
+        results = run_batch(args.batch, jobs=args.jobs, cache_dir=args.cache_dir, cache_size=args.cache_size)
+        sys.exit(1 if any(["error" in r for r in results]) else 0)
+        pass
+    from apb.batch import parse_defines
+    defines = parse_defines(args.define)
+    if args.cache_dir is not None:
+        from apb.compile_cache import CompileCache
+        cache = CompileCache(args.cache_dir, max_bytes=args.cache_size*1024*1024)
+        compilation = cache.compile_module(args.src, defines)
+        pass
+    else:
+        import importlib
+        m = importlib.import_module(args.src)
+        program = m.program(Rom, defines)
+        compilation = Rom.compile_program(program)
+        pass
     if args.mif is not None:
         Rom.mif_of_compilation(compilation, filename=args.mif)
         pass
     if args.mem is not None:
         Rom.mem_of_compilation(compilation, filename=args.mem)
         pass
+    if args.bin is not None:
+        Rom.bin_of_compilation(compilation, filename=args.bin)
+        pass
     pass
@@ -1,7 +1,10 @@
 #a Imports
+from array import array
 from regress.utils import t_dprintf_req_4, t_dprintf_byte, Dprintf, DprintfBus, FifoStatus
 from regress.apb.structs import t_apb_request, t_apb_response
 from regress.apb.bfm     import ApbMaster
+from regress.apb.fifo_sink_drain import FifoSinkDrainer
+from regress.apb.profiler import HarnessProfiler
 from cdl.sim     import ThExecFile
 from cdl.sim     import HardwareThDut
 from cdl.sim     import TestCase
@@ -35,9 +38,8 @@ class TestBase(ThExecFile):
         self.dprintf.invalid()
         pass
 
-    #f run
-    def run(self) -> None:
-
+    #f run_start
+    def run_start(self) -> None:
         self.apb = ApbMaster(self, "apb_request",  "apb_response")
         self.apb_map = ApbAddressMap()
         self.fifo_sink_map    = self.apb_map.fifo_sink
@@ -47,6 +49,20 @@ class TestBase(ThExecFile):
         self.fifo_status   = self.apb.reg(self.fifo_sink_map.fifo_status)
         self.fifo_data     = self.apb.reg(self.fifo_sink_map.fifo_data)
         self.bfm_wait(10)
+        pass
+
+    #f run
+    def run(self) -> None:
+        with HarnessProfiler(self) as profiler:
+            self.run_start()
+            self.run_fifo()
+            pass
+        self.verbose.info(profiler.report())
+        self.passtest("Test succeeded")
+        pass
+
+    #f run_fifo
+    def run_fifo(self) -> None:
 
         self.config_status.write(0xff) # 8 words per entr
         cs = self.config_status.read()
@@ -140,14 +156,109 @@ class TestBase(ThExecFile):
         self.compare_expected("data",x,0x65666768)
         cs = self.config_status.read()&0xf0
         self.compare_expected("Cs should have mid-entry set and sticky empty set",cs,0x50)
-
-        self.passtest("Test succeeded")
         pass
 
 #c ApbTest0
 class ApbTest0(TestBase):
     pass
 
+#c ApbDrainTest
+class ApbDrainTest(TestBase):
+    #f run
+    def run(self) -> None:
+        self.run_start()
+        status_entries = {FifoStatus(515,n).as_csr32():n for n in range(516)}
+        drainer = FifoSinkDrainer(self.apb, self.fifo_sink_map, entries_of_status=status_entries.__getitem__)
+        drainer.configure(3)
+        self.compare_expected("Drainer words per entry",drainer.words_per_entry,3)
+        for i in range(4):
+            self.drive_dprintf_req(Dprintf(0x0, b"abcdefghijklmnop"))
+            pass
+        self.bfm_wait(20)
+        fs = self.fifo_status.read()
+        self.compare_expected("Fifo status 4 entries",fs,FifoStatus(515,4).as_csr32())
+        # Three words per entry hold the first 64-bit dprintf data word and the low half of the second
+        messages = list(drainer.dprintf_messages(max_batch=3))
+        self.compare_expected("Drained dprintf messages",messages,[b"abcdefgh"]*4)
+        self.compare_expected("Entries drained",drainer.entries_drained,4)
+        fs = self.fifo_status.read()
+        self.compare_expected("Fifo status empty after drain",fs,FifoStatus(515,0).as_csr32())
+        frame = array("I", [0x65666768, 0x61626364, 0x6d6e6f70, 0x696a6b6c, 0, 0, 0, 0])
+        self.compare_expected("Eight word dprintf payload",FifoSinkDrainer.dprintf_payload(frame),b"abcdefghijklmnop")
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ProfilerTest
+class ProfilerTest(ThExecFile):
+    """
+    Check the per-call-site accounting of HarnessProfiler using a fake
+    harness whose bfm_wait just counts cycles
+    """
+    th_name = "Harness profiler test"
+    #c FakeTh
+    class FakeTh(object):
+        def __init__(self):
+            self.cycles = 0
+            pass
+        def bfm_wait(self, cycles):
+            self.cycles += cycles
+            pass
+        pass
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        th = self.FakeTh()
+        th_bfm_wait = th.bfm_wait
+        with HarnessProfiler(th) as profiler:
+            self.compare_expected("Profiler installed",th.bfm_wait==th_bfm_wait,False)
+            for i in range(3):
+                th.bfm_wait(4)
+                pass
+            th.bfm_wait(7)
+            pass
+        self.compare_expected("Profiler uninstalled",th.bfm_wait==th_bfm_wait,True)
+        self.compare_expected("Cycles waited through profiler",th.cycles,19)
+        th.bfm_wait(100)
+        profile = profiler.profile()
+        self.compare_expected("Profiled sites",len(profile),2)
+        self.compare_expected("Sites in this file",[n.split(":")[0] for n in profile],["test_fifo_sink.py"]*2)
+        self.compare_expected("Site waits and cycles",sorted([(p["waits"],p["cycles"]) for p in profile.values()]),[(1,7),(3,12)])
+        summary = profiler.summary()
+        self.compare_expected("Total waits",summary["waits"],4)
+        self.compare_expected("Total cycles",summary["cycles"],19)
+        self.compare_expected("Python and simulation within wall time",summary["python_seconds"]+summary["sim_seconds"]<=summary["wall_seconds"],True)
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbProfilerTest
+class ApbProfilerTest(TestBase):
+    """
+    Check that HarnessProfiler attributes the waits of ApbMaster
+    transfers to the lines of the test that made them
+    """
+    #f run
+    def run(self) -> None:
+        self.run_start()
+        start = self.global_cycle()
+        with HarnessProfiler(self) as profiler:
+            for i in range(4):
+                self.config_status.write(2)
+                pass
+            self.fifo_status.read()
+            pass
+        cycles = self.global_cycle() - start
+        profile = profiler.profile()
+        self.verbose.info(profiler.report())
+        self.compare_expected("Profiled sites",len(profile),2)
+        self.compare_expected("Sites in the test",[n.split(":")[0] for n in profile],["test_fifo_sink.py"]*2)
+        self.compare_expected("Sites in run",[n.split(" ")[-1] for n in profile],["(run)"]*2)
+        self.compare_expected("Cycles profiled",profiler.summary()["cycles"],cycles)
+        self.passtest("Test succeeded")
+        pass
+    pass
+
 #c ApbHardware
 class ApbHardware(HardwareThDut):
     clock_desc = [("clk",(0,1,1))]
@@ -165,6 +276,9 @@ class ApbHardware(HardwareThDut):
 class TestApbFifoSink(TestCase):
     hw = ApbHardware
     _tests = {"0": (ApbTest0, 5*1000, {"verbosity":0}),
+              "drain": (ApbDrainTest, 5*1000, {"verbosity":0}),
+              "profiler": (ProfilerTest, 5*1000, {"verbosity":0}),
+              "profiler_apb": (ApbProfilerTest, 5*1000, {"verbosity":0}),
               "smoke": (ApbTest0, 5*1000, {"verbosity":0}),
               }
     pass
@@ -16,9 +16,14 @@
 #
 
 #a Imports
+import io
 import tempfile
 from regress.apb.structs import t_apb_processor_request, t_apb_processor_response
 from regress.apb.rom     import Rom
+from regress.apb.rom_sim import RomSim
+from regress.apb.rom_analysis import RomAnalysis
+from regress.apb.models  import ApbTargetBus, ApbMemoryModel
+from regress.apb.address_map_index import AddressMapIndex
 from cdl.sim     import ThExecFile
 from cdl.sim     import HardwareThDut
 from cdl.sim     import TestCase
@@ -106,6 +111,7 @@ class ProcessorTestBase(ThExecFile):
         (Rom.op_finish(),),
         ]
     programs_to_run = [ "prog_timer_comparator" ]
+    optimize = False
     #f invoke_program
     def invoke_program(self, address):
         self.compare_expected("acknowledge should start low",
@@ -127,7 +133,10 @@ class ProcessorTestBase(ThExecFile):
         self.bfm_wait(2)
         self.tempfile = self.hardware.tempfile
         self.sim_msg = self.sim_message()
-        compiled_program = Rom.compile_program(self.program)
+        compiled_program = Rom.compile_program(self.program, optimize=self.optimize)
+        if self.optimize:
+            self.verbose.info("Optimized program: %s"%str(compiled_program.optimization))
+            pass
         self.memory = Memory(bit_width=40)
         compiled_program.add_to_memory(self.memory, bytes_per_word=5)
         self.tempfile.seek(0)
@@ -158,6 +167,257 @@ class ProcessorTest0(ProcessorTestBase):
     ]
     pass
 
+#c ProcessorOptimizedTest
+class ProcessorOptimizedTest(ProcessorTest0):
+    optimize = True
+    pass
+
+#c ProcessorModelTest
+class ProcessorModelTest(ProcessorTest0):
+    """
+    Run the programs in the ROM simulator on the target models, wired
+    as in tb_apb_processor (the GPIO inputs are the SRAM control bits
+    shifted up by three)
+    """
+    #f pready_wait
+    def pready_wait(self, address, write_not_read):
+        """
+        Wait cycles for the static analysis - SRAM data accesses only
+        """
+        if (address is None) or ((address>>28)!=2): return 0
+        if (address & 0xff) in [0, 2]: return 0
+        return 1 if write_not_read else 2
+    def run(self) -> None:
+        bus = ApbTargetBus.of_map(self.apb)
+        sram = bus.model("sram")
+        bus.model("gpio").input_fn = lambda cycle:(sram.control<<3) & 0xfff8
+        compiled_program = Rom.compile_program(self.program, optimize=self.optimize)
+        rom_sim = RomSim(compiled_program, bus)
+        rom_analysis = RomAnalysis(compiled_program, pready_wait=self.pready_wait)
+        index = AddressMapIndex(self.apb)
+        self.compare_expected("Decode of SRAM window",index.name(self.apb.sram.data_window.Address()+5),"sram.data_window+5")
+        self.compare_expected("Decode of timer comparator fields",
+                              index.decode(self.apb.timer.comparator0.Address()).decode_value(0x80000005),
+                              {"comparator":5, "equalled":1})
+        for l in self.programs_to_run:
+            result = rom_sim.run(l, max_cycles=10*1000)
+            self.verbose.info("Program %s %s"%(l,str(result)))
+            self.compare_expected("Program %s should finish"%l, result.status, "finished")
+            analysis = rom_analysis.analyze(l)
+            self.verbose.info("Analysis %s"%(str(analysis)))
+            if (analysis.best_cycles is None) or (result.cycles<analysis.best_cycles) or (result.cycles>analysis.worst_cycles):
+                self.failtest("Program %s took %d cycles, outside analysis %s"%(l, result.cycles, str(analysis)))
+                pass
+            pass
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ProcessorOptimizedModelTest
+class ProcessorOptimizedModelTest(ProcessorModelTest):
+    optimize = True
+    pass
+
+#c RomOptimizerTest
+class RomOptimizerTest(ThExecFile):
+    """
+    Checks of each pass of the ROM program optimizer: a small program
+    for each is optimized to an expected program, and both are run in
+    the ROM simulator on a memory model with the same results; the
+    hardware is not used
+    """
+    th_name = "APB processor optimizer harness"
+    #v optimizations - (name, program code, optimized code, report)
+    optimizations = []
+    optimizations.append(("unreachable", [
+        (Rom.op_set("address",0x10),["start:"]),
+        (Rom.op_req("write_arg",1),),
+        (Rom.op_branch("branch",0),["done"]),
+        (Rom.op_req("write_arg",2),),
+        (Rom.op_alu("add",1),),
+        (Rom.op_req("write_arg",3),["done:"]),
+        (Rom.op_finish(),),
+        (Rom.op_req("write_arg",4),),
+        ], [
+        (Rom.op_set("address",0x10),["start:"]),
+        (Rom.op_req("write_arg",1),),
+        (Rom.op_branch("branch",0),["done"]),
+        (Rom.op_req("write_arg",3),["done:"]),
+        (Rom.op_finish(),),
+        ], {"unreachable":3}))
+    optimizations.append(("set_address", [
+        (Rom.op_set("address",0x10),["start:"]),
+        (Rom.op_req("write_arg",1),),
+        (Rom.op_alu("add",1),),
+        (Rom.op_set("address",0x10),),
+        (Rom.op_req("write_acc",0),),
+        (Rom.op_set("increment",4),),
+        (Rom.op_req("write_arg_inc",2),),
+        (Rom.op_set("address",0x14),),
+        (Rom.op_req("write_arg",3),),
+        (Rom.op_set("address",0x20),["again:"]),
+        (Rom.op_req("read",0),),
+        (Rom.op_set("address",0x20),),
+        (Rom.op_req("write_arg",5),),
+        (Rom.op_finish(),),
+        ], [
+        (Rom.op_set("address",0x10),["start:"]),
+        (Rom.op_req("write_arg",1),),
+        (Rom.op_alu("add",1),),
+        (Rom.op_req("write_acc",0),),
+        (Rom.op_set("increment",4),),
+        (Rom.op_req("write_arg_inc",2),),
+        (Rom.op_req("write_arg",3),),
+        (Rom.op_set("address",0x20),["again:"]),
+        (Rom.op_req("read",0),),
+        (Rom.op_req("write_arg",5),),
+        (Rom.op_finish(),),
+        ], {"set_address":3}))
+    optimizations.append(("alu_folded", [
+        (Rom.op_set("address",0x10),["start:"]),
+        (Rom.op_set("accumulator",5),),
+        (Rom.op_alu("add",3),),
+        (Rom.op_alu("add",4),),
+        (Rom.op_alu("xor",1),),
+        (Rom.op_alu("or",0x100),),
+        (Rom.op_req("write_acc_inc",0),),
+        (Rom.op_req("read",0),),
+        (Rom.op_alu("bic",1),),
+        (Rom.op_alu("bic",6),),
+        (Rom.op_alu("and",0xff),),
+        (Rom.op_alu("and",0xf0f),),
+        (Rom.op_req("write_acc",0),),
+        (Rom.op_finish(),),
+        ], [
+        (Rom.op_set("address",0x10),["start:"]),
+        (Rom.op_set("accumulator",0x10d),),
+        (Rom.op_req("write_acc_inc",0),),
+        (Rom.op_req("read",0),),
+        (Rom.op_alu("bic",7),),
+        (Rom.op_alu("and",0xf),),
+        (Rom.op_req("write_acc",0),),
+        (Rom.op_finish(),),
+        ], {"alu_folded":6}))
+    optimizations.append(("repeats", [
+        (Rom.op_set("address",0x10),["start:"]),
+        (Rom.op_set("increment",1),),
+        ] + [(Rom.op_req("write_arg_inc",7),)]*6 + [
+        (Rom.op_req("read",0),),
+        (Rom.op_finish(),),
+        ], [
+        (Rom.op_set("address",0x10),["start:"]),
+        (Rom.op_set("increment",1),),
+        (Rom.op_set("repeat",5),),
+        (Rom.op_req("write_arg_inc",7),["__repeat_0:"]),
+        (Rom.op_branch("loop",0),["__repeat_0"]),
+        (Rom.op_req("read",0),),
+        (Rom.op_finish(),),
+        ], {"repeats":3}))
+    #f run_program
+    def run_program(self, compiled):
+        memory = ApbMemoryModel()
+        rom_sim = RomSim(compiled, memory)
+        result = rom_sim.run("start", max_cycles=10*1000)
+        return (result.status, result.apb_reads, result.apb_writes, rom_sim.accumulator, memory.contents)
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        for (name, code, optimized_code, report) in self.optimizations:
+            compiled = Rom.compile_program({"code":code})
+            optimized = Rom.compile_program({"code":code}, optimize=True)
+            expected = Rom.compile_program({"code":optimized_code})
+            self.verbose.info("Optimized %s: %s"%(name, str(optimized.optimization)))
+            self.compare_expected("Optimized image of %s"%name,list(optimized.image),list(expected.image))
+            for (k,v) in report.items():
+                self.compare_expected("Optimization report %s of %s"%(k,name),optimized.optimization[k],v)
+                pass
+            self.compare_expected("Words saved by %s"%name,optimized.optimization["words_saved"],len(code)-len(optimized_code))
+            result = self.run_program(compiled)
+            self.compare_expected("Program %s should finish"%name,result[0],"finished")
+            self.compare_expected("Optimized program %s results"%name,self.run_program(optimized),result)
+            pass
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c RomAnalysisTest
+class RomAnalysisTest(ThExecFile):
+    """
+    Check the ROM analysis of programs with sequential polling loops:
+    each poll adds the same best and worst case cycles, and the
+    analysis stays within a small number of states; the hardware is
+    not used
+    """
+    th_name = "APB processor analysis harness"
+    poll_bound = 16
+    #f polls_program
+    def polls_program(self, num_polls):
+        program = {"code":[(Rom.op_set("address",0x10),["start:"])]}
+        for i in range(num_polls):
+            program["code"] += [(Rom.op_set("address",0x10+i),),
+                                (Rom.op_req("read",0),["poll_%d:"%i]),
+                                (Rom.op_alu("and",1),),
+                                (Rom.op_branch("beq",0),["poll_%d"%i]),
+                                ]
+            pass
+        program["code"].append((Rom.op_finish(),))
+        return program
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        cycles = []
+        for num_polls in range(9):
+            compiled = Rom.compile_program(self.polls_program(num_polls))
+            analysis = RomAnalysis(compiled, poll_bound=self.poll_bound, max_states=5000).analyze("start")
+            self.verbose.info("Analysis of %d polls %s"%(num_polls, str(analysis)))
+            self.compare_expected("Reads of %d polls"%num_polls,analysis.reads,num_polls*(self.poll_bound+1))
+            memory = ApbMemoryModel()
+            for i in range(num_polls): memory.contents[0x10+i] = 1
+            result = RomSim(compiled, memory).run("start", max_cycles=10*1000)
+            self.compare_expected("Simulation of %d polls that pass at once"%num_polls,result.cycles,analysis.best_cycles)
+            cycles.append((analysis.best_cycles, analysis.worst_cycles))
+            pass
+        (best_poll, worst_poll) = (cycles[1][0]-cycles[0][0], cycles[1][1]-cycles[0][1])
+        for i in range(1, len(cycles)):
+            self.compare_expected("Cycles added by poll %d"%i,(cycles[i][0]-cycles[i-1][0], cycles[i][1]-cycles[i-1][1]),(best_poll, worst_poll))
+            pass
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c RomFileTest
+class RomFileTest(ThExecFile):
+    """
+    Check that the streaming MIF and READMEMH writers of Rom produce
+    the same files as the Memory that the harness loads the ROM from,
+    and that the packed binary image reads back; the hardware is not
+    used
+    """
+    th_name = "APB processor ROM file harness"
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        for optimize in [False, True]:
+            compiled = Rom.compile_program(ProcessorTestBase.program, optimize=optimize)
+            memory = Memory(bit_width=40)
+            compiled.add_to_memory(memory, bytes_per_word=5)
+            for (kind, write_memory, write_rom) in [("MIF",       memory.write_mif, Rom.write_mif),
+                                                    ("READMEMH",  memory.write_mem, Rom.write_mem)]:
+                (memory_file, rom_file) = (io.StringIO(), io.StringIO())
+                write_memory(memory_file)
+                write_rom(compiled, rom_file, chunk_words=7)
+                self.compare_expected("%s file of program (optimize %s)"%(kind, str(optimize)),rom_file.getvalue(),memory_file.getvalue())
+                pass
+            with tempfile.NamedTemporaryFile(suffix=".bin") as f:
+                Rom.write_bin(compiled, f, chunk_words=7)
+                f.flush()
+                self.compare_expected("Binary image of program (optimize %s)"%str(optimize),list(Rom.image_of_bin(f.name)),list(compiled.image))
+                pass
+            pass
+        self.passtest("Test succeeded")
+        pass
+    pass
+
 #c ApbProcessorHardware
 class ApbProcessorHardware(HardwareThDut):
     clock_desc = [("clk",(0,1,1))]
@@ -182,6 +442,12 @@ class ApbProcessorHardware(HardwareThDut):
 class TestApbProcessor(TestCase):
     hw = ApbProcessorHardware
     _tests = {"smoke": (ProcessorTest0, 100*1000, {"verbosity":0}),
+              "optimized": (ProcessorOptimizedTest, 100*1000, {"verbosity":0}),
+              "model": (ProcessorModelTest, 100*1000, {"verbosity":0}),
+              "model_optimized": (ProcessorOptimizedModelTest, 100*1000, {"verbosity":0}),
+              "optimizer": (RomOptimizerTest, 10*1000, {"verbosity":0}),
+              "rom_files": (RomFileTest, 10*1000, {"verbosity":0}),
+              "analysis": (RomAnalysisTest, 10*1000, {"verbosity":0}),
               }
     pass
 
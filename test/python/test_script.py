@@ -20,7 +20,13 @@ from random import Random
 from regress.utils import t_dbg_master_request, t_dbg_master_op
 from regress.utils import t_dbg_master_response, t_dbg_master_resp_type
 from regress.utils import DbgMaster
-from regress.apb import Script
+from regress.apb import Script, ScriptSim, SramLoader
+from regress.apb.models import ApbTargetBus, ApbTargetModel, ApbMemoryModel
+from regress.apb.log_parser import ApbLogParser
+from regress.apb.script import CompiledScript
+from regress.apb.script_analysis import ScriptAnalysis
+from regress.apb.structs import t_apb_logging_control
+from regress.apb.logging_control import ApbLoggingControl
 from cdl.sim     import ThExecFile
 from cdl.sim     import HardwareThDut
 from cdl.sim     import TestCase
@@ -48,6 +54,7 @@ class ScriptMasterTestBase(ThExecFile):
     random_seed = "some tx random seed"
     #v program
     defines = {"nothing":"value"}
+    optimize = False
     scripts = {}
     scripts["none"] = ([],"ok",[])
     scripts["gpio_rw"] = ([
@@ -102,17 +109,47 @@ class ScriptMasterTestBase(ThExecFile):
                 (-1,4),
                 (-1,0x1234567),
                 ])
+    scripts["sram_accesses"] = (Script.script_of_accesses([
+        (apb.sram.address, 0),
+        (apb.sram.data_inc, 0x1234567),
+        (apb.sram.data_inc, 0x2345678),
+        (apb.sram.data_inc, 0x12),
+        (apb.sram.address, 0),
+        ("read", apb.sram.data_inc),
+        ("read", apb.sram.data_inc),
+        ("read", apb.sram.data_inc, 8),
+        (apb.gpio.output, 0x1234),
+        ("read", apb.gpio.output, 16),
+        ]),"ok",[(-1,0x1234567), (-1,0x2345678), (0xff,0x12), (0xffff,0x1234)])
+    sram_image = [0x1234567, 0x2345678, 0, 0, 0x12, 0, 0, 0, 0, 0, 0x3456789] + [0]*200 + [0x456789a]
+    scripts["sram_load"] = (SramLoader(apb.sram, sram_image, base_address=0x40).script() +
+                            Script.script_of_accesses([
+        (apb.sram.address, 0x40),
+        ("read", apb.sram.data_inc),
+        ("read", apb.sram.data_inc),
+        (apb.sram.address, 0x4a),
+        ("read", apb.sram.data_inc),
+        (apb.sram.address, 0x40+211),
+        ("read", apb.sram.data_inc),
+        ], clear=False),"ok",[(-1,0x1234567), (-1,0x2345678), (-1,0x3456789), (-1,0x456789a)])
     scripts_to_run = list(scripts.keys())
-    #f invoke_script
-    def invoke_script(self, script_name):
-        script_to_run = self.compiled_scripts[script_name]
-        bytes_to_run = bytearray(script_to_run[0].as_bytes())
-
-        (completion, data_returned) = self.dbg_master.invoke_script_bytes(
+    #f invoke_script_bytes
+    def invoke_script_bytes(self, bytes_to_run):
+        return self.dbg_master.invoke_script_bytes(
             bytes_to_run,
             self.bfm_wait,
             self.inter_data_idle_cycles,
             1000)
+    #f invoke_compiled_script
+    def invoke_compiled_script(self, compiled):
+        # DbgMaster takes the whole script as a bytearray of its own, so
+        # only the model tests feed the script lazily as beats
+        return self.invoke_script_bytes(bytearray(compiled.as_memoryview()))
+    #f invoke_script
+    def invoke_script(self, script_name):
+        script_to_run = self.compiled_scripts[script_name]
+
+        (completion, data_returned) = self.invoke_compiled_script(script_to_run[0])
 
         if completion != script_to_run[1]:
             self.failtest("Completion that occured (%s) was not what was expected (%s)"%(completion, script_to_run[1]))
@@ -135,19 +172,26 @@ class ScriptMasterTestBase(ThExecFile):
     #f inter_data_idle_cycles
     def inter_data_idle_cycles(self) -> int:
         return 0
+    #f logging_control
+    def logging_control(self) -> ApbLoggingControl:
+        return ApbScriptMasterHardware.logging_control
     #f run_init
     def run__init(self) -> None:
         self.random = Random()
         self.random.seed(self.random_seed)
         self.bfm_wait(2)
         self.dbg_master = DbgMaster(self, "dbg_master_req", "dbg_master_resp")
+        self.logging_control().drive(self, "apb_logging_control")
         self.compiled_scripts = {}
         for (n,s) in self.scripts.items():
             self.verbose.info("Compile script %s"%n)
             self.compiled_scripts[n] = (
-                Script.compile_script(s[0]),
+                Script.compile_script(s[0], optimize=self.optimize),
                 s[1],
                 s[2])
+            if self.optimize:
+                self.verbose.info("Optimized script %s: %s"%(n, str(self.compiled_scripts[n][0].optimization)))
+                pass
             pass
         pass
     def run(self) -> None:
@@ -166,6 +210,8 @@ class ScriptMasterTest0(ScriptMasterTestBase):
                         "sram",
                         "sram_gpio",
                         "sram_long",
+                        "sram_accesses",
+                        "sram_load",
                         "none",
     ]
     pass
@@ -180,6 +226,8 @@ class ScriptMasterTest1(ScriptMasterTestBase):
                         "sram",
                         "sram_gpio",
                         "sram_long",
+                        "sram_accesses",
+                        "sram_load",
                         "none",
     ]
     pass
@@ -194,26 +242,317 @@ class ScriptMasterTest2(ScriptMasterTestBase):
                         "sram",
                         "sram_gpio",
                         "sram_long",
+                        "sram_accesses",
+                        "sram_load",
                         "none",
     ]
     pass
 
+#c ScriptMasterOptimizedTest
+class ScriptMasterOptimizedTest(ScriptMasterTest2):
+    optimize = True
+    pass
+
+#c ScriptMasterModelTest
+class ScriptMasterModelTest(ScriptMasterTest2):
+    """
+    Run the scripts in the script executor on the target models, wired
+    as in tb_apb_script_master
+    """
+    #f pready_wait
+    def pready_wait(self, address, write_not_read):
+        """
+        Wait cycles for the static analysis - SRAM data accesses only
+        """
+        if (address is None) or ((address>>28)!=2): return 0
+        if (address & 0xff) in [0, 2]: return 0
+        return 1 if write_not_read else 2
+    #f invoke_compiled_script
+    def invoke_compiled_script(self, compiled):
+        result = self.script_sim.invoke_script_beats(compiled.beats(), self.inter_data_idle_cycles, 1000)
+        self.verbose.info("Script took %d cycles (%d APB)"%(self.script_sim.cycles, self.script_sim.apb_cycles))
+        best = ScriptAnalysis(self.pready_wait, inter_data_idle_cycles=0).analyze(compiled)
+        worst = ScriptAnalysis(self.pready_wait, inter_data_idle_cycles=9).analyze(compiled)
+        if (self.script_sim.cycles<best.best_cycles) or (self.script_sim.cycles>worst.worst_cycles):
+            self.failtest("Script took %d cycles, outside analysis of %d to %d"%(self.script_sim.cycles, best.best_cycles, worst.worst_cycles))
+            pass
+        return result
+    #f run_init
+    def run__init(self) -> None:
+        super(ScriptMasterModelTest,self).run__init()
+        bus = ApbTargetBus.of_map(self.apb)
+        sram = bus.model("sram")
+        bus.model("gpio").input_fn = lambda cycle:((sram.control<<3) & 0xfff8)
+        self.script_sim = ScriptSim(bus)
+        pass
+    pass
+
+#c ScriptMasterOptimizedModelTest
+class ScriptMasterOptimizedModelTest(ScriptMasterModelTest):
+    optimize = True
+    pass
+
+#c ApbTransferRecorder
+class ApbTransferRecorder(ApbTargetModel):
+    """
+    Target model that records the (write_not_read, address, data, err)
+    of every transfer to another target model
+    """
+    def __init__(self, target:ApbTargetModel):
+        self.target = target
+        self.transfers = []
+        pass
+    def transaction(self, cycle, write_not_read, address, data):
+        (err, read_data, wait_cycles) = self.target.transaction(cycle, write_not_read, address, data)
+        self.transfers.append((write_not_read, address, data if write_not_read else read_data, err))
+        return (err, read_data, wait_cycles)
+    pass
+
+#c ScriptMasterLoggingTest
+class ScriptMasterLoggingTest(ScriptMasterTestBase):
+    """
+    Run scripts with the apb_logging_filtered filter of
+    ApbScriptMasterLoggingHardware, and check that the transfers
+    logged are those that the filter passes of the transfers of the
+    same scripts on the target models
+    """
+    scripts_to_run = [  "gpio_rw",
+                        "sram",
+                        "sram_gpio",
+                        "sram_accesses",
+    ]
+    #f logging_control
+    def logging_control(self) -> ApbLoggingControl:
+        return ApbScriptMasterLoggingHardware.logging_control
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        bus = ApbTargetBus.of_map(self.apb)
+        sram = bus.model("sram")
+        bus.model("gpio").input_fn = lambda cycle:((sram.control<<3) & 0xfff8)
+        recorder = ApbTransferRecorder(bus)
+        script_sim = ScriptSim(recorder)
+        for l in self.scripts_to_run:
+            self.verbose.info("Run script %s"%l)
+            self.invoke_script(l)
+            script_sim.invoke_script_beats(self.compiled_scripts[l][0].beats(), 0, 1000)
+            pass
+        self.bfm_wait(10)
+        # apb_logging_filtered events are written to the log file as they occur
+        trace = ApbLogParser.parse(ApbScriptMasterLoggingHardware.log_filename)
+        logged = [(int(w), int(a), int(d)) for (w,a,d) in zip(trace.rw, trace.address, trace.data)]
+        expected = [(w,a,d) for (w,a,d,e) in self.logging_control().logged(recorder.transfers)]
+        sram_transfers = [t for t in recorder.transfers if (t[1]>>28)==2]
+        self.compare_expected("One in two SRAM transfers logged",len(expected),(len(sram_transfers)+1)//2)
+        self.compare_expected("Logged transfers",logged,expected)
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbLoggingControlTest
+class ApbLoggingControlTest(ThExecFile):
+    """
+    Check the validation of logging filter configurations; the
+    hardware is not used
+    """
+    th_name = "APB logging control harness"
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        for (config, valid) in [({}, True),
+                                ({"window":(0x20000000,0x10000000)}, True),
+                                ({"window":(0x20000000,0)}, False),
+                                ({"window":(0,0)}, False),
+                                ({"window":(0x20000000,0x30000000)}, False),
+                                ({"window":(0x28000000,0x10000000)}, False),
+                                ({"sample":0xffff}, True),
+                                ({"sample":0x10000}, False),
+                                ({"sample":-1}, False),
+                                ]:
+            try:
+                ApbLoggingControl(config)
+                accepted = True
+                pass
+            except Exception:
+                accepted = False
+                pass
+            self.compare_expected("Logging control %s accepted"%str(config),accepted,valid)
+            pass
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbLogParserTest
+class ApbLogParserTest(ThExecFile):
+    """
+    Check the parsing of apb_logging log lines, including loggers
+    whose hierarchy names contain digits; the hardware is not used
+    """
+    th_name = "APB log parser harness"
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        lines = ["0: dut.apb_log: APB write address 20000000 data 00000000",
+                 "1234: dut.apb_log2: APB write address 20000004 data 12345678",
+                 "  1240: dut.apb_log: APB read address 20000004 data 12345678",
+                 "1250:dut2.apb_log3:APB read:address:10000000:data:0000abcd",
+                 "1260 tb_apb_script_master_2.dut.apb_log: APB write address=0x10000004, data=0x00000001",
+                 "1270: dut.apb_log2: APB error address 20000000",
+                 "dut3.apb_log: APB read address 20000008 data 00000042",
+                 ]
+        parser = ApbLogParser()
+        parser.parse_lines(lines)
+        trace = parser.trace()
+        self.compare_expected("Lines skipped", parser.lines_skipped, 1)
+        self.compare_expected("Cycles", [int(c) for c in trace.cycle], [0, 1234, 1240, 1250, 1260, 5])
+        self.compare_expected("Read/write", [int(rw) for rw in trace.rw], [1, 1, 0, 0, 1, 0])
+        self.compare_expected("Addresses", [int(a) for a in trace.address], [0x20000000, 0x20000004, 0x20000004, 0x10000000, 0x10000004, 0x20000008])
+        self.compare_expected("Data", [int(d) for d in trace.data], [0, 0x12345678, 0x12345678, 0xabcd, 1, 0x42])
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbTargetBusTest
+class ApbTargetBusTest(ThExecFile):
+    """
+    Check the decode of the target models bus built from the address
+    map; the hardware is not used
+    """
+    th_name = "APB target bus harness"
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        apb = ApbAddressMap()
+        bus = ApbTargetBus.of_map(apb)
+        for (address, err) in [(apb.timer.comparator2.Address(), 0),
+                               (apb.timer.timer.Address()+8, 1),
+                               (apb.gpio.input1.Address(), 0),
+                               (apb.gpio.input1.Address()+1, 1),
+                               (apb.sram.data_window.Address()+0x7f, 0),
+                               (apb.sram.data_window.Address()+0x80, 1),
+                               (0x30000000, 1),
+                               (0xffffffff, 1),
+                               ]:
+            self.compare_expected("Error response of read of 0x%08x"%address,bus.transaction(0, 0, address, 0)[0],err)
+            pass
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ScriptCompilerTest
+class ScriptCompilerTest(ThExecFile):
+    """
+    Checks of the script compiler on the script executor, with a
+    memory model target; the hardware is not used
+    """
+    th_name = "APB script_master compiler harness"
+    #f run_memory
+    def run_memory(self, script_bytes, page=0):
+        """
+        Run script bytes in the script executor, starting at a page,
+        and return the memory contents
+        """
+        memory = ApbMemoryModel()
+        sim = ScriptSim(memory)
+        start = bytes(Script.op_set("addr1",page) + Script.op_set("addr2",page>>8) + Script.op_set("addr3",page>>16))
+        (completion, data) = sim.invoke_script_bytes(start + bytes(script_bytes))
+        self.compare_expected("Script completion",completion,"ok")
+        return memory.contents
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+
+        for page in [0, 0x1ff, 0xffff]:
+            compiled = CompiledScript()
+            compiled.add_op_write(0xfc, 32, list(range(1,17)), inc=True, page=page)
+            contents = self.run_memory(compiled.as_bytes(), page)
+            expected = {(page<<8)+0xfc+i:i+1 for i in range(16)}
+            self.compare_expected("Incrementing write across a page from page 0x%x"%page,contents,expected)
+            pass
+        compiled = CompiledScript()
+        compiled.add_op_write(0xf0, 8, list(range(1,17)), inc=True)
+        contents = self.run_memory(compiled.as_bytes(), 0x12)
+        self.compare_expected("Incrementing write to the end of a page",contents,{0x12f0+i:i+1 for i in range(16)})
+        compiled = CompiledScript()
+        compiled.add_op_write(0xfc, 16, list(range(1,17)))
+        contents = self.run_memory(compiled.as_bytes(), 0x12)
+        self.compare_expected("Repeated write",contents,{0x12fc:16})
+        self.compare_expected("Write ops of no data and too much data",[Script.op_write(4,32,[]), Script.op_write(4,32,[0]*9)],[bytearray(), bytearray()])
+        self.compare_expected("Write op of data",type(Script.op_write(4,32,[1])),bytearray)
+        script = bytes(Script.op_write(4,32,[1,2])) + bytes(Script.op_read(4,32))
+        for n in [1, 3, 6, 9, len(script)-1]:
+            (completion, data) = ScriptSim(ApbMemoryModel()).invoke_script_bytes(script[:n])
+            self.compare_expected("Completion of script truncated to %d bytes"%n,completion,"errored")
+            (completion, data) = ScriptSim(ApbMemoryModel()).invoke_script_beats(Script.beats([script[:n]]))
+            self.compare_expected("Completion of script beats truncated to %d bytes"%n,completion,"errored")
+            pass
+        (completion, data) = ScriptSim(ApbMemoryModel()).invoke_script_bytes(script)
+        self.compare_expected("Completion of whole script",(completion, data),("ok", [2]))
+        scripts = {"writes":[Script.op_write(i,32,[i]) for i in range(8)],
+                   "reads":[Script.op_read(i,32) for i in range(8)],
+                   "sets":[Script.op_set("addr1",0) for i in range(8)] + [Script.op_write(0,8,[1])],
+                   "mixed":[Script.op_set("addr1",1), Script.op_write(4,16,[1]),
+                            Script.op_set("addr1",1), Script.op_write(5,16,[2]),
+                            Script.op_read(4,16), Script.op_read(4,16), Script.op_poll_set(4,0)],
+                   }
+        for (name, script) in scripts.items():
+            for idle in [0, 5]:
+                (optimized, report) = Script.optimize_script(script, inter_data_idle_cycles=idle)
+                cycles = []
+                for s in [script, optimized]:
+                    sim = ScriptSim(ApbMemoryModel())
+                    sim.invoke_script_bytes(b"".join([bytes(op) for op in s]), idle)
+                    cycles.append(sim.cycles)
+                    pass
+                self.compare_expected("Cycles saved by optimizing %s with %d idle"%(name, idle),report["cycles_saved"],cycles[0]-cycles[1])
+                self.compare_expected("Cycles after optimizing %s with %d idle"%(name, idle),report["cycles_after"],cycles[1])
+                pass
+            pass
+        (optimized, report) = Script.optimize_script(scripts["writes"])
+        self.compare_expected("Merged writes",len(optimized),1)
+        self.compare_expected("Merged writes save no cycles",report["cycles_saved"],0)
+
+        try:
+            CompiledScript().add_op_write(0xfc, 32, list(range(1,17)), inc=True)
+            self.failtest("Incrementing write across a page without the page should raise an exception")
+            pass
+        except Exception as e:
+            if "crosses a 256-address page" not in str(e): raise
+            pass
+
+        self.passtest("Test succeeded")
+        pass
+    pass
+
 #c ApbScriptMasterHardware
 class ApbScriptMasterHardware(HardwareThDut):
     clock_desc = [("clk",(0,1,1))]
     reset_desc = {"name":"reset_n", "init_value":0, "wait":5}
     module_name = "tb_apb_script_master"
     dut_inputs  = {"dbg_master_req":t_dbg_master_request,
+                   "apb_logging_control":t_apb_logging_control,
     }
     dut_outputs = {"dbg_master_resp":t_dbg_master_response,
                    "timer_equalled":3
     }
-    loggers = { # "apb":{"modules":"dut dut.apb_log", "verbose":1},
-                # "apb":{"modules":"dut.apb_log", "verbose":1},
-                }
-    def __init__(self, **kwargs):
-        super(ApbScriptMasterHardware,self).__init__(**kwargs)
-        pass
+    # The 'filter' of a logger is removed here, once, and driven by the test harness as the logging control
+    (loggers, logging_control) = ApbLoggingControl.of_loggers({
+        # "apb":{"modules":"dut dut.apb_log", "verbose":1},
+        # "apb":{"modules":"dut.apb_log", "verbose":1},
+        # "apb":{"modules":"dut.apb_log", "verbose":1, "filter":{"window":(0x20000000,0x10000000), "sample":4}},
+        })
+    pass
+
+#c ApbScriptMasterLoggingHardware
+class ApbScriptMasterLoggingHardware(ApbScriptMasterHardware):
+    """
+    Hardware that logs the SRAM transfers, sampled one in two, to a file
+    """
+    log_filename = "apb_script_master_logging.log"
+    (loggers, logging_control) = ApbLoggingControl.of_loggers({
+        "apb":{"modules":"dut.apb_log", "verbose":0, "filename":log_filename,
+               "filter":{"window":(0x20000000,0x10000000), "sample":2}},
+        })
     pass
 
 #c TestApbScriptMaster
@@ -223,6 +562,20 @@ class TestApbScriptMaster(TestCase):
               "slow": (ScriptMasterTest1, 100*1000, {"verbosity":0}),
               "random": (ScriptMasterTest2, 100*1000, {"verbosity":0}),
               "smoke": (ScriptMasterTest2, 100*1000, {"verbosity":0}),
+              "optimized": (ScriptMasterOptimizedTest, 100*1000, {"verbosity":0}),
+              "model": (ScriptMasterModelTest, 100*1000, {"verbosity":0}),
+              "model_optimized": (ScriptMasterOptimizedModelTest, 100*1000, {"verbosity":0}),
+              "compiler": (ScriptCompilerTest, 10*1000, {"verbosity":0}),
+              "bus": (ApbTargetBusTest, 10*1000, {"verbosity":0}),
+              "logging_control": (ApbLoggingControlTest, 10*1000, {"verbosity":0}),
+              "log_parser": (ApbLogParserTest, 10*1000, {"verbosity":0}),
+              }
+    pass
+
+#c TestApbScriptMasterLogging
+class TestApbScriptMasterLogging(TestCase):
+    hw = ApbScriptMasterLoggingHardware
+    _tests = {"logging_filter": (ScriptMasterLoggingTest, 100*1000, {"verbosity":0}),
               }
     pass
 
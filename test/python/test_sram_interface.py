@@ -1,6 +1,12 @@
 #a Imports
+import tempfile
+from array import array
 from regress.apb.structs import t_apb_request, t_apb_response
-from regress.apb.bfm     import ApbMaster
+from regress.apb.bfm     import ApbMaster, ApbModelMaster
+from regress.apb.models  import ApbTargetBus
+from regress.apb.sram_access import SramAccess, mismatch_ranges
+from regress.apb.trace_file import TraceWriter, TraceReader, flag_write
+from regress.apb.stats import ApbStats
 from cdl.sim     import ThExecFile
 from cdl.sim     import HardwareThDut
 from cdl.sim     import TestCase
@@ -24,9 +30,8 @@ class ApbAddressMap(csr.Map):
 class TestBase(ThExecFile):
     th_name = "APB Sram Interface harness"
     inter_delay = 1 # Minimum 1
-    #f run
-    def run(self) -> None:
-
+    #f run_start
+    def run_start(self) -> None:
         self.apb = ApbMaster(self, "apb_request",  "apb_response")
         self.apb_map = ApbAddressMap()
         self.sram_map    = self.apb_map.sram_interface
@@ -36,6 +41,26 @@ class TestBase(ThExecFile):
         self.data = self.apb.reg(self.sram_map.data)
         self.data_inc = self.apb.reg(self.sram_map.data_inc)
         self.bfm_wait(10)
+        pass
+    #f queue_block
+    def queue_block(self, address:int, block:array) -> None:
+        """
+        Queue writes of a block to SRAM at address through data_inc,
+        then reads of it back
+        """
+        self.apb.queue_write(self.sram_map.address.Address(), address)
+        for d in block:
+            self.apb.queue_write(self.sram_map.data_inc.Address(), d)
+            pass
+        self.apb.queue_write(self.sram_map.address.Address(), address)
+        for d in block:
+            self.apb.queue_read(self.sram_map.data_inc.Address())
+            pass
+        pass
+    #f run
+    def run(self) -> None:
+
+        self.run_start()
 
         for d in [0x12345678, 0xdeadbeef, 0xf00dcafe]:
             self.control.write(d)
@@ -67,7 +92,7 @@ class TestBase(ThExecFile):
             self.compare_expected("Data read back for %d"%i,x,d)
             self.bfm_wait(self.inter_delay)
             pass
-        
+
         self.passtest("Test succeeded")
         pass
 
@@ -81,6 +106,194 @@ class ApbTest1(TestBase):
     inter_delay = 3
     pass
 
+#c ApbBlockTest
+class ApbBlockTest(TestBase):
+    #f run
+    def run(self) -> None:
+        self.run_start()
+        block = array("I", [(0xdeadbeef*i+0xf00dcafe) & 0xffffffff for i in range(64)])
+        self.address.write(0x100)
+        self.apb.write_block(self.sram_map.data_inc.Address(), block, stride=0)
+        self.address.write(0x100)
+        x = self.apb.read_block(self.sram_map.data_inc.Address(), len(block), stride=0)
+        self.compare_expected("Block read back",list(x),list(block))
+        self.compare_expected("Address after block read",self.address.read(),0x100+len(block))
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbQueueTest
+class ApbQueueTest(TestBase):
+    #f run
+    def run(self) -> None:
+        self.run_start()
+        block = array("I", [(0xdeadbeef*i+0xf00dcafe) & 0xffffffff for i in range(8)])
+        start = self.global_cycle()
+        self.address.write(0x200)
+        for d in block:
+            self.data_inc.write(d)
+            pass
+        self.address.write(0x200)
+        for d in block:
+            self.data_inc.read()
+            pass
+        single_cycles = self.global_cycle() - start
+
+        self.apb.reset_bandwidth()
+        start = self.global_cycle()
+        self.queue_block(0x200, block)
+        results = self.apb.flush()
+        queued_cycles = self.global_cycle() - start
+        self.compare_expected("Queued read back",[rd for (err,rd) in results[10:]],list(block))
+        bandwidth = self.apb.bandwidth()
+        self.compare_expected("Queued transfers",bandwidth["transfers"],18)
+        self.compare_expected("Queued bus cycles",bandwidth["cycles"],queued_cycles)
+        self.compare_expected("Queued cycles match single transfers",queued_cycles,single_cycles)
+        self.compare_expected("Cycles of transfers and wait cycles",queued_cycles,2*18+bandwidth["wait_cycles"])
+        self.verbose.info(self.apb.bandwidth_report())
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbSramAccessTest
+class ApbSramAccessTest(TestBase):
+    #f run
+    def run(self) -> None:
+        self.run_start()
+        sram = SramAccess(self.apb, self.sram_map)
+        image = array("I", [(0x1234567*i+0xcafe) & 0xffffffff for i in range(64)])
+        sram.load(0x400, image)
+        self.compare_expected("Loaded image verifies",sram.verify(0x400, image),[])
+        self.address.write(0x405)
+        self.data_inc.write(2)
+        self.data_inc.write(3)
+        self.address.write(0x43c)
+        self.data.write(0)
+        ranges = sram.verify(0x400, image)
+        self.verbose.info(sram.mismatch_report(ranges))
+        self.compare_expected("Mismatch ranges",ranges,[(0x405,0x407),(0x43c,0x43d)])
+        evens = array("I", image[::2])
+        self.compare_expected("Strided buffer matches",mismatch_ranges(memoryview(image)[::2], evens),[])
+        evens[3] ^= 1
+        self.compare_expected("Strided buffer mismatches",mismatch_ranges(memoryview(image)[::2], evens),[(3,4)])
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbTraceTest
+class ApbTraceTest(TestBase):
+    #f run
+    def run(self) -> None:
+        self.run_start()
+        block = array("I", [(0xdeadbeef*i+0xf00dcafe) & 0xffffffff for i in range(8)])
+        with tempfile.NamedTemporaryFile(suffix=".apbtrace") as trace_file:
+            with TraceWriter(trace_file.name) as trace_writer:
+                self.apb.record_trace(trace_writer)
+                self.queue_block(0x200, block)
+                self.apb.flush()
+                self.apb.record_trace(None)
+                pass
+            trace = TraceReader(trace_file.name)
+            self.compare_expected("Traced transfers",len(trace),18)
+            self.compare_expected("Traced read data",[d for (t,a,d,f,w) in trace][10:],list(block))
+            self.compare_expected("Traced writes",len([f for (t,a,d,f,w) in trace if f & flag_write]),10)
+            trace.close()
+            pass
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbTraceCloseTest
+class ApbTraceCloseTest(TestBase):
+    """
+    Check that the records and trace of a TraceReader remain valid
+    after it is closed; the hardware is not used
+    """
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        transfers = [(100+3*i, i&1, 0x1000+4*i, (0xdeadbeef*i) & 0xffffffff) for i in range(16)]
+        with tempfile.NamedTemporaryFile(suffix=".apbtrace") as trace_file:
+            with TraceWriter(trace_file.name) as trace_writer:
+                for (t,w,a,d) in transfers:
+                    trace_writer.record(t, w, a, d)
+                    pass
+                pass
+            reader = TraceReader(trace_file.name)
+            records = reader.records
+            records_iter = iter(reader)
+            trace = reader.trace()
+            reader.close()
+            reader.close()
+            if records is not None:
+                self.compare_expected("Records after close",[int(a) for a in records["address"]],[a for (t,w,a,d) in transfers])
+                pass
+            self.compare_expected("Iterated records after close",[(t,a,d) for (t,a,d,f,w) in records_iter],[(t,a,d) for (t,w,a,d) in transfers])
+            self.compare_expected("Trace after close",[(int(t),int(w),int(a),int(d)) for (t,w,a,d) in zip(trace.cycle, trace.rw, trace.address, trace.data)],transfers)
+            del records
+            del records_iter
+            pass
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbStatsTest
+class ApbStatsTest(TestBase):
+    #f run
+    def run(self) -> None:
+        self.run_start()
+        block = array("I", [(0xdeadbeef*i+0xf00dcafe) & 0xffffffff for i in range(8)])
+        stats = ApbStats(self.apb_map)
+        self.apb.record_stats(stats)
+        self.queue_block(0x200, block)
+        self.apb.flush()
+        self.apb.record_stats(None)
+        registers = stats.registers()
+        self.compare_expected("Stats data_inc writes",registers["sram_interface.data_inc"]["writes"],8)
+        self.compare_expected("Stats data_inc reads",registers["sram_interface.data_inc"]["reads"],8)
+        self.compare_expected("Stats address writes",registers["sram_interface.address"]["writes"],2)
+        self.compare_expected("Stats wait histogram transfers",sum(stats.wait_histograms()["sram_interface"]),18)
+        self.verbose.info(stats.report())
+        self.passtest("Test succeeded")
+        pass
+    pass
+
+#c ApbModelRecordTest
+class ApbModelRecordTest(TestBase):
+    """
+    Check that block transfers of an ApbModelMaster are recorded with
+    the timestamp given to record_trace
+    """
+    #c TransferList
+    class TransferList(object):
+        def __init__(self):
+            self.transfers = []
+            pass
+        def record(self, timestamp, write_not_read, address, data, err, wait_cycles):
+            self.transfers.append((timestamp, write_not_read, address, data))
+            pass
+        pass
+    #f run
+    def run(self) -> None:
+        self.bfm_wait(10)
+        apb = ApbModelMaster(self, ApbTargetBus.of_map(ApbAddressMap))
+        sram_map = ApbAddressMap().sram_interface
+        block = array("I", [(0xdeadbeef*i+0xf00dcafe) & 0xffffffff for i in range(8)])
+        transfers = self.TransferList()
+        timestamps = iter(range(1000, 2000))
+        apb.record_trace(transfers, timestamp=lambda : next(timestamps))
+        apb.write(sram_map.address.Address(), 0x200)
+        apb.write_block(sram_map.data_inc.Address(), block, stride=0)
+        apb.write(sram_map.address.Address(), 0x200)
+        read_back = apb.read_block(sram_map.data_inc.Address(), len(block), stride=0)
+        apb.record_trace(None)
+        self.compare_expected("Model read back",list(read_back),list(block))
+        self.compare_expected("Recorded timestamps",[t for (t,w,a,d) in transfers.transfers],list(range(1000, 1018)))
+        self.compare_expected("Recorded block data",[d for (t,w,a,d) in transfers.transfers][10:],list(block))
+        self.passtest("Test succeeded")
+        pass
+    pass
+
 #c ApbHardware
 class ApbHardware(HardwareThDut):
     clock_desc = [("clk",(0,1,1))]
@@ -98,6 +311,13 @@ class TestApbSramInterface(TestCase):
     hw = ApbHardware
     _tests = {"0": (ApbTest0, 5*1000, {"verbosity":0}),
               "1": (ApbTest1, 5*1000, {"verbosity":0}),
+              "block": (ApbBlockTest, 5*1000, {"verbosity":0}),
+              "queue": (ApbQueueTest, 5*1000, {"verbosity":0}),
+              "sram_access": (ApbSramAccessTest, 5*1000, {"verbosity":0}),
+              "trace": (ApbTraceTest, 5*1000, {"verbosity":0}),
+              "trace_close": (ApbTraceCloseTest, 5*1000, {"verbosity":0}),
+              "stats": (ApbStatsTest, 5*1000, {"verbosity":0}),
+              "model_record": (ApbModelRecordTest, 5*1000, {"verbosity":0}),
               "smoke": (ApbTest0, 5*1000, {"verbosity":0}),
               }
     pass
@@ -17,7 +17,8 @@
 
 #a Imports
 from regress.apb.structs import t_apb_request, t_apb_response
-from regress.apb.bfm     import ApbMaster
+from regress.apb.bfm     import ApbMaster, ApbModelMaster
+from regress.apb.models  import ApbTargetBus
 from cdl.sim     import ThExecFile
 from cdl.sim     import HardwareThDut
 from cdl.sim     import TestCase
@@ -38,8 +39,12 @@ class ApbAddressMap(csr.Map):
 #c apb_timer_thef
 class apb_timer_thef(ThExecFile):
     th_name = "APB timer test harness"
+    #f apb_master
+    def apb_master(self):
+        return ApbMaster(self, "signal__apb_request",  "signal__apb_response")
+    #f run
     def run(self) -> None:
-        self.apb = ApbMaster(self, "signal__apb_request",  "signal__apb_response")
+        self.apb = self.apb_master()
         self.apb_map = ApbAddressMap()
         self.timer_map  = self.apb_map.timer # This is an ApbAddressMap()
         self.timer      = self.apb.reg(self.timer_map.timer)
@@ -74,6 +79,17 @@ class apb_timer_thef(ThExecFile):
         self.passtest("Test succeeded")
         pass
 
+#c apb_timer_model_thef
+class apb_timer_model_thef(apb_timer_thef):
+    """
+    Run the same test on the transaction-level timer model
+    """
+    th_name = "APB timer model test harness"
+    #f apb_master
+    def apb_master(self):
+        return ApbModelMaster(self, ApbTargetBus.of_map(ApbAddressMap))
+    pass
+
 #c ApbTimerHardware
 class ApbTimerHardware(HardwareThDut):
     clock_desc = [("clk",(0,1,1))]
@@ -92,6 +108,7 @@ class ApbTimerHardware(HardwareThDut):
 class TestApbTimer(TestCase):
     hw = ApbTimerHardware
     _tests = {"smoke": (apb_timer_thef, 5*1000, {"verbosity":0}),
+              "model": (apb_timer_model_thef, 5*1000, {"verbosity":0}),
               }
     pass
 